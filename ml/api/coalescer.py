@@ -0,0 +1,128 @@
+"""
+============================================================
+api/coalescer.py — Micro-batching for /api/recommend
+============================================================
+
+Under load, many small /recommend calls (20-50 candidates each) land
+within a few milliseconds of each other. Each one pays the full
+predict_proba overhead for a tiny matrix.
+
+The coalescer sits in front of the model: each request builds its own
+feature matrix, then parks it here. The queue is flushed when either
+  - max_wait_ms has passed since the first queued request, or
+  - the queued rows reach max_batch
+and the flush runs ONE prediction over the stacked matrices. Every
+caller gets back exactly its own slice of scores.
+
+Opt-in: set ML_COALESCE_WINDOW_MS > 0 (and optionally
+ML_COALESCE_MAX_BATCH) to enable it in routes.py.
+
+All queue bookkeeping happens on the event loop thread; only the
+prediction itself runs on the scoring pool.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+from api.executor import run_scoring
+
+
+class RecommendCoalescer:
+    def __init__(self, score_fn, max_wait_ms=5.0, max_batch=2048):
+        self.score_fn = score_fn          # (n, F) matrix → (n,) scores
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch        # rows, not requests
+
+        self._pending = []                # [(X, future, enqueued_at)]
+        self._pending_rows = 0
+        self._timer = None
+        self._tasks = set()               # in-flight flushes (the loop only keeps weak refs)
+
+        # Metrics
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.max_batch_rows = 0
+        self.flush_on_size = 0
+        self.flush_on_timeout = 0
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+
+    async def score(self, X):
+        """Queue one request's feature matrix; resolves to its scores."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((X, future, time.perf_counter()))
+        self._pending_rows += len(X)
+
+        if self._pending_rows >= self.max_batch:
+            self.flush_on_size += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._on_timeout)
+
+        return await future
+
+    def _on_timeout(self):
+        self._timer = None
+        if self._pending:
+            self.flush_on_timeout += 1
+            self._flush()
+
+    def _flush(self):
+        """Hand the current queue to a prediction task and start a new one."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_rows = self._pending, [], 0
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        started = time.perf_counter()
+        sizes = [len(X) for X, _, _ in batch]
+        total = sum(sizes)
+
+        self.batches += 1
+        self.requests += len(batch)
+        self.rows += total
+        self.max_batch_rows = max(self.max_batch_rows, total)
+        for _, _, enqueued_at in batch:
+            delay = started - enqueued_at
+            self.queue_delay_total += delay
+            self.queue_delay_max = max(self.queue_delay_max, delay)
+
+        try:
+            stacked = np.concatenate([X for X, _, _ in batch])
+            scores = await run_scoring(self.score_fn, stacked)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offsets = np.cumsum([0] + sizes)
+        for (_, future, _), start, end in zip(batch, offsets[:-1], offsets[1:]):
+            # A caller may have been cancelled (client went away)
+            if not future.done():
+                future.set_result(scores[start:end])
+
+    def stats(self):
+        """Batch-size and queueing-delay metrics."""
+        return {
+            'max_wait_ms': self.max_wait * 1000.0,
+            'max_batch': self.max_batch,
+            'batches': self.batches,
+            'requests': self.requests,
+            'rows': self.rows,
+            'avg_batch_requests': round(self.requests / self.batches, 2) if self.batches else 0.0,
+            'avg_batch_rows': round(self.rows / self.batches, 2) if self.batches else 0.0,
+            'max_batch_rows': self.max_batch_rows,
+            'flush_on_size': self.flush_on_size,
+            'flush_on_timeout': self.flush_on_timeout,
+            'avg_queue_delay_ms': round(self.queue_delay_total / self.requests * 1000.0, 3) if self.requests else 0.0,
+            'max_queue_delay_ms': round(self.queue_delay_max * 1000.0, 3),
+        }
@@ -0,0 +1,75 @@
+"""
+============================================================
+api/executor.py — Keep CPU-bound work off the asyncio loop
+============================================================
+
+Every route is `async def`, but scoring (feature extraction +
+LightGBM inference) and state persistence are synchronous. Run inline,
+one large /recommend stalls every concurrent /feedback and /health.
+
+Two pools:
+  - scoring pool: ML_SCORING_THREADS threads (default: CPU count).
+    NumPy and LightGBM's C API release the GIL while they work, so
+    concurrent requests actually use multiple cores. Each LightGBM
+    call is pinned to ML_LGBM_THREADS OpenMP threads (default 1) so
+    N request threads don't each spawn N OpenMP threads.
+  - state pool: ONE thread. Bandit updates, profile updates and their
+    JSON writes run here in arrival order — mutations are serialized
+    without holding up the scoring threads.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SCORING_THREADS = int(os.getenv('ML_SCORING_THREADS', os.cpu_count() or 4))
+LGBM_THREADS = int(os.getenv('ML_LGBM_THREADS', 1))
+
+_scoring_pool = ThreadPoolExecutor(max_workers=SCORING_THREADS, thread_name_prefix='ml-scoring')
+_state_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ml-state')
+
+# Submitted-but-unfinished calls per pool (only touched on the event loop)
+_in_flight = {'scoring': 0, 'state': 0}
+
+
+async def _run(pool, name, fn, args, kwargs):
+    loop = asyncio.get_running_loop()
+    _in_flight[name] += 1
+    try:
+        return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+    finally:
+        _in_flight[name] -= 1
+
+
+async def run_scoring(fn, *args, **kwargs):
+    """Run a CPU-bound scoring call on the scoring pool."""
+    return await _run(_scoring_pool, 'scoring', fn, args, kwargs)
+
+
+async def run_state(fn, *args, **kwargs):
+    """Run a state mutation (and its persistence) on the single state thread."""
+    return await _run(_state_pool, 'state', fn, args, kwargs)
+
+
+def configure_model_threads(recommender):
+    """Pin LightGBM's per-call OpenMP threads (no-op for compiled trees)."""
+    model = recommender.model
+    if model is not None and hasattr(model, 'set_params'):
+        model.set_params(n_jobs=LGBM_THREADS)
+
+
+def pool_stats():
+    """Pool sizes and in-flight calls — for /api/health."""
+    return {
+        'scoring_threads': SCORING_THREADS,
+        'lgbm_threads': LGBM_THREADS,
+        'scoring_in_flight': _in_flight['scoring'],
+        'state_in_flight': _in_flight['state'],
+    }
+
+
+def shutdown():
+    """Drain both pools — pending state writes finish before exit."""
+    _scoring_pool.shutdown(wait=True)
+    _state_pool.shutdown(wait=True)
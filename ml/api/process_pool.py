@@ -0,0 +1,142 @@
+"""
+============================================================
+api/process_pool.py — Forked inference workers sharing one model
+============================================================
+
+Running uvicorn with workers > 1 imports routes.py in every process:
+each one unpickles its own copy of lightgbm_ranker.pkl AND keeps its
+own bandit and profile store, so they learn from different feedback.
+
+This mode keeps ONE serving process (one bandit, one profile store)
+and moves only inference out of it:
+
+  1. The parent loads the model once (routes.py does this at import).
+  2. gc.freeze() moves every existing object into the permanent
+     generation, so the collector in the children never writes to the
+     model's pages (refcount/GC-header writes are what usually breaks
+     copy-on-write sharing).
+  3. N workers are forked immediately, before any thread or OpenMP
+     pool starts running inference. They inherit the model pages
+     copy-on-write — the model is resident in RAM once, not N times.
+  4. Feature matrices are built in the parent and shipped to a worker;
+     the worker returns the score vector.
+
+memory_report() reads /proc/<pid>/smaps_rollup for the parent and every
+worker: RSS counts shared pages in every process, PSS splits them
+between the processes sharing them, so sum(PSS) is the real footprint.
+
+If a worker dies (OOM kill, native crash) the executor is broken for
+good. The pool then scores in-process and reports itself as down in
+/api/workers. Re-forking from a multi-threaded parent isn't safe, so
+restart the service to get the workers back.
+
+Linux only (fork + /proc). Enable with ML_INFERENCE_PROCESSES=N.
+"""
+
+import gc
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Set in the parent right before forking; inherited by every worker
+_MODEL = None
+
+
+def _init_worker():
+    # Each worker is one inference lane — no nested OpenMP fan-out
+    if hasattr(_MODEL, 'set_params'):
+        _MODEL.set_params(n_jobs=1)
+
+
+def _score_in_worker(X):
+    # P(class=1) = probability user will engage
+    return _MODEL.predict_proba(X)[:, 1]
+
+
+def _worker_pid(_=None):
+    return os.getpid()
+
+
+def _read_memory(pid):
+    """RSS / PSS / shared / private in kB from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        'pid': pid,
+        'rss_kb': fields.get('Rss', 0),
+        'pss_kb': fields.get('Pss', 0),
+        'shared_kb': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'private_kb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def _child_pids():
+    """PIDs of this process's direct children (all threads' children lists)."""
+    pids = set()
+    task_dir = f'/proc/{os.getpid()}/task'
+    for tid in os.listdir(task_dir):
+        try:
+            with open(f'{task_dir}/{tid}/children') as f:
+                pids.update(int(pid) for pid in f.read().split())
+        except OSError:
+            continue
+    return sorted(pids)
+
+
+class InferencePool:
+    """Fork-based worker pool scoring feature matrices with a shared model."""
+
+    def __init__(self, model, workers):
+        global _MODEL
+        if model is None:
+            raise ValueError("Model not trained yet!")
+        _MODEL = model
+        self.workers = workers
+        self.broken = False
+
+        # Freeze everything allocated so far (model included) out of the
+        # GC's reach so children don't dirty those pages
+        gc.collect()
+        gc.freeze()
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+        )
+        # Fork every worker now, while the parent is still single-threaded
+        list(self._executor.map(_worker_pid, range(workers)))
+
+    def score(self, X):
+        """Score one matrix on a worker (blocks the calling thread); in-process once the pool is down."""
+        if not self.broken:
+            try:
+                return self._executor.submit(_score_in_worker, X).result()
+            except BrokenProcessPool as e:
+                if not self.broken:
+                    self.broken = True
+                    print(f"[WARN] Inference worker died ({e}) — scoring in-process until restart")
+        return _score_in_worker(X)
+
+    def memory_report(self):
+        """Per-process memory for the parent and every worker."""
+        parent = _read_memory(os.getpid())
+        workers = [m for m in (_read_memory(pid) for pid in _child_pids()) if m]
+        total_pss = (parent['pss_kb'] if parent else 0) + sum(w['pss_kb'] for w in workers)
+        return {
+            'status': 'down' if self.broken else 'up',
+            'parent': parent,
+            'workers': workers,
+            'total_pss_kb': total_pss,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
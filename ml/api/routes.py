@@ -1,13 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
+import json
+import numpy as np
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from models.RFC import LightGBMRecommender
+from models.RFC import LightGBMRecommender, PLACE_BLOCK_WIDTH
+from models.feature_cache import PlaceFeatureCache
+from models.tree_evaluator import CompiledForest
+from models.topk import top_k_indices
+from models.telemetry import missing_fields
+from api.executor import run_scoring, run_state, configure_model_threads, pool_stats
+from api.coalescer import RecommendCoalescer
+from api.process_pool import InferencePool
 from models.thompson import ContextualThompsonSampling
+from models.shared_bandit import SharedContextualThompsonSampling
+from models.replica_sync import DirectorySync, REPLICA_ID, SYNC_DIR
 from models.vibe_profiler import build_vibe_profile, get_vibe_vector, PLACE_TYPE_DEFAULTS, DEFAULT_VIBE
-from models.user_profile import get_profile, update_profile, get_all_profiles
+from models.user_profile import get_profile, get_profile_matrix, update_profile, update_profiles, get_all_profiles, PERSONAS
+from models.user_profile import persistence_stats as profile_persistence_stats
 
 router = APIRouter()
 
@@ -17,13 +31,121 @@ _CAT_TO_PLACE_TYPE = {
     'entertainment': 'bowling_alley', 'culture': 'museum',
 }
 
-# Load model on startup
-recommender = LightGBMRecommender()
+# Load model on startup. ML_MODEL_PATH can point at the compiled .npz
+# export (see train_model.py) to serve without the LightGBM runtime.
+recommender = LightGBMRecommender(place_cache=PlaceFeatureCache(
+    PLACE_BLOCK_WIDTH,
+    max_entries=int(os.getenv('ML_PLACE_CACHE_SIZE', 50_000)),
+    ttl_seconds=float(os.getenv('ML_PLACE_CACHE_TTL', 3600)),
+))
 ML_DIR = os.path.join(os.path.dirname(__file__), '..')
-recommender.load_model(os.path.join(ML_DIR, 'models', 'trained', 'lightgbm_ranker.pkl'))
+recommender.load_model(os.getenv(
+    'ML_MODEL_PATH', os.path.join(ML_DIR, 'models', 'trained', 'lightgbm_ranker.pkl')))
+configure_model_threads(recommender)
+
+# Optional forked inference workers sharing the model copy-on-write.
+# Run uvicorn with ONE worker in this mode: bandit and profiles stay here.
+_inference_processes = int(os.getenv('ML_INFERENCE_PROCESSES', 0))
+inference_pool = None
+if _inference_processes > 0 and recommender.model is not None:
+    inference_pool = InferencePool(recommender.model, _inference_processes)
+    recommender.inference_pool = inference_pool
+
+# Optional micro-batching of concurrent /recommend calls (off by default)
+_coalesce_window_ms = float(os.getenv('ML_COALESCE_WINDOW_MS', 0))
+coalescer = RecommendCoalescer(
+    recommender.score_matrix,
+    max_wait_ms=_coalesce_window_ms,
+    max_batch=int(os.getenv('ML_COALESCE_MAX_BATCH', 2048)),
+) if _coalesce_window_ms > 0 else None
+
+# Initialize Thompson Sampling bandit (snapshot + write-ahead log in data/).
+# ML_SHARED_STATE=1: arms live in shared memory so every uvicorn worker
+# samples from and updates the same posterior (see shared_bandit.py);
+# profiles then need ML_PROFILE_BACKEND=sqlite (user_profile.py checks).
+# ML_SYNC_DIR=<shared dir>: replicas on different machines swap arm
+# deltas through that directory and converge (see replica_sync.py).
+replica_sync = None
+if os.getenv('ML_SHARED_STATE', '0') == '1':
+    bandit = SharedContextualThompsonSampling()
+    if SYNC_DIR:
+        print("[WARN] ML_SYNC_DIR is not supported with ML_SHARED_STATE=1 — replica sync disabled")
+elif SYNC_DIR:
+    bandit = ContextualThompsonSampling(replica_id=REPLICA_ID)
+    replica_sync = DirectorySync(bandit, SYNC_DIR).start()
+    print(f"[OK] Replica sync: {REPLICA_ID} via {SYNC_DIR} every {replica_sync.interval:g}s")
+else:
+    bandit = ContextualThompsonSampling()
+
+
+def _build_context(raw_context):
+    """Build model context from the request (new fields from server)."""
+    return {
+        'hour': raw_context.get('hour', None),
+        'day_of_week': raw_context.get('dayOfWeek', None),
+        'weather': raw_context.get('weather', 'clear'),
+        'travel_mode': raw_context.get('travelMode', 'walking'),
+    }
+
 
-# Initialize Thompson Sampling bandit (in-memory, resets on restart)
-bandit = ContextualThompsonSampling()
+def _prepare_activities(activities, raw_context):
+    """Per-activity travel minutes (for distance decay) + vibe profile injection."""
+    travel_map = raw_context.get('travelMinutesMap', {})
+    for act in activities:
+        if act.get('id') and act['id'] in travel_map:
+            act['travelMinutes'] = travel_map[act['id']]
+        if 'isOpen' not in act:
+            act['isOpen'] = True
+        # Inject vibe features from place-type defaults if not already present
+        if 'vibe_chill' not in act:
+            place_type = _CAT_TO_PLACE_TYPE.get(act.get('category', ''), 'restaurant')
+            vibe = PLACE_TYPE_DEFAULTS.get(place_type, DEFAULT_VIBE)
+            act['vibe_chill']          = vibe['chill']
+            act['vibe_social']         = vibe['social']
+            act['vibe_studious']       = vibe['studious']
+            act['vibe_trendy']         = vibe['trendy']
+            act['vibe_date_spot']      = vibe['date_spot']
+            act['vibe_budget_friendly'] = vibe['budget_friendly']
+
+
+async def _lgbm_scores(activities, user_prefs, context, user_id):
+    """LightGBM base scores — through the coalescer when it is enabled."""
+    if coalescer is None:
+        # Feature extraction + inference run on the scoring pool
+        return await run_scoring(_score_for_user, activities, user_prefs, context, user_id)
+    X = await run_scoring(_features_for_user, activities, user_prefs, context, user_id)
+    return await coalescer.score(X)
+
+
+def _score_for_user(activities, user_prefs, context, user_id):
+    return recommender.score_activities(
+        activities, user_prefs, context, get_profile(user_id), source='recommend')
+
+
+def _features_for_user(activities, user_prefs, context, user_id):
+    return recommender.feature_matrix(
+        activities, user_prefs, context, get_profile(user_id), source='recommend')
+
+
+def _blend_and_rank(activities, lgbm_scores, context, top_k):
+    """Blend Thompson samples into LightGBM scores and rank (scoring pool)."""
+    hour = context.get('hour', 12)
+    place_ids = [a.get('id', '') for a in activities]
+    categories = [a.get('category', 'entertainment') for a in activities]
+    thompson_scores = bandit.sample_scores(place_ids, categories, hour)
+    ts_scores = np.array([thompson_scores.get(aid, 0.5) for aid in place_ids])
+    blended = 0.7 * lgbm_scores + 0.3 * ts_scores
+
+    # Rank by blended score; with topK only the winners are sorted/copied
+    scored = []
+    for i in top_k_indices(blended, top_k).tolist():
+        scored.append({
+            **activities[i],
+            'ml_score': round(float(blended[i]), 4),
+            'lgbm_score': round(float(lgbm_scores[i]), 4),
+            'thompson_score': round(float(ts_scores[i]), 4),
+        })
+    return scored
 
 
 # =============================================================
@@ -39,7 +161,8 @@ async def recommend(data: dict):
         "activities": [...],
         "userPreferences": { "preferences", "priceLevel", "duration" },
         "context": { "hour", "dayOfWeek", "weather", "travelMinutesMap" },
-        "userId": "alex"  // optional — loads user profile for personalized scoring
+        "userId": "alex",  // optional — loads user profile for personalized scoring
+        "topK": 10         // optional — return only the 10 best (default: all)
     }
     Output: { "success": true, "recommendations": [...with ml_score] }
     """
@@ -54,56 +177,19 @@ async def recommend(data: dict):
                 'message': 'No activities to score'
             }
 
-        # Build context from request (new fields from server)
         raw_context = data.get('context', {})
-        context = {
-            'hour': raw_context.get('hour', None),
-            'day_of_week': raw_context.get('dayOfWeek', None),
-            'weather': raw_context.get('weather', 'clear'),
-            'travel_mode': raw_context.get('travelMode', 'walking'),
-        }
-
-        # Per-activity travel minutes (for distance decay) + vibe profile injection
-        travel_map = raw_context.get('travelMinutesMap', {})
-        for act in activities:
-            if act.get('id') and act['id'] in travel_map:
-                act['travelMinutes'] = travel_map[act['id']]
-            if 'isOpen' not in act:
-                act['isOpen'] = True
-            # Inject vibe features from place-type defaults if not already present
-            if 'vibe_chill' not in act:
-                place_type = _CAT_TO_PLACE_TYPE.get(act.get('category', ''), 'restaurant')
-                vibe = PLACE_TYPE_DEFAULTS.get(place_type, DEFAULT_VIBE)
-                act['vibe_chill']          = vibe['chill']
-                act['vibe_social']         = vibe['social']
-                act['vibe_studious']       = vibe['studious']
-                act['vibe_trendy']         = vibe['trendy']
-                act['vibe_date_spot']      = vibe['date_spot']
-                act['vibe_budget_friendly'] = vibe['budget_friendly']
+        context = _build_context(raw_context)
+        _prepare_activities(activities, raw_context)
 
         # Load user profile for personalized scoring
         user_id = data.get('userId', None)
-        user_profile = get_profile(user_id)
+        top_k = data.get('topK', None)
 
         # Score ALL candidates with user profile (LightGBM base scores)
-        scored = recommender.predict_scores(activities, user_prefs, context, user_profile)
+        lgbm_scores = await _lgbm_scores(activities, user_prefs, context, user_id)
 
         # Blend Thompson sampling scores into the final ranking.
-        hour = context.get('hour', 12)
-        place_ids = [a.get('id', '') for a in scored]
-        categories = [a.get('category', 'entertainment') for a in scored]
-        thompson_scores = bandit.sample_scores(place_ids, categories, hour)
-
-        for activity in scored:
-            aid = activity.get('id', '')
-            lgbm_score = activity.get('ml_score', 0.5)
-            ts_score = thompson_scores.get(aid, 0.5)
-            activity['ml_score'] = round(0.7 * lgbm_score + 0.3 * ts_score, 4)
-            activity['lgbm_score'] = round(lgbm_score, 4)
-            activity['thompson_score'] = round(ts_score, 4)
-
-        # Re-sort by blended score
-        scored.sort(key=lambda x: x.get('ml_score', 0), reverse=True)
+        scored = await run_scoring(_blend_and_rank, activities, lgbm_scores, context, top_k)
 
         return {
             'success': True,
@@ -112,6 +198,7 @@ async def recommend(data: dict):
             'userId': user_id,
             'profileUsed': user_id is not None,
             'scoring': 'lgbm+thompson',
+            'topK': top_k,
         }
 
     except Exception as e:
@@ -119,6 +206,56 @@ async def recommend(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# =============================================================
+# POST /api/recommend/batch — U users × M places score matrix
+# =============================================================
+
+@router.post('/recommend/batch')
+async def recommend_batch(data: dict):
+    """
+    Score the same candidate places for a cohort of users in one model call.
+    Used to pre-warm recommendations (e.g. all seeded personas).
+
+    Input: {
+        "activities": [...],
+        "userIds": ["alex", "jordan"],   // optional — defaults to all personas
+        "userPreferences": { "priceLevel", "duration" },
+        "context": { "hour", "dayOfWeek", "weather", "travelMinutesMap" }
+    }
+    Output: {
+        "success": true, "userIds": [...], "placeIds": [...],
+        "scores": [[...M LightGBM scores...], ...U rows]
+    }
+    """
+    try:
+        activities = data.get('activities', [])
+        user_ids = data.get('userIds') or list(PERSONAS)
+        user_prefs = data.get('userPreferences', {})
+
+        raw_context = data.get('context', {})
+        context = _build_context(raw_context)
+        _prepare_activities(activities, raw_context)
+
+        # One gather for every user (one fancy-index with the matrix backend)
+        profiles = get_profile_matrix(user_ids)
+        scores = await run_scoring(
+            recommender.predict_score_matrix, activities, profiles, user_prefs, context,
+            source='recommend_batch')
+
+        return {
+            'success': True,
+            'userIds': user_ids,
+            'placeIds': [a.get('id', '') for a in activities],
+            'scores': np.round(scores, 4).tolist(),
+            'total_scored': int(scores.size),
+            'scoring': 'lgbm',
+        }
+
+    except Exception as e:
+        print(f"Error in /recommend/batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # =============================================================
 # POST /api/thompson — Thompson Sampling scoring
 # =============================================================
@@ -136,7 +273,7 @@ async def thompson_score(data: dict):
         categories = data.get('categories', [])
         hour = data.get('hour', 12)
 
-        scores = bandit.sample_scores(place_ids, categories, hour)
+        scores = await run_scoring(bandit.sample_scores, place_ids, categories, hour)
 
         return {
             'success': True,
@@ -153,18 +290,71 @@ async def thompson_score(data: dict):
 # GET /api/thompson/stats — Bandit state for demo
 # =============================================================
 
+# Page size cap; format=ndjson streams every match in pages of this size
+STATS_MAX_LIMIT = 5_000
+
+
+def _stream_stats(place_id, bucket, min_observations):
+    """NDJSON lines of every matching arm, one page (one short lock hold) at a time."""
+    cursor = 0
+    while cursor is not None:
+        arms, cursor = bandit.stats_page(cursor, STATS_MAX_LIMIT, place_id, bucket, min_observations)
+        if arms:
+            yield ''.join(json.dumps(arm) + '\n' for arm in arms.values())
+
+
 @router.get('/thompson/stats')
-async def thompson_stats():
+async def thompson_stats(
+    cursor: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=STATS_MAX_LIMIT),
+    place_id: Optional[List[str]] = Query(None),
+    bucket: Optional[str] = None,
+    min_observations: float = Query(0, ge=0),
+    group: Optional[str] = Query(None, pattern='^place$'),
+    format: str = Query('json', pattern='^(json|ndjson)$'),
+):
     """
-    Returns all bandit arm stats for demo visualization.
+    Bandit arm stats for demo visualization, one page at a time.
     Shows alpha, beta, expected_value, observations per (place, context).
+
+    Query:
+      cursor, limit       page through arms (pass back next_cursor)
+      place_id            only these places (repeatable)
+      bucket              only this context, e.g. "evening_food"
+      min_observations    skip arms with less (decayed) evidence
+      group=place         per-place totals instead, most observed first
+      format=ndjson       stream every matching arm, one JSON object per line
+
+    Output:
+      {
+        "success": true,
+        "arms": {"place_id|bucket": {...}},   (or "places": [...] with group=place)
+        "count": 100,
+        "next_cursor": 4096,                  (null on the last page)
+        "total_arms": 125000
+      }
     """
-    stats = bandit.get_all_stats()
-    return {
-        'success': True,
-        'arms': stats,
-        'total_arms': len(stats),
-    }
+    try:
+        if format == 'ndjson':
+            return StreamingResponse(_stream_stats(place_id, bucket, min_observations),
+                                     media_type='application/x-ndjson')
+        if group == 'place':
+            places, next_cursor = await run_scoring(
+                bandit.stats_by_place, cursor, limit, place_id, bucket, min_observations)
+            page = {'places': places, 'count': len(places)}
+        else:
+            arms, next_cursor = await run_scoring(
+                bandit.stats_page, cursor, limit, place_id, bucket, min_observations)
+            page = {'arms': arms, 'count': len(arms)}
+        return {
+            'success': True,
+            **page,
+            'next_cursor': next_cursor,
+            'total_arms': len(bandit),
+        }
+    except Exception as e:
+        print(f"Error in /thompson/stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 # =============================================================
@@ -181,6 +371,22 @@ REWARD_MAP = {
     'dislike': 0,     # explicit dislike
 }
 
+def _apply_feedback(place_id, category, hour, reward, user_id):
+    """Apply one feedback event (runs on the state thread)."""
+    if reward is not None:
+        # Update Thompson Sampling bandit
+        bandit.update(place_id, category, hour, reward)
+
+        # Update user profile (nudge category affinity)
+        if user_id:
+            update_profile(user_id, category, reward)
+
+    # Return current stats for this place in this context
+    stats = bandit.explain(place_id, category, hour)
+    profile = get_profile(user_id) if user_id else None
+    return stats, profile
+
+
 @router.post('/feedback')
 async def feedback(data: dict):
     """
@@ -205,16 +411,17 @@ async def feedback(data: dict):
 
         reward = REWARD_MAP.get(event_type)
 
-        if reward is not None:
-            # Update Thompson Sampling bandit
-            bandit.update(place_id, category, hour, reward)
-
-            # Update user profile (nudge category affinity)
-            if user_id:
-                update_profile(user_id, category, reward)
+        if not place_id:
+            return {
+                'success': True,
+                'event_type': event_type,
+                'reward': reward,
+                'message': 'No place_id — event skipped'
+            }
 
-        # Return current stats for this place in this context
-        stats = bandit.explain(place_id, category, hour)
+        # Updates + their disk writes run in order on the state thread
+        stats, profile = await run_state(
+            _apply_feedback, place_id, category, hour, reward, user_id)
 
         # Include updated profile if userId provided
         response = {
@@ -224,7 +431,7 @@ async def feedback(data: dict):
             'stats': stats,
         }
         if user_id:
-            response['updatedProfile'] = get_profile(user_id)
+            response['updatedProfile'] = profile
 
         return response
 
@@ -233,6 +440,75 @@ async def feedback(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# =============================================================
+# POST /api/feedback/batch — Bulk feedback (bursts, backlog replay)
+# =============================================================
+
+def _apply_feedback_batch(events):
+    """Apply a list of parsed feedback events (runs on the state thread)."""
+    events = [e for e in events if e['reward'] is not None]
+    arms_updated = bandit.update_many(
+        [e['place_id'] for e in events],
+        [e['category'] for e in events],
+        [e['hour'] for e in events],
+        [e['reward'] for e in events],
+    )
+    profiles = update_profiles((e['user_id'], e['category'], e['reward']) for e in events)
+    return len(events), arms_updated, profiles
+
+
+@router.post('/feedback/batch')
+async def feedback_batch(data: dict):
+    """
+    Apply many feedback events in one call. Same per-event semantics as
+    /feedback, but the bandit is updated with one scatter-add, each
+    user's profile is folded once, and state is persisted once — no
+    per-event explain.
+
+    Input: {
+        "events": [
+            { "place_id": "ChIJ...", "category": "food", "hour": 14,
+              "event_type": "like", "userId": "alex" },
+            ...
+        ]
+    }
+    Output: {
+        "success": true, "received": 2000, "applied": 1850,
+        "skipped": 150,          // no place_id, or event_type without a reward
+        "armsUpdated": 412, "usersUpdated": 37
+    }
+    """
+    try:
+        raw_events = data.get('events', [])
+        events = []
+        for raw in raw_events:
+            place_id = raw.get('place_id')
+            if not place_id:
+                continue
+            events.append({
+                'place_id': place_id,
+                'category': raw.get('category', 'entertainment'),
+                'hour': raw.get('hour', 12),
+                'reward': REWARD_MAP.get(raw.get('event_type', 'impression')),
+                'user_id': raw.get('userId', None),
+            })
+
+        applied, arms_updated, profiles = await run_state(_apply_feedback_batch, events)
+
+        return {
+            'success': True,
+            'received': len(raw_events),
+            'applied': applied,
+            'skipped': len(raw_events) - applied,
+            'armsUpdated': arms_updated,
+            'usersUpdated': len(profiles),
+        }
+
+    except Exception as e:
+        print(f"Error in /feedback/batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # =============================================================
 # POST /api/vibe-profile — Place vibe analysis
 # =============================================================
@@ -297,6 +573,51 @@ async def get_single_profile(user_id: str):
     }
 
 
+# =============================================================
+# GET /api/workers — Inference worker memory (process-pool mode)
+# =============================================================
+
+@router.get('/workers')
+async def workers():
+    """
+    Per-process RSS/PSS for the serving process and inference workers.
+    PSS splits shared (copy-on-write) pages between processes, so
+    total_pss_kb is what the pool really costs.
+    """
+    if inference_pool is None:
+        return {'success': True, 'mode': 'in-process', 'workers': []}
+    return {
+        'success': True,
+        'mode': 'process-pool',
+        'num_workers': inference_pool.workers,
+        **inference_pool.memory_report(),
+    }
+
+
+# =============================================================
+# GET /api/metrics — In-process counters (data quality, caches, pools)
+# =============================================================
+
+@router.get('/metrics')
+async def metrics():
+    """
+    Cheap, in-memory counters for dashboards and alerting.
+    missing_fields: {field: {source: count}} of activities scored with a
+    defaulted rating / review count / category.
+    """
+    return {
+        'success': True,
+        'missing_fields': missing_fields.snapshot(),
+        'place_cache': recommender.place_cache.stats(),
+        'executor': pool_stats(),
+        'coalescer': coalescer.stats() if coalescer else None,
+        'bandit': bandit.store_stats(),
+        'bandit_wal': bandit.wal.stats(),
+        'replica_sync': replica_sync.stats() if replica_sync else None,
+        'profiles': profile_persistence_stats(),
+    }
+
+
 # =============================================================
 # GET /api/health — Health check
 # =============================================================
@@ -307,7 +628,10 @@ async def health():
     return {
         'status': 'ok',
         'model_loaded': model_loaded,
-        'model_type': 'LightGBM',
+        'model_type': 'LightGBM (compiled)' if isinstance(recommender.model, CompiledForest) else 'LightGBM',
         'features': len(recommender.feature_names),
-        'thompson_arms': len(bandit.arms),
+        'thompson_arms': len(bandit),
+        'place_cache': recommender.place_cache.stats(),
+        'executor': pool_stats(),
+        'coalescer': coalescer.stats() if coalescer else None,
     }
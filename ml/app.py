@@ -1,9 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router
+from api import executor, routes
+from models import user_profile
 import os
 
-app = FastAPI(title="Sorcerer Troop ML Service")
+@asynccontextmanager
+async def lifespan(app):
+    # Background profile flushing — started here, after routes.py has
+    # forked any inference workers from the still single-threaded process
+    user_profile.start_flusher()
+    yield
+    # Let queued state writes land before the process exits
+    executor.shutdown()
+    # Push our last bandit delta to the other replicas
+    if routes.replica_sync is not None:
+        routes.replica_sync.close()
+    # Fold the bandit's write-ahead log into its snapshot
+    routes.bandit.close()
+    # Flush dirty user profiles into user_profiles.json
+    user_profile.close()
+    if routes.inference_pool is not None:
+        routes.inference_pool.shutdown()
+
+app = FastAPI(title="Sorcerer Troop ML Service", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
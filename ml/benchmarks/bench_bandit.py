@@ -0,0 +1,141 @@
+"""
+Contextual bandit arm storage: legacy dict-of-dicts vs the ArmStore arrays.
+
+Reports memory per arm (tracemalloc) and sample_scores latency for a
+request-sized candidate list drawn from a bandit holding 1M arms
+(62,500 places × 16 context buckets).
+
+The legacy store is rebuilt here exactly as it was: a dict keyed by
+(place_id, "period_category") tuples holding {'alpha', 'beta'} dicts,
+sampled with one np.random.beta call per place.
+
+    python benchmarks/bench_bandit.py
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from common import best_of
+from models.arm_store import ArmStore, DEFAULT_BUCKETS
+from models.thompson import ContextualThompsonSampling
+
+N_PLACES = 62_500
+CANDIDATES = [100, 1_000, 10_000]
+HOUR = 18
+CATEGORIES = ['food', 'outdoor', 'entertainment', 'culture']
+
+
+def legacy_bucket(hour, category):
+    if 6 <= hour < 11:     period = 'morning'
+    elif 11 <= hour < 17:  period = 'afternoon'
+    elif 17 <= hour < 21:  period = 'evening'
+    else:                  period = 'night'
+    return f"{period}_{category}"
+
+
+def build_legacy(place_ids):
+    arms = {}
+    for pid in place_ids:
+        for bucket in DEFAULT_BUCKETS:
+            arms[(pid, bucket)] = {'alpha': 1, 'beta': 1}
+    return arms
+
+
+def sample_legacy(arms, place_ids, categories, hour):
+    scores = {}
+    for pid, cat in zip(place_ids, categories):
+        arm = arms[(pid, legacy_bucket(hour, cat))]
+        scores[pid] = np.random.beta(arm['alpha'], arm['beta'])
+    return scores
+
+
+def build_store(place_ids):
+    store = ArmStore()
+    n = len(place_ids)
+    store.add_arms(np.repeat(place_ids, len(DEFAULT_BUCKETS)).tolist(),
+                   DEFAULT_BUCKETS * n, np.ones(n * 16), np.ones(n * 16))
+    return store
+
+
+def traced(fn):
+    """(result, bytes allocated and still live) for fn()."""
+    tracemalloc.start()
+    result = fn()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    place_ids = [f"ChIJ_place_{i:07d}" for i in range(N_PLACES)]
+    n_arms = N_PLACES * len(DEFAULT_BUCKETS)
+
+    # Place-id strings are shared by both stores; allocate them outside the trace
+    legacy, legacy_bytes = traced(lambda: build_legacy(place_ids))
+    store, store_bytes = traced(lambda: build_store(place_ids))
+
+    print(f"\n{n_arms:,} arms")
+    print(f"  legacy dict : {legacy_bytes / n_arms:>7.1f} bytes/arm  ({legacy_bytes / 2**20:,.0f} MiB)")
+    print(f"  ArmStore    : {store_bytes / n_arms:>7.1f} bytes/arm  ({store_bytes / 2**20:,.0f} MiB, "
+          f"{store.nbytes() / 2**20:,.0f} MiB in arrays)")
+
+    bandit = ContextualThompsonSampling(persist_path=os.path.join(tempfile.mkdtemp(), 'bench_state.bin'))
+    bandit.store = store
+
+    rng = np.random.default_rng(0)
+    print(f"\n{'candidates':>10} | {'legacy ms':>9} | {'ArmStore ms':>11} | {'speedup':>7}")
+    print('-' * 48)
+    for k in CANDIDATES:
+        pick = rng.choice(N_PLACES, size=k, replace=False)
+        pids = [place_ids[i] for i in pick]
+        cats = [CATEGORIES[i % 4] for i in pick]
+
+        t_legacy = best_of(lambda: sample_legacy(legacy, pids, cats, HOUR))
+        t_store = best_of(lambda: bandit.sample_scores(pids, cats, HOUR))
+        print(f"{k:>10} | {t_legacy * 1e3:>9.2f} | {t_store * 1e3:>11.3f} | {t_legacy / t_store:>6.1f}x")
+
+    unseen = [f"ChIJ_unseen_{i:07d}" for i in range(10_000)]
+    t_unseen = best_of(lambda: bandit.sample_scores(unseen, ['food'] * len(unseen), HOUR))
+    print(f"\n10k never-seen candidates: {t_unseen * 1e3:.2f} ms, "
+          f"arms {n_arms:,} -> {len(store):,} (prior draws allocate nothing)")
+    assert len(store) == n_arms, "sampling must not create arms"
+
+    # Discounted mode: lazy decay on read, vectorized eviction pass
+    bandit.half_life = 24 * 3600
+    pids = [place_ids[i] for i in rng.choice(N_PLACES, size=1_000, replace=False)]
+    t_plain = best_of(lambda: ContextualThompsonSampling.sample_scores(bandit, pids, ['food'] * 1_000, HOUR))
+    store.alpha[:n_arms] += rng.integers(0, 20, n_arms)
+    store.beta[:n_arms] += rng.integers(0, 20, n_arms)
+    store.touched[:n_arms] = time.time() - rng.uniform(0, 30 * 24 * 3600, n_arms)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        evicted = bandit.evict()
+    t_evict = time.perf_counter() - start
+    bandit.wal.wait()
+    print(f"\ndiscounted (24h half-life): 1k candidates {t_plain * 1e3:.3f} ms; "
+          f"eviction pass over {n_arms:,} arms {t_evict * 1e3:.0f} ms, evicted {evicted:,}")
+
+    # /api/thompson/stats: every arm at once vs one page / one filtered or grouped read
+    n_left = len(store)
+    start = time.perf_counter()
+    bandit.get_all_stats()
+    t_all = time.perf_counter() - start
+    t_page = best_of(lambda: bandit.stats_page(0, 100))
+    t_filtered = best_of(lambda: bandit.stats_page(0, 100, pids[:10], 'evening_food', 5), repeats=3)
+    start = time.perf_counter()
+    bandit.stats_by_place(0, 100)
+    t_grouped = time.perf_counter() - start
+    print(f"\nstats over {n_left:,} arms: get_all_stats {t_all * 1e3:,.0f} ms; "
+          f"first page of 100 {t_page * 1e3:.2f} ms; filtered full scan {t_filtered * 1e3:.0f} ms; "
+          f"per-place totals {t_grouped * 1e3:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Feedback ingestion: one /feedback-style update per event vs /feedback/batch.
+
+The per-event path is what /api/feedback does for each event: bandit
+update, profile update, explain. The batch path is /api/feedback/batch:
+one scatter-add into the arm arrays, one fold per user, one log write.
+Profile writes are batched by the background flusher in both cases.
+
+Both paths start from the same state and must end in the same arm
+counts and profiles. Profiles are written to a temp file, not data/.
+
+Profiles only: users with k queued events per category, update_profile()
+per event vs update_profiles() (one exact fold per user and category,
+vectorized across users — see fold_ema).
+
+    python benchmarks/bench_feedback.py
+"""
+
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from models import user_profile
+from models.thompson import ContextualThompsonSampling
+from models.wal import WriteAheadLog
+
+SIZES = [1_000, 10_000]
+CATEGORIES = ['food', 'outdoor', 'entertainment', 'culture']
+# Queued events per (user, category) for the profile-only table
+QUEUED = [1, 10, 100]
+PROFILE_USERS = 2_000
+USERS = ['alex', 'jordan', 'sam', 'maya_okc', 'chris_dallas'] + [f"user_{i}" for i in range(95)]
+
+
+def make_events(n, seed=0):
+    rng = random.Random(seed)
+    return [(f"place_{rng.randrange(2_000)}", rng.choice(CATEGORIES), rng.randrange(24),
+             int(rng.random() < 0.3), rng.choice(USERS)) for _ in range(n)]
+
+
+def fresh_state(tmp, name):
+    user_profile._wal = WriteAheadLog(os.path.join(tmp, f"{name}_profiles.json"))
+    user_profile._profiles.clear()
+    for uid, persona in user_profile.PERSONAS.items():
+        user_profile._profiles[uid] = user_profile.ProfileRecord.from_dict(persona['profile'])
+    return ContextualThompsonSampling(persist_path=os.path.join(tmp, f"{name}.bin"))
+
+
+def per_event(bandit, events):
+    for place_id, category, hour, reward, user_id in events:
+        bandit.update(place_id, category, hour, reward)
+        user_profile.update_profile(user_id, category, reward)
+        bandit.explain(place_id, category, hour)
+
+
+def batched(bandit, events):
+    place_ids, categories, hours, rewards, users = zip(*events)
+    bandit.update_many(place_ids, categories, hours, rewards)
+    user_profile.update_profiles(zip(users, categories, rewards))
+
+
+def main():
+    print(f"\n{'events':>7} | {'per-event s':>11} | {'batch ms':>8} | {'events/s (batch)':>16} | {'speedup':>7}")
+    print('-' * 64)
+    for n in SIZES:
+        events = make_events(n)
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            loop_bandit = fresh_state(tmp, 'loop')
+            start = time.perf_counter()
+            per_event(loop_bandit, events)
+            t_loop = time.perf_counter() - start
+            loop_profiles = {u: dict(p) for u, p in user_profile._profiles.items()}
+
+            batch_bandit = fresh_state(tmp, 'batch')
+            start = time.perf_counter()
+            batched(batch_bandit, events)
+            t_batch = time.perf_counter() - start
+            batch_profiles = {u: dict(p) for u, p in user_profile._profiles.items()}
+
+        assert batch_bandit.get_all_stats() == loop_bandit.get_all_stats(), "arm counts differ"
+        assert batch_profiles == loop_profiles, "profiles differ"
+        print(f"{n:>7} | {t_loop:>11.2f} | {t_batch * 1e3:>8.1f} | {n / t_batch:>16,.0f} | {t_loop / t_batch:>6.0f}x")
+
+    print(f"\n{PROFILE_USERS:,} users, k events per category")
+    print(f"{'k':>4} | {'events':>7} | {'per-event ms':>12} | {'folded ms':>9} | {'speedup':>7}")
+    print('-' * 51)
+    for k in QUEUED:
+        rng = random.Random(k)
+        events = [(f"user_{u}", category, int(rng.random() < 0.3))
+                  for _ in range(k) for u in range(PROFILE_USERS) for category in CATEGORIES]
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            fresh_state(tmp, f"loop_{k}")
+            start = time.perf_counter()
+            for user_id, category, reward in events:
+                user_profile.update_profile(user_id, category, reward)
+            t_loop = time.perf_counter() - start
+            loop_profiles = {u: dict(p) for u, p in user_profile._profiles.items()}
+
+            fresh_state(tmp, f"fold_{k}")
+            start = time.perf_counter()
+            user_profile.update_profiles(events)
+            t_fold = time.perf_counter() - start
+            fold_profiles = {u: dict(p) for u, p in user_profile._profiles.items()}
+            # 2,000 dirty users wake the flusher: let it finish before the temp dir goes
+            user_profile.flush()
+            user_profile._wal.close()
+
+        assert fold_profiles == loop_profiles, "profiles differ"
+        print(f"{k:>4} | {len(events):>7,} | {t_loop * 1e3:>12.1f} | {t_fold * 1e3:>9.1f} | {t_loop / t_fold:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
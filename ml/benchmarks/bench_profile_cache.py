@@ -0,0 +1,115 @@
+"""
+Two-tier profile store (models/profile_cache.py): an LRU of hot profiles
+over a SQLite table, against the all-in-memory dict of records.
+
+A synthetic population of N users lives in SQLite; traffic is skewed
+the way it is in production — most requests come from a small active
+set. For several LRU sizes, the first half of the traffic warms the
+cache; over the second half, reports hit rate, cost per request,
+read-through p99, write-behind batch cost and memory held in Python.
+
+    python benchmarks/bench_profile_cache.py [n_users]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from models.profile_cache import ProfileCache
+from models.user_profile import PROFILE_KEYS, ProfileRecord
+
+N_USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+# 95% of requests come from 5% of users
+ACTIVE_FRACTION = 0.05
+ACTIVE_TRAFFIC = 0.95
+REQUESTS = 400_000
+# One feedback event per WRITE_EVERY requests, flushed every FLUSH_EVERY events
+WRITE_EVERY = 5
+FLUSH_EVERY = 256
+CACHE_SIZES = [10_000, 50_000, 200_000]
+
+
+def populate(path):
+    cache = ProfileCache(path, PROFILE_KEYS, ProfileRecord)
+    rng = np.random.default_rng(0)
+    values = np.round(rng.random((N_USERS, len(PROFILE_KEYS))), 3).tolist()
+    cache._writer.execute("BEGIN")
+    cache._writer.executemany(cache._upsert, ((f"user_{i}", *v) for i, v in enumerate(values)))
+    cache._writer.execute("COMMIT")
+    cache.close()
+
+
+def traffic(seed=1):
+    rng = random.Random(seed)
+    active = int(N_USERS * ACTIVE_FRACTION)
+    return [f"user_{rng.randrange(active) if rng.random() < ACTIVE_TRAFFIC else rng.randrange(N_USERS)}"
+            for _ in range(REQUESTS)]
+
+
+def run(cache, user_ids):
+    """get_profile per request, an EMA update every WRITE_EVERY, batched flushes."""
+    writes = 0
+    start = time.perf_counter()
+    for i, user_id in enumerate(user_ids):
+        profile = cache.get(user_id)
+        if i % WRITE_EVERY == 0:
+            cache[user_id] = profile.replace('category_food', round(profile['category_food'] * 0.9 + 0.1, 3))
+            writes += 1
+            if writes % FLUSH_EVERY == 0:
+                cache.flush()
+    cache.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    user_ids = traffic()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'profiles.db')
+        start = time.perf_counter()
+        populate(path)
+        print(f"\n{N_USERS:,} users in SQLite ({os.path.getsize(path) / 2**20:,.0f} MiB) "
+              f"in {time.perf_counter() - start:.1f}s; {REQUESTS:,} requests, "
+              f"{ACTIVE_TRAFFIC:.0%} from the {ACTIVE_FRACTION:.0%} most active users")
+
+        warm, measured = user_ids[:REQUESTS // 2], user_ids[REQUESTS // 2:]
+        print(f"\n{'LRU size':>9} | {'hit rate':>8} | {'us/request':>10} | {'read-through p99 ms':>19} | "
+              f"{'batch write p50 ms':>18} | {'RAM MiB':>7}")
+        print('-' * 89)
+        for size in CACHE_SIZES:
+            cache = ProfileCache(path, PROFILE_KEYS, ProfileRecord, capacity=size)
+            tracemalloc.start()
+            run(cache, warm)
+            before = cache.stats()
+            elapsed = run(cache, measured)
+            held, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = cache.stats()
+            cache.close()
+            hits, misses = (stats[k] - before[k] for k in ('hits', 'misses'))
+            print(f"{size:>9,} | {hits / (hits + misses):>8.1%} | {elapsed / len(measured) * 1e6:>10.1f} | "
+                  f"{stats['read_through_ms']['p99']:>19.3f} | {stats['write_batch_ms']['p50']:>18.2f} | "
+                  f"{held / 2**20:>7.1f}")
+
+        # Baseline: every profile resident, as the json backend keeps them
+        reader = ProfileCache(path, PROFILE_KEYS, ProfileRecord)
+        tracemalloc.start()
+        everyone = {user_id: ProfileRecord(values) for user_id, *values in
+                    reader._reader.execute(f"SELECT user_id, {', '.join(PROFILE_KEYS)} FROM profiles")}
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        reader.close()
+        start = time.perf_counter()
+        for user_id in user_ids:
+            everyone.get(user_id)
+        t_dict = (time.perf_counter() - start) / REQUESTS
+        print(f"\nall in memory (dict of records): {held / 2**20:,.0f} MiB, get {t_dict * 1e6:.2f} us")
+
+
+if __name__ == '__main__':
+    main()
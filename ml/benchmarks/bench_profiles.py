@@ -0,0 +1,152 @@
+"""
+User profile persistence: the old full-file rewrite per click vs the
+dirty-set flush into the write-ahead log.
+
+For growing stores, reports the write cost of one click under the old
+scheme (json.dump of every profile, indent=2) and of one flush of 100
+dirty users. The flush cost should stay flat as the store grows. Also
+checks that a reload (snapshot + log replay) restores every profile.
+
+Reads: get_profile() used to deepcopy the stored dict per call; it now
+returns the immutable ProfileRecord itself.
+
+Matrix backend (profile_matrix.py): memory for 1M users as a dict of
+records vs one N×6 float32 matrix, map-on-load time, and assembling a
+1,000-user batch for scoring per user vs one gather.
+
+    python benchmarks/bench_profiles.py
+"""
+
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from common import best_of
+from models import user_profile
+from models.profile_matrix import ProfileMatrix, load_matrix, write_matrix
+from models.wal import WriteAheadLog
+
+SIZES = [1_000, 10_000, 100_000]
+DIRTY = 100
+MATRIX_USERS = 1_000_000
+BATCH = 1_000
+CATEGORIES = ['food', 'outdoor', 'entertainment', 'culture']
+
+
+def fill(n, seed=0):
+    rng = random.Random(seed)
+    user_profile._profiles.clear()
+    for i in range(n):
+        user_profile._profiles[f"user_{i}"] = user_profile.ProfileRecord(
+            round(rng.random(), 3) for _ in user_profile.PROFILE_KEYS)
+
+
+def legacy_save(path):
+    """The pre-flush _save_profiles: every profile, every click."""
+    snapshot = {uid: dict(profile) for uid, profile in user_profile._profiles.items()}
+    with open(path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+
+
+def main():
+    rng = random.Random(1)
+    print(f"\n{'users':>8} | {'rewrite/click ms':>16} | {f'flush {DIRTY} dirty ms':>18} | {'reload OK':>9}")
+    print('-' * 62)
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()) as out:
+        rows = []
+        for n in SIZES:
+            path = os.path.join(tmp, f"profiles_{n}.json")
+            fill(n)
+            user_profile._wal = WriteAheadLog(path)
+            user_profile._save_profiles()
+
+            t_rewrite = best_of(lambda: legacy_save(path + '.legacy'), repeats=3)
+
+            def click_and_flush():
+                for _ in range(DIRTY):
+                    user_profile.update_profile(f"user_{rng.randrange(n)}", rng.choice(CATEGORIES), rng.random() < 0.5)
+                start = time.perf_counter()
+                user_profile.flush()
+                return time.perf_counter() - start
+            t_flush = min(click_and_flush() for _ in range(5))
+
+            expected = {uid: dict(p) for uid, p in user_profile._profiles.items()}
+            user_profile._wal.wait()
+            user_profile._wal.close()
+            user_profile._profiles.clear()
+            user_profile._wal = WriteAheadLog(path)
+            user_profile._PROFILES_PATH = path
+            user_profile._load_profiles()
+            rows.append((n, t_rewrite, t_flush, user_profile._profiles == expected))
+    for n, t_rewrite, t_flush, ok in rows:
+        print(f"{n:>8} | {t_rewrite * 1e3:>16.1f} | {t_flush * 1e3:>18.2f} | {'OK' if ok else 'MISMATCH':>9}")
+    assert all(ok for *_, ok in rows), out.getvalue()
+
+    legacy = {uid: dict(profile) for uid, profile in user_profile._profiles.items()}
+    uid = next(iter(legacy))
+    reads = 10_000
+    t_copy = best_of(lambda: [copy.deepcopy(legacy[uid]) for _ in range(reads)]) / reads
+    t_record = best_of(lambda: [user_profile.get_profile(uid) for _ in range(reads)]) / reads
+    print(f"\nget_profile: deepcopy {t_copy * 1e6:.2f} us -> shared record {t_record * 1e6:.2f} us "
+          f"({t_copy / t_record:.0f}x)")
+
+    matrix_backend()
+
+
+def traced(fn):
+    tracemalloc.start()
+    result = fn()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def matrix_backend():
+    keys, neutral = user_profile.PROFILE_KEYS, user_profile.NEUTRAL.values_tuple
+    uids = [f"user_{i}" for i in range(MATRIX_USERS)]
+    values = np.round(np.random.default_rng(0).random((MATRIX_USERS, len(keys))), 3).tolist()
+
+    # User-id strings are shared by both stores; allocate them outside the trace
+    records, dict_bytes = traced(lambda: {uid: user_profile.ProfileRecord(v) for uid, v in zip(uids, values)})
+
+    def build_matrix():
+        store = ProfileMatrix(keys, neutral, user_profile.ProfileRecord, capacity=MATRIX_USERS)
+        for uid, record in records.items():
+            store[uid] = record
+        return store
+    store, matrix_bytes = traced(build_matrix)
+    print(f"\n{MATRIX_USERS:,} users: dict of records {dict_bytes / 2**20:,.0f} MiB, "
+          f"ProfileMatrix {matrix_bytes / 2**20:,.0f} MiB in RAM "
+          f"({store.matrix.nbytes / 2**20:,.0f} MiB matrix + id index)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'profiles.bin')
+        write_matrix(path, store)
+        start = time.perf_counter()
+        (mapped, _), mapped_bytes = traced(lambda: load_matrix(path, keys, neutral, user_profile.ProfileRecord))
+        t_map = time.perf_counter() - start
+        print(f"load: map {os.path.getsize(path) / 2**20:,.0f} MiB file in {t_map * 1e3:.1f} ms "
+              f"({mapped_bytes / 2**10:,.0f} KiB allocated)")
+
+        batch = random.Random(2).sample(uids, BATCH)
+        expected = np.array([records[uid].values_tuple for uid in batch], dtype=np.float32)
+        assert np.array_equal(mapped.gather(batch), expected)
+        t_each = best_of(lambda: np.array([records[uid].values_tuple for uid in batch], dtype=np.float32))
+        t_gather = best_of(lambda: mapped.gather(batch))
+        t_ram = best_of(lambda: store.gather(batch))
+        print(f"{BATCH:,}-user scoring batch: per-user records {t_each * 1e3:.2f} ms, "
+              f"gather {t_ram * 1e3:.2f} ms in RAM / {t_gather * 1e3:.2f} ms mapped")
+        del mapped
+
+
+if __name__ == '__main__':
+    main()
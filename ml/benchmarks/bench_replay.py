@@ -0,0 +1,96 @@
+"""
+Offline replay throughput: models/bandit_replay.py vs driving the live
+API methods (sample_scores + update) one request at a time.
+
+Also reports how the decision batch size trades speed for regret (a
+batch decides on the posterior as of its start), and runs a logged
+(rejection) replay of feedback recorded by the simulated run.
+
+    python benchmarks/bench_replay.py [n_events]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from models.bandit_replay import load_events, replay, write_logged, write_synthetic
+from models.thompson import ContextualThompsonSampling
+
+N_EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+PER_REQUEST_EVENTS = 20_000
+BATCHES = [64, 1_024, 8_192, 65_536]
+
+
+def fresh_bandit(tmp, name, seed=0):
+    with contextlib.redirect_stdout(io.StringIO()):
+        bandit = ContextualThompsonSampling(persist_path=os.path.join(tmp, f"{name}.bin"),
+                                            seed=seed, max_arms=0)
+    return bandit
+
+
+def per_request(bandit, path, n):
+    """The live path: one sample_scores + one update() per request."""
+    events, meta = load_events(path)
+    categories = [str(c) for c in meta['categories']]
+    place_category, ctr = meta['place_category'], meta['ctr']
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for event in events[:n]:
+        cands = event['candidates'].tolist()
+        pids = [f"place_{c}" for c in cands]
+        cats = [categories[place_category[c]] for c in cands]
+        scores = bandit.sample_scores(pids, cats, int(event['hour']))
+        best = max(range(len(pids)), key=lambda i: scores[pids[i]])
+        reward = int(rng.random() < ctr[cands[best], event['hour']])
+        bandit.update(pids[best], cats[best], int(event['hour']), reward)
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.npy')
+        start = time.perf_counter()
+        write_synthetic(path, N_EVENTS)
+        print(f"\nwrote {N_EVENTS:,} synthetic requests in {time.perf_counter() - start:.1f}s")
+
+        t_live = per_request(fresh_bandit(tmp, 'live'), path, PER_REQUEST_EVENTS)
+        print(f"live API path (sample_scores + update): {PER_REQUEST_EVENTS / t_live:,.0f} events/s")
+
+        baseline = replay(fresh_bandit(tmp, 'random'), path, policy='random')
+        print(f"random policy: CTR {baseline['ctr']:.4f}, regret/request {baseline['regret_per_request']:.4f}")
+
+        print(f"\n{'batch':>7} | {'events/s':>11} | {'vs live':>7} | {'CTR':>6} | {'regret/req':>10}")
+        print('-' * 54)
+        for batch in BATCHES:
+            report = replay(fresh_bandit(tmp, f"b{batch}"), path, batch=batch)
+            speedup = report['events_per_second'] * t_live / PER_REQUEST_EVENTS
+            print(f"{batch:>7,} | {report['events_per_second']:>11,} | {speedup:>6.0f}x | "
+                  f"{report['ctr']:>6.4f} | {report['regret_per_request']:>10.4f}")
+
+        # Logged mode: the WAL a uniformly random logging policy would have left
+        events, meta = load_events(path)
+        n = min(N_EVENTS, 1_000_000)
+        rng = np.random.default_rng(1)
+        shown = events['candidates'][np.arange(n), rng.integers(0, events['candidates'].shape[1], n)]
+        hours = events['hour'][:n]
+        rewards = (rng.random(n) < meta['ctr'][shown, hours]).astype(int)
+        periods = ['night'] * 6 + ['morning'] * 5 + ['afternoon'] * 6 + ['evening'] * 4 + ['night'] * 3
+        categories = [str(c) for c in meta['categories']]
+        records = ([f"place_{p}", f"{periods[h]}_{categories[meta['place_category'][p]]}", r, t]
+                   for p, h, r, t in zip(shown.tolist(), hours.tolist(), rewards.tolist(),
+                                         events['time'][:n].tolist()))
+        logged = write_logged(records, os.path.join(tmp, 'logged.npy'))
+        report = replay(fresh_bandit(tmp, 'logged'), logged)
+        print(f"\nlogged replay of {n:,} uniformly logged events: matched {report['match_rate']:.1%}, "
+              f"CTR {report['ctr']:.4f} (logging policy {rewards.mean():.4f}), "
+              f"{report['events_per_second']:,} events/s")
+
+
+if __name__ == '__main__':
+    main()
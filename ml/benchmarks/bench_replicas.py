@@ -0,0 +1,132 @@
+"""
+Replica sync: do replicas that each see a slice of the feedback converge?
+
+Three replicas share a temp sync directory. Feedback is split across
+them at random; after each burst they run a sync round in a random
+order. At the end every replica must hold the same arms as one bandit
+that saw all of the feedback.
+
+Also checked:
+  - merge is commutative and idempotent: applying the same deltas in
+    shuffled order, twice, gives the same counters
+  - restart: a replica reloaded from disk keeps its counters, and
+    re-reading every delta file doesn't double count
+  - bytes shipped per round vs the full snapshot
+
+    python benchmarks/bench_replicas.py
+"""
+
+import contextlib
+import glob
+import io
+import os
+import random
+import tempfile
+import time
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from models.replica_sync import DirectorySync, ReplicaCounters, totals
+from models.thompson import ContextualThompsonSampling
+
+REPLICAS = ['replica-a', 'replica-b', 'replica-c']
+CATEGORIES = ['food', 'outdoor', 'entertainment', 'culture']
+ROUNDS = 20
+EVENTS_PER_ROUND = 2_000
+
+
+def make_events(n, rng):
+    return [(f"place_{rng.randrange(5_000)}", rng.choice(CATEGORIES), rng.randrange(24),
+             int(rng.random() < 0.3)) for _ in range(n)]
+
+
+def apply(bandit, events):
+    if events:
+        bandit.update_many(*zip(*events))
+
+
+def arms(bandit):
+    return {key: (s['alpha'], s['beta']) for key, s in bandit.get_all_stats().items()}
+
+
+def check_merge_laws(rng):
+    """Shuffled, duplicated delivery of the same deltas → identical counters."""
+    sources = []
+    for name in REPLICAS:
+        counters = ReplicaCounters(name)
+        counters.record([f"p{rng.randrange(50)}|morning_food" for _ in range(500)],
+                        [rng.random() < 0.4 for _ in range(500)])
+        sources.append(counters.delta())
+
+    results = []
+    for _ in range(5):
+        target = ReplicaCounters('observer')
+        deltas = sources * 2
+        rng.shuffle(deltas)
+        for delta in deltas:
+            target.merge(delta)
+        results.append(target.counts)
+    return all(r == results[0] for r in results)
+
+
+def main():
+    rng = random.Random(0)
+    assert check_merge_laws(rng), "merge is not order-independent / idempotent"
+    print("\nmerge laws (shuffled + duplicated deltas): OK")
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        sync_dir = os.path.join(tmp, 'sync')
+
+        def open_replica(name):
+            bandit = ContextualThompsonSampling(persist_path=os.path.join(tmp, name, 'state.bin'),
+                                                replica_id=name)
+            return bandit, DirectorySync(bandit, sync_dir, keep_files=8)
+
+        replicas = {name: open_replica(name) for name in REPLICAS}
+        reference = ContextualThompsonSampling(persist_path=os.path.join(tmp, 'reference.bin'))
+
+        shipped, sync_seconds = 0, 0.0
+        for _ in range(ROUNDS):
+            events = make_events(EVENTS_PER_ROUND, rng)
+            apply(reference, events)
+            shares = {name: [] for name in REPLICAS}
+            for event in events:
+                shares[rng.choice(REPLICAS)].append(event)
+            for name, (bandit, _) in replicas.items():
+                apply(bandit, shares[name])
+
+            before = {p: os.path.getsize(p) for p in glob.glob(os.path.join(sync_dir, '*', '*.json'))}
+            order = list(replicas.values())
+            rng.shuffle(order)
+            start = time.perf_counter()
+            # Two passes: deltas written late in the first pass reach everyone in the second
+            for _, sync in order + order:
+                sync.sync_once()
+            sync_seconds += time.perf_counter() - start
+            shipped += sum(os.path.getsize(p) for p in glob.glob(os.path.join(sync_dir, '*', '*.json'))
+                           if p not in before)
+
+        expected = arms(reference)
+        converged = all(arms(bandit) == expected for bandit, _ in replicas.values())
+
+        # Restart one replica from disk and re-read every delta file from scratch
+        bandit, sync = replicas['replica-b']
+        bandit.close()
+        restarted, resync = open_replica('replica-b')
+        resync.sync_once()
+        restart_ok = (arms(restarted) == expected
+                      and totals(restarted.replicas.counts) == totals(replicas['replica-a'][0].replicas.counts))
+
+        reference.close()
+        reference._write_snapshot(reference.persist_path, reference.store, 0)
+        full_bytes = os.path.getsize(reference.persist_path)
+
+    print(f"{len(REPLICAS)} replicas, {ROUNDS} rounds x {EVENTS_PER_ROUND:,} events, {len(expected):,} arms")
+    print(f"  converged to the single-bandit posterior: {'OK' if converged else 'MISMATCH'}")
+    print(f"  restart + full re-read (no double count): {'OK' if restart_ok else 'MISMATCH'}")
+    print(f"  deltas shipped per round: {shipped / ROUNDS / 1024:,.1f} KiB "
+          f"(full snapshot {full_bytes / 1024:,.1f} KiB), sync round {sync_seconds / ROUNDS * 1e3:.1f} ms")
+    assert converged and restart_ok
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Per-candidate scoring cost: per-row predict_proba loop vs one batched call.
+
+The loop is the pre-batching predict_scores: extract_features + one
+predict_proba per activity. The batch path is the current predict_scores:
+one feature matrix, one predict_proba, scores attached by index.
+
+    python benchmarks/bench_scoring.py
+"""
+
+import numpy as np
+
+from common import load_recommender, make_candidates, best_of, REQUEST_PREFS, REQUEST_CONTEXT
+
+SIZES = [10, 100, 1_000, 10_000]
+
+
+def score_loop(recommender, activities, user_prefs, context):
+    """The old predict_scores: one predict_proba call per activity."""
+    scored = []
+    for activity in activities:
+        act_context = recommender._activity_context(activity, context)
+        features = recommender.extract_features(activity, user_prefs, act_context)
+        score = recommender.model.predict_proba(features.reshape(1, -1))[0][1]
+        scored.append({**activity, 'ml_score': float(score)})
+    return scored
+
+
+def main():
+    recommender = load_recommender()
+
+    print(f"\n{'n':>7} | {'loop us/cand':>12} | {'batch us/cand':>13} | {'speedup':>7}")
+    print('-' * 50)
+    for n in SIZES:
+        activities = make_candidates(n)
+
+        loop = score_loop(recommender, activities, REQUEST_PREFS, REQUEST_CONTEXT)
+        batch = recommender.predict_scores(activities, REQUEST_PREFS, REQUEST_CONTEXT)
+        diff = np.abs(np.array([a['ml_score'] for a in loop]) -
+                      np.array([a['ml_score'] for a in batch])).max()
+        assert diff < 1e-9, f"batch scores drifted from the loop by {diff}"
+
+        repeats = 1 if n >= 10_000 else 3
+        t_loop = best_of(lambda: score_loop(recommender, activities, REQUEST_PREFS, REQUEST_CONTEXT), repeats)
+        t_batch = best_of(lambda: recommender.predict_scores(activities, REQUEST_PREFS, REQUEST_CONTEXT))
+
+        print(f"{n:>7} | {t_loop / n * 1e6:>12.1f} | {t_batch / n * 1e6:>13.2f} | {t_loop / t_batch:>6.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Shared-memory bandit (ML_SHARED_STATE=1) across worker processes.
+
+Spawns N worker processes attached to one SharedContextualThompsonSampling
+segment. Each applies UPDATES single-event updates to a small set of
+hot arms (maximum lock contention) and then samples a 1k-candidate
+list. The parent checks that no update was lost: the summed
+observations must equal N × UPDATES.
+
+    python benchmarks/bench_shared_bandit.py
+"""
+
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import common  # noqa: F401  (puts ml/ on sys.path)
+from common import best_of
+from models.shared_bandit import SharedContextualThompsonSampling
+
+NAME = f"bench_bandit_{os.getpid()}"
+UPDATES = 2_000
+WORKERS = [1, 2, 4]
+
+
+def worker(path, name, n, ready, results):
+    bandit = SharedContextualThompsonSampling(persist_path=path, name=name, capacity=1 << 16)
+    ready.wait()
+    start = time.perf_counter()
+    for i in range(n):
+        bandit.update(f"place_{i % 50}", ['food', 'outdoor'][i % 2], 9, i % 3 == 0)
+    elapsed = time.perf_counter() - start
+    candidates = [f"place_{i}" for i in range(1_000)]
+    t_sample = best_of(lambda: bandit.sample_scores(candidates, ['food'] * 1_000, 9))
+    results.put((elapsed, t_sample))
+    bandit.close()
+
+
+def run(tmp, workers):
+    path = os.path.join(tmp, f"shared_{workers}.bin")
+    ctx = mp.get_context('spawn')
+    ready, results = ctx.Event(), ctx.Queue()
+    owner = SharedContextualThompsonSampling(persist_path=path, name=NAME, capacity=1 << 16)
+    procs = [ctx.Process(target=worker, args=(path, NAME, UPDATES, ready, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    time.sleep(1.0)   # let every worker attach before the clock starts
+    start = time.perf_counter()
+    ready.set()
+    stats = [results.get() for _ in procs]
+    wall = time.perf_counter() - start
+    for p in procs:
+        p.join()
+
+    observed = sum(s['observations'] for s in owner.get_all_stats().values())
+    owner._stop.set()
+    owner.table.close()
+    assert observed == workers * UPDATES, f"lost updates: {observed} != {workers * UPDATES}"
+    sample_ms = min(t for _, t in stats) * 1e3
+    return workers * UPDATES / wall, sample_ms
+
+
+def main():
+    print(f"\n{'workers':>7} | {'updates/s (all)':>15} | {'sample 1k ms':>12} | lost updates")
+    print('-' * 56)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in WORKERS:
+            rate, sample_ms = run(tmp, n)
+            print(f"{n:>7} | {rate:>15,.0f} | {sample_ms:>12.2f} | 0")
+
+
+if __name__ == '__main__':
+    main()
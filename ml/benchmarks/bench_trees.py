@@ -0,0 +1,42 @@
+"""
+CompiledForest (pure NumPy) vs LGBMClassifier.predict_proba.
+
+Checks agreement to 1e-6 on synthetic feature matrices, then reports
+latency per call at several batch sizes.
+
+    python benchmarks/bench_trees.py
+"""
+
+import numpy as np
+
+from common import load_recommender, make_candidates, best_of, REQUEST_PREFS, REQUEST_CONTEXT
+from models.tree_evaluator import CompiledForest
+
+SIZES = [1, 10, 100, 1_000, 10_000]
+
+
+def main():
+    recommender = load_recommender()
+    forest = CompiledForest.from_lgbm(recommender.model)
+    print(f"[OK] Compiled {len(forest.roots)} trees, {len(forest.feature)} nodes, depth {forest.max_depth}")
+
+    print(f"\n{'n':>7} | {'predict_proba ms':>16} | {'compiled ms':>11} | {'speedup':>7} | {'max |diff|':>10}")
+    print('-' * 66)
+    for n in SIZES:
+        activities = make_candidates(n)
+        contexts = [recommender._activity_context(a, REQUEST_CONTEXT) for a in activities]
+        X = recommender.extract_features_batch(activities, REQUEST_PREFS, contexts)
+
+        expected = recommender.model.predict_proba(X)[:, 1]
+        actual = forest.predict_proba(X)[:, 1]
+        diff = np.abs(expected - actual).max()
+        assert diff < 1e-6, f"compiled trees disagree with predict_proba by {diff}"
+
+        t_lgbm = best_of(lambda: recommender.model.predict_proba(X), 20)
+        t_forest = best_of(lambda: forest.predict_proba(X), 20)
+        print(f"{n:>7} | {t_lgbm * 1e3:>16.3f} | {t_forest * 1e3:>11.3f} | "
+              f"{t_lgbm / t_forest:>6.1f}x | {diff:>10.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Shared setup for the benchmark scripts.
+
+Run any benchmark from the ml/ directory, e.g.:
+    python benchmarks/bench_scoring.py
+"""
+
+import os
+import random
+import sys
+import time
+import warnings
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from models.RFC import LightGBMRecommender
+from utils.generate_training_data import generate_synthetic_data
+
+ML_DIR = os.path.join(os.path.dirname(__file__), '..')
+MODEL_PATH = os.path.join(ML_DIR, 'models', 'trained', 'lightgbm_ranker.pkl')
+
+# Fitted-feature-name warnings from sklearn would drown the tables
+warnings.filterwarnings('ignore', category=UserWarning)
+
+
+def load_recommender():
+    """Load the trained ranker, or train a fresh one if none is on disk."""
+    recommender = LightGBMRecommender()
+    if os.path.exists(MODEL_PATH):
+        recommender.load_model(MODEL_PATH)
+    else:
+        print("[INFO] No trained model — training on synthetic data for the benchmark")
+        random.seed(42)
+        recommender.train(generate_synthetic_data(n_samples=2000))
+    return recommender
+
+
+def make_candidates(n, seed=0):
+    """n synthetic candidates shaped like the server's /recommend payload."""
+    rng = random.Random(seed)
+    samples = generate_synthetic_data(n_samples=n)
+    activities = []
+    for i, sample in enumerate(samples):
+        activity = sample['activity']
+        activity['id'] = f'place_{i}'
+        activity['travelMinutes'] = rng.randint(2, 40)
+        activity['isOpen'] = rng.random() > 0.1
+        activities.append(activity)
+    return activities
+
+
+REQUEST_PREFS = {'preferences': ['food', 'outdoor'], 'priceLevel': 2, 'duration': 2.0}
+REQUEST_CONTEXT = {'hour': 18, 'day_of_week': 4, 'weather': 'clear', 'travel_mode': 'walking'}
+
+
+def best_of(fn, repeats=5):
+    """Best wall-clock time of fn() in seconds (min is the least noisy)."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -19,15 +19,114 @@
 
 import numpy as np
 import math
-import lightgbm as lgb
-import joblib
 import os
+from collections.abc import Mapping
 from datetime import datetime
 
+from models.telemetry import missing_fields
+from models.topk import top_k_indices, StreamingTopK
+from models.tree_evaluator import CompiledForest
+
+# lightgbm / joblib are imported lazily (train, pickle load) so a service
+# serving the compiled .npz trees never loads the LightGBM runtime.
+
+# =============================================================
+# Lookup tables — shared by the per-row and batch feature paths
+# =============================================================
+
+CATEGORIES = ['food', 'outdoor', 'entertainment', 'culture']
+CATEGORY_INDEX = {cat: i for i, cat in enumerate(CATEGORIES)}
+UNKNOWN_CATEGORY = len(CATEGORIES)   # row index for anything else
+
+# Distance-decay lambda per travel mode (unknown modes use 0.5)
+DISTANCE_LAMBDAS = {'walking': 0.8, 'bicycle': 0.35, 'driving': 0.15, 'transit': 0.25}
+
+# Category × [morning 6-11, afternoon 11-17, evening 17-21, night 21-6]
+TIME_MATRIX = {
+    'food':          [0.6, 0.9, 1.0, 0.5],
+    'outdoor':       [0.7, 1.0, 0.6, 0.1],
+    'entertainment': [0.3, 0.7, 1.0, 0.8],
+    'culture':       [0.5, 1.0, 0.7, 0.1],
+}
+DEFAULT_TIME_ROW = [0.5, 0.5, 0.5, 0.5]
+
+# Rows follow CATEGORY_INDEX; the last row is the unknown-category default
+_TIME_TABLE = np.array([TIME_MATRIX[c] for c in CATEGORIES] + [DEFAULT_TIME_ROW])
+
+WEATHER_SCORES = {
+    'clear': 1.0,
+    'sunny': 1.0,
+    'clouds': 0.7,
+    'partly_cloudy': 0.8,
+    'overcast': 0.5,
+    'rain': 0.1,
+    'drizzle': 0.2,
+    'snow': 0.2,
+    'thunderstorm': 0.0,
+}
+
+# Rough travel speed used to turn travelMinutes into km for distance decay
+SPEED_KM_PER_MIN = {'walking': 0.07, 'driving': 0.5, 'transit': 0.3}
+
+_LOG_1001 = math.log(1 + 1000)
+
+# Vibe columns and their defaults, in feature order
+VIBE_DEFAULTS = [
+    ('vibe_chill', 0.5), ('vibe_social', 0.5), ('vibe_studious', 0.3),
+    ('vibe_trendy', 0.3), ('vibe_date_spot', 0.3), ('vibe_budget_friendly', 0.5),
+]
+
+# Place-static block layout (see _compute_place_block / PlaceFeatureCache)
+PB_QUALITY = 0
+PB_TRENDING = 1
+PB_ONEHOT = slice(2, 6)
+PB_VIBE = slice(6, 12)
+PB_CATEGORY = 12     # category index (UNKNOWN_CATEGORY for anything else)
+PB_PRICE = 13        # raw priceLevel
+PB_DURATION = 14     # raw typicalDuration
+PLACE_BLOCK_WIDTH = 15
+
+
+def _column(source, key, default, n):
+    """
+    Pull one field for every row as a float64 array.
+
+    `source` is either a single dict (or other Mapping, e.g. a
+    ProfileRecord) shared by all n rows (one request) or a list of
+    per-row dicts (training samples). None rows act like {}.
+    """
+    if source is None or isinstance(source, Mapping):
+        value = (source or {}).get(key, default)
+        return np.full(n, value, dtype=np.float64)
+    return np.array([(row or {}).get(key, default) for row in source], dtype=np.float64)
+
+
+def _labels(source, key, default, n):
+    """Same as _column, but for string fields (category, weather, mode)."""
+    if source is None or isinstance(source, Mapping):
+        return [(source or {}).get(key, default)] * n
+    return [(row or {}).get(key, default) for row in source]
+
+
+def _apply_unique(values, fn):
+    """
+    Evaluate a scalar math function once per distinct value.
+
+    Keeps math.log / math.exp bit-identical to the per-row path while
+    only paying for distinct review counts / distances.
+    """
+    uniq, inverse = np.unique(values, return_inverse=True)
+    mapped = np.array([fn(v) for v in uniq.tolist()], dtype=np.float64)
+    return mapped[inverse]
+
 
 class LightGBMRecommender:
-    def __init__(self):
+    def __init__(self, place_cache=None):
         self.model = None
+        # Optional PlaceFeatureCache for the place-static feature block
+        self.place_cache = place_cache
+        # Optional process pool that runs inference (api/process_pool.py)
+        self.inference_pool = None
         self.feature_names = [
             # --- Place quality signals ---
             'composite_quality',      # rating * log(reviews) — Bayesian average
@@ -83,7 +182,7 @@ class LightGBMRecommender:
 
         Inspired by IMDB's Top 250 weighted rating formula.
         """
-        confidence = math.log(1 + review_count) / math.log(1 + 1000)
+        confidence = math.log(1 + review_count) / _LOG_1001
         return (rating / 5.0) * min(confidence, 1.0)
 
     def distance_decay_score(self, distance_km, travel_mode='walking'):
@@ -98,8 +197,7 @@ class LightGBMRecommender:
           driving:  lambda=0.15 (5km=0.47, 10km=0.22)
           transit:  lambda=0.25 (3km=0.47, 5km=0.29)
         """
-        lambdas = {'walking': 0.8, 'bicycle': 0.35, 'driving': 0.15, 'transit': 0.25}
-        lam = lambdas.get(travel_mode, 0.5)
+        lam = DISTANCE_LAMBDAS.get(travel_mode, 0.5)
         return math.exp(-lam * distance_km)
 
     def time_appropriateness_score(self, category, hour):
@@ -112,20 +210,12 @@ class LightGBMRecommender:
         Returns 0.0-1.0 based on a hand-tuned matrix encoding
         domain knowledge about college-student temporal behavior.
         """
-        # [morning 6-11, afternoon 11-17, evening 17-21, night 21-6]
-        MATRIX = {
-            'food':          [0.6, 0.9, 1.0, 0.5],
-            'outdoor':       [0.7, 1.0, 0.6, 0.1],
-            'entertainment': [0.3, 0.7, 1.0, 0.8],
-            'culture':       [0.5, 1.0, 0.7, 0.1],
-        }
-
         if 6 <= hour < 11:     period = 0
         elif 11 <= hour < 17:  period = 1
         elif 17 <= hour < 21:  period = 2
         else:                  period = 3
 
-        return MATRIX.get(category, [0.5, 0.5, 0.5, 0.5])[period]
+        return TIME_MATRIX.get(category, DEFAULT_TIME_ROW)[period]
 
     def duration_efficiency_score(self, typical_duration, available_duration):
         """
@@ -161,8 +251,7 @@ class LightGBMRecommender:
         Instead of needing many splits to learn "bar AND night → boost",
         this single feature encodes it directly.
         """
-        cat_map = {'food': 0, 'outdoor': 1, 'entertainment': 2, 'culture': 3}
-        cat_num = cat_map.get(category, 2)
+        cat_num = CATEGORY_INDEX.get(category, 2)
         hour_norm = hour / 24.0
         return cat_num * 0.25 + hour_norm * 0.75
 
@@ -197,25 +286,17 @@ class LightGBMRecommender:
         outdoor_categories = ['outdoor']
         if category not in outdoor_categories:
             return 0.5  # weather doesn't matter for indoor places
-
-        weather_scores = {
-            'clear': 1.0,
-            'sunny': 1.0,
-            'clouds': 0.7,
-            'partly_cloudy': 0.8,
-            'overcast': 0.5,
-            'rain': 0.1,
-            'drizzle': 0.2,
-            'snow': 0.2,
-            'thunderstorm': 0.0,
-        }
-        return weather_scores.get(weather, 0.5)
+        return WEATHER_SCORES.get(weather, 0.5)
 
     # =============================================================
     # Feature Extraction — builds the full 14-feature vector
     # =============================================================
 
-    def extract_features(self, activity, user_prefs, context=None, user_profile=None):
+    def _record_missing_fields(self, activities, source):
+        """Count critical fields that will be defaulted (see models/telemetry.py)."""
+        missing_fields.record_activities(activities, source)
+
+    def extract_features(self, activity, user_prefs, context=None, user_profile=None, source='features'):
         """
         Extract 20 numerical features from activity, user prefs, context, and user profile.
 
@@ -235,14 +316,7 @@ class LightGBMRecommender:
         category = activity.get('category', 'entertainment')
         hour = context.get('hour', datetime.now().hour)
 
-        # Log when critical fields are defaulted — helps debug weird rankings
-        aid = activity.get('id', '?')
-        if 'rating' not in activity:
-            print(f"[WARN] {aid}: no rating, defaulting to 3.0")
-        if 'userRatingsTotal' not in activity:
-            print(f"[WARN] {aid}: no review count, defaulting to 100")
-        if 'category' not in activity:
-            print(f"[WARN] {aid}: no category, defaulting to entertainment")
+        self._record_missing_fields([activity], source)
 
         # --- Place quality signals ---
         composite_quality = self.composite_quality_score(rating, review_count)
@@ -339,6 +413,231 @@ class LightGBMRecommender:
             vibe_budget,
         ])
 
+    def _compute_place_block(self, activities):
+        """
+        Place-static columns for a list of activities, (n, PLACE_BLOCK_WIDTH).
+
+        Everything here depends only on the place itself, which is what
+        makes it cacheable across users and requests (see PlaceFeatureCache).
+        """
+        n = len(activities)
+        block = np.empty((n, PLACE_BLOCK_WIDTH), dtype=np.float64)
+        if n == 0:
+            return block
+
+        rating = _column(activities, 'rating', 3.0, n)
+        review_count = _column(activities, 'userRatingsTotal', 100, n)
+        cat_idx = np.array([CATEGORY_INDEX.get(c, UNKNOWN_CATEGORY)
+                            for c in _labels(activities, 'category', 'entertainment', n)])
+
+        # --- Place quality signals ---
+        confidence = _apply_unique(review_count, lambda rc: math.log(1 + rc)) / _LOG_1001
+        block[:, PB_QUALITY] = (rating / 5.0) * np.minimum(confidence, 1.0)
+        block[:, PB_TRENDING] = np.select(
+            [review_count < 10,
+             (review_count < 50) & (rating >= 4.3),
+             (review_count < 200) & (rating >= 4.0),
+             (review_count > 500) & (rating >= 4.0)],
+            [0.3, 0.9, 0.7, 0.5],
+            default=0.4,
+        )
+
+        # --- Category one-hot (unknown category → all zeros) ---
+        block[:, PB_ONEHOT] = cat_idx[:, None] == np.arange(len(CATEGORIES))
+
+        # --- Vibe profile features (6D atmosphere vector) ---
+        for col, (key, default) in zip(range(PB_VIBE.start, PB_VIBE.stop), VIBE_DEFAULTS):
+            block[:, col] = _column(activities, key, default, n)
+
+        # Raw attributes the context / user columns are built from
+        block[:, PB_CATEGORY] = cat_idx
+        block[:, PB_PRICE] = _column(activities, 'priceLevel', 2, n)
+        block[:, PB_DURATION] = _column(activities, 'typicalDuration', 1.0, n)
+        return block
+
+    def place_static_block(self, activities):
+        """Place-static block, served from self.place_cache when one is attached."""
+        if self.place_cache is None:
+            return self._compute_place_block(activities)
+        return self.place_cache.get_block(activities, self._compute_place_block)
+
+    def extract_features_batch(self, activities, user_prefs, context=None, user_profile=None,
+                               source='features'):
+        """
+        Vectorized extract_features for many activities at once.
+
+        Returns an (n, 26) float32 matrix whose rows equal
+        extract_features(...) for each activity. Instead of one np.array
+        per activity, every feature is computed as a NumPy column:
+        category / weather / time-of-day become table lookups, and
+        math.log / math.exp run once per distinct review count / distance.
+
+        user_prefs, context and user_profile may each be a single dict
+        shared by all rows (one request) or a list with one dict per row
+        (training samples, per-place travel distance).
+
+        Place-only columns come from place_static_block(), so with a
+        place cache attached only the context and user columns are
+        computed per request.
+        """
+        n = len(activities)
+        features = np.empty((n, len(self.feature_names)), dtype=np.float32)
+        if n == 0:
+            return features
+
+        self._record_missing_fields(activities, source)
+
+        place = self.place_static_block(activities)
+        context_cols = self._context_columns(place, user_prefs, context)
+        user_affinity, user_price_sens = self._user_columns(user_profile, n)
+        cat_idx = place[:, PB_CATEGORY].astype(np.intp)
+
+        features[:, 0] = place[:, PB_QUALITY]
+        features[:, 1] = context_cols[:, 0]
+        features[:, 2] = place[:, PB_TRENDING]
+        features[:, 3:10] = context_cols[:, 1:]
+        features[:, 10:14] = place[:, PB_ONEHOT]
+        features[:, 14:18] = user_affinity
+
+        # User price match: how close is user's price preference to this place?
+        features[:, 18] = 1.0 - np.abs(user_price_sens - (place[:, PB_PRICE] / 4.0))
+
+        # Cross-feature: pick this row's category column, 0.5 when unknown
+        padded = np.column_stack([user_affinity, np.full(n, 0.5)])
+        features[:, 19] = padded[np.arange(n), cat_idx]
+
+        features[:, 20:26] = place[:, PB_VIBE]
+        return features
+
+    def _context_columns(self, place, user_prefs, context):
+        """
+        Request/context columns for each place row, (n, 8) float64:
+        price_match, distance_decay, time_appropriateness,
+        duration_efficiency, category_time_interaction,
+        weather_outdoor_match, day_of_week, is_open.
+
+        Shared by every user scored against the same places.
+        """
+        n = len(place)
+        cat_idx = place[:, PB_CATEGORY].astype(np.intp)
+        cols = np.empty((n, 8), dtype=np.float64)
+
+        # Defaults that depend on the clock are resolved once per batch
+        now = datetime.now()
+        hour = _column(context, 'hour', now.hour, n)
+
+        user_price = _column(user_prefs, 'priceLevel', 2, n)
+        cols[:, 0] = 1 - np.abs(place[:, PB_PRICE] - user_price) / 3.0
+
+        distance_km = _column(context, 'distance_km', 1.0, n)
+        lam = np.array([DISTANCE_LAMBDAS.get(m, 0.5)
+                        for m in _labels(context, 'travel_mode', 'walking', n)])
+        cols[:, 1] = _apply_unique(-lam * distance_km, math.exp)
+
+        period = np.select([(hour >= 6) & (hour < 11),
+                            (hour >= 11) & (hour < 17),
+                            (hour >= 17) & (hour < 21)],
+                           [0, 1, 2], default=3)
+        cols[:, 2] = _TIME_TABLE[cat_idx, period]
+
+        typical_dur = place[:, PB_DURATION]
+        available_dur = _column(user_prefs, 'duration', 2.0, n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fill_ratio = typical_dur / available_dur
+        cols[:, 3] = np.select(
+            [available_dur <= 0,
+             fill_ratio > 1.0,
+             (fill_ratio >= 0.5) & (fill_ratio <= 0.9),
+             fill_ratio < 0.3,
+             fill_ratio > 0.95],
+            [0.5, 0.0, 1.0, 0.3, 0.6],
+            default=0.7,
+        )
+
+        # Unknown categories count as entertainment (2) in the cross feature
+        cat_num = np.where(cat_idx == UNKNOWN_CATEGORY, 2, cat_idx)
+        cols[:, 4] = cat_num * 0.25 + (hour / 24.0) * 0.75
+
+        weather = _labels(context, 'weather', 'clear', n)
+        cols[:, 5] = np.where(
+            cat_idx == CATEGORY_INDEX['outdoor'],
+            [WEATHER_SCORES.get(w, 0.5) for w in weather],
+            0.5,
+        )
+
+        cols[:, 6] = _column(context, 'day_of_week', now.weekday(), n) / 6.0
+
+        if context is None or isinstance(context, dict):
+            cols[:, 7] = 1.0 if (context or {}).get('is_open', True) else 0.0
+        else:
+            cols[:, 7] = [1.0 if (c or {}).get('is_open', True) else 0.0 for c in context]
+        return cols
+
+    def _user_columns(self, user_profile, n):
+        """
+        Per-row category affinities (n, 4) and price sensitivity (n,).
+
+        `user_profile` may also be an (n, 6) profile matrix (columns in
+        user_profile.PROFILE_KEYS order, e.g. from get_profile_matrix()).
+        """
+        if isinstance(user_profile, np.ndarray):
+            # Stored rounded to 3 decimals: round the float32 back to the exact values
+            matrix = np.round(user_profile.astype(np.float64), 3)
+            return matrix[:, :4], matrix[:, 4]
+        affinity = np.column_stack([
+            _column(user_profile, f'category_{cat}', 0.5, n) for cat in CATEGORIES
+        ])
+        return affinity, _column(user_profile, 'price_sensitivity', 0.5, n)
+
+    def extract_features_matrix(self, activities, user_profiles, user_prefs, context=None,
+                                source='features'):
+        """
+        Features for every (user, place) pair, shape (U, M, 26) float32.
+
+        The place block and the context columns are computed once for the
+        M places, the user columns once for the U profiles; the two cross
+        features (user_price_match, user_category_affinity) are built by
+        broadcasting users against places. Row [u, m] equals
+        extract_features(activities[m], user_prefs, context, user_profiles[u]).
+        `user_profiles` is a list of profiles or an (U, 6) profile matrix.
+        """
+        n_users, n_places = len(user_profiles), len(activities)
+        features = np.empty((n_users, n_places, len(self.feature_names)), dtype=np.float32)
+        if n_users == 0 or n_places == 0:
+            return features
+
+        self._record_missing_fields(activities, source)
+
+        place = self.place_static_block(activities)
+        context_cols = self._context_columns(place, user_prefs, context)
+        if not isinstance(user_profiles, np.ndarray):
+            user_profiles = list(user_profiles)
+        user_affinity, user_price_sens = self._user_columns(user_profiles, n_users)
+        cat_idx = place[:, PB_CATEGORY].astype(np.intp)
+
+        features[:, :, 0] = place[:, PB_QUALITY]
+        features[:, :, 1] = context_cols[:, 0]
+        features[:, :, 2] = place[:, PB_TRENDING]
+        features[:, :, 3:10] = context_cols[:, 1:]
+        features[:, :, 10:14] = place[:, PB_ONEHOT]
+        features[:, :, 14:18] = user_affinity[:, None, :]
+        features[:, :, 18] = 1.0 - np.abs(user_price_sens[:, None] - (place[:, PB_PRICE] / 4.0)[None, :])
+        padded = np.column_stack([user_affinity, np.full(n_users, 0.5)])
+        features[:, :, 19] = padded[:, cat_idx]
+        features[:, :, 20:26] = place[:, PB_VIBE]
+        return features
+
+    def _activity_context(self, activity, context):
+        """Per-activity context: distance from travelMinutes, open status."""
+        act_context = {**context}
+        if 'travelMinutes' in activity:
+            # Convert travel minutes to approximate km for distance decay
+            mode = context.get('travel_mode', 'walking')
+            act_context['distance_km'] = activity['travelMinutes'] * SPEED_KM_PER_MIN.get(mode, 0.07)
+        if 'isOpen' in activity:
+            act_context['is_open'] = activity['isOpen']
+        return act_context
+
     # =============================================================
     # Training
     # =============================================================
@@ -354,21 +653,16 @@ class LightGBMRecommender:
         mistakes of all previous trees. This learns complex patterns
         like "cheap cafes in the morning" without explicit rules.
         """
-        X = []
-        y = []
-
-        for sample in training_data:
-            features = self.extract_features(
-                sample['activity'],
-                sample['user_prefs'],
-                sample.get('context', {}),
-                sample.get('user_profile', None)
-            )
-            X.append(features)
-            y.append(sample['label'])
+        X = self.extract_features_batch(
+            [sample['activity'] for sample in training_data],
+            [sample['user_prefs'] for sample in training_data],
+            [sample.get('context', {}) for sample in training_data],
+            [sample.get('user_profile', None) for sample in training_data],
+            source='train',
+        )
+        y = np.array([sample['label'] for sample in training_data])
 
-        X = np.array(X)
-        y = np.array(y)
+        import lightgbm as lgb
 
         # LightGBM doesn't need feature scaling (tree-based)
         self.model = lgb.LGBMClassifier(
@@ -399,7 +693,8 @@ class LightGBMRecommender:
     # Prediction — same contract as before
     # =============================================================
 
-    def predict_scores(self, activities, user_prefs, context=None, user_profile=None):
+    def predict_scores(self, activities, user_prefs, context=None, user_profile=None, top_k=None,
+                       source='predict'):
         """
         Score all candidate activities for a specific user.
         Returns each activity with 'ml_score' added (float 0.0-1.0).
@@ -411,44 +706,96 @@ class LightGBMRecommender:
         features (category affinities, price match) to rank differently
         for different users. Same place, same time → different score
         for Alex vs Jordan.
+
+        With top_k set, only the k best activities are returned (best
+        first); the rest are never copied into result dicts.
         """
+        scores = self.score_activities(activities, user_prefs, context, user_profile, source)
+
+        if top_k is None:
+            indices = range(len(activities))
+        else:
+            indices = top_k_indices(scores, top_k).tolist()
+
+        return [
+            {**activities[i], 'ml_score': float(scores[i])}
+            for i in indices
+        ]
+
+    def score_activities(self, activities, user_prefs, context=None, user_profile=None,
+                         source='predict'):
+        """ml_score for each activity as a float64 array (input order)."""
         if self.model is None:
             raise ValueError("Model not trained yet!")
 
+        # One model call for the whole candidate set, scores attached by index
+        return self.score_matrix(self.feature_matrix(activities, user_prefs, context, user_profile, source))
+
+    def feature_matrix(self, activities, user_prefs, context=None, user_profile=None, source='predict'):
+        """Request feature matrix (n, 26): per-activity context + batch extraction."""
         if context is None:
             context = {}
 
-        scored_activities = []
+        # Build per-activity context (distance may vary per place)
+        act_contexts = [self._activity_context(activity, context) for activity in activities]
+        return self.extract_features_batch(activities, user_prefs, act_contexts, user_profile, source)
 
-        for activity in activities:
-            # Build per-activity context (distance may vary per place)
-            act_context = {**context}
-            if 'travelMinutes' in activity:
-                # Convert travel minutes to approximate km for distance decay
-                speed_km_per_min = {'walking': 0.07, 'driving': 0.5, 'transit': 0.3}
-                mode = context.get('travel_mode', 'walking')
-                act_context['distance_km'] = activity['travelMinutes'] * speed_km_per_min.get(mode, 0.07)
-            if 'isOpen' in activity:
-                act_context['is_open'] = activity['isOpen']
+    def score_matrix(self, X):
+        """
+        Score a prebuilt (n, 26) feature matrix in a single predict_proba call.
 
-            features = self.extract_features(activity, user_prefs, act_context, user_profile)
-            features_2d = features.reshape(1, -1)
+        Calling predict_proba once per row pays the sklearn wrapper and
+        LightGBM C-API overhead n times; one call over the whole matrix
+        pays it once. Returns P(class=1) as a float64 array of length n.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet!")
+        if len(X) == 0:
+            return np.empty(0, dtype=np.float64)
+        if self.inference_pool is not None:
+            return self.inference_pool.score(X)
+        # P(class=1) = probability user will engage
+        return self.model.predict_proba(X)[:, 1]
+
+    def predict_score_matrix(self, activities, user_profiles, user_prefs=None, context=None,
+                             source='predict'):
+        """
+        Score M places for U users at once → (U, M) array of ml_score.
 
-            # P(class=1) = probability user will engage
-            score = self.model.predict_proba(features_2d)[0][1]
+        Used to pre-warm recommendations for cohorts (all personas, every
+        active user in a city): one feature tensor, one model call,
+        instead of one predict_scores call per user.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet!")
 
-            scored_activities.append({
-                **activity,
-                'ml_score': float(score)
-            })
+        if context is None:
+            context = {}
+        if user_prefs is None:
+            user_prefs = {}
 
-        return scored_activities
+        act_contexts = [self._activity_context(activity, context) for activity in activities]
+        features = self.extract_features_matrix(activities, user_profiles, user_prefs, act_contexts, source)
+        n_users, n_places = features.shape[:2]
+        return self.score_matrix(features.reshape(-1, features.shape[2])).reshape(n_users, n_places)
 
     def recommend_top_n(self, activities, user_prefs, context=None, user_profile=None, n=5):
         """Score activities and return top N."""
-        scored = self.predict_scores(activities, user_prefs, context, user_profile)
-        scored.sort(key=lambda x: x['ml_score'], reverse=True)
-        return scored[:n]
+        return self.predict_scores(activities, user_prefs, context, user_profile, top_k=n)
+
+    def recommend_top_n_streaming(self, activity_chunks, user_prefs, context=None,
+                                  user_profile=None, n=5):
+        """
+        Top N over candidate lists too large to score in one batch.
+
+        activity_chunks is any iterable of activity lists; each chunk is
+        scored as one batch and only contenders for the running top N
+        are kept (StreamingTopK), so memory stays O(chunk + N).
+        """
+        top = StreamingTopK(n)
+        for chunk in activity_chunks:
+            top.push_many(self.score_activities(chunk, user_prefs, context, user_profile), chunk)
+        return [{**activity, 'ml_score': score} for score, activity in top.result()]
 
     # =============================================================
     # Persistence
@@ -456,15 +803,36 @@ class LightGBMRecommender:
 
     def save_model(self, path='models/trained/lightgbm_ranker.pkl'):
         """Save trained model to disk."""
+        import joblib
+
         os.makedirs(os.path.dirname(path), exist_ok=True)
         joblib.dump({'model': self.model}, path)
         print(f"[OK] Model saved to {path}")
 
+    def save_compiled(self, path='models/trained/lightgbm_ranker.npz'):
+        """
+        Export the trained booster as flat NumPy tree arrays.
+
+        Load it back with load_model(path) — scoring then runs on
+        CompiledForest and never touches lightgbm or sklearn.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet!")
+        forest = self.model if isinstance(self.model, CompiledForest) else CompiledForest.from_lgbm(self.model)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        forest.save(path)
+        print(f"[OK] Compiled trees saved to {path}")
+
     def load_model(self, path='models/trained/lightgbm_ranker.pkl'):
-        """Load trained model."""
-        if os.path.exists(path):
+        """Load trained model (.pkl via joblib, or .npz compiled trees)."""
+        if not os.path.exists(path):
+            print(f"[ERROR] No model found at {path}")
+            return
+        if path.endswith('.npz'):
+            self.model = CompiledForest.load(path)
+        else:
+            import joblib
+
             data = joblib.load(path)
             self.model = data['model']
-            print(f"[OK] Model loaded from {path}")
-        else:
-            print(f"[ERROR] No model found at {path}")
+        print(f"[OK] Model loaded from {path}")
@@ -0,0 +1,299 @@
+# =============================================================
+# Arm Snapshot — memory-mapped binary format for the bandit state
+# =============================================================
+#
+# Loading the JSON snapshot means parsing every arm and rebuilding every
+# key before the service can answer — cold start grows with how much the
+# bandit has learned. This format is laid out so that loading is just
+# mmap + a header read: O(1) in arm count, pages fault in lazily as
+# arms are actually touched.
+#
+# File layout (little-endian, every section 64-byte aligned):
+#
+#   header (256 bytes)
+#     magic "TSARMS\0\1", version, n_buckets, n_arms, n_places, wal_seq
+#     section table: (offset, length) for each section below
+#
+#   place_offsets  uint64[n_places + 1]   ┐ string table: place i is
+#   place_blob     utf-8 bytes            ┘ blob[offsets[i]:offsets[i+1]]
+#   bucket_offsets uint64[n_buckets + 1]  ┐ same for bucket names
+#   bucket_blob    utf-8 bytes            ┘
+#   place_hash     int32[2^k]             open-addressing table:
+#                                         crc32(place_id) → place row
+#   slots          int32[n_places, n_buckets]   arm row, -1 = none
+#   alpha, beta    float64[n_arms]
+#   arm_place      int32[n_arms]
+#   arm_bucket     int32[n_arms]
+#   touched        float64[n_arms]        unix time of last update (v2+)
+#
+# Loaded arrays are copy-on-write maps (mode 'c'): updating an arm only
+# copies the page it lives on, the file itself is never modified. When
+# the store grows past the mapped size, _grow copies into RAM once.
+#
+# Convert an existing JSON snapshot (run from ml/):
+#     python -m models.arm_snapshot data/thompson_state.json data/thompson_state.bin
+
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from models.arm_store import ArmStore
+from models.wal import WriteAheadLog, atomic_write
+
+MAGIC = b'TSARMS\x00\x01'
+VERSION = 2
+HEADER_SIZE = 256
+ALIGN = 64
+
+SECTIONS = [
+    ('place_offsets', np.uint64),
+    ('place_blob', np.uint8),
+    ('bucket_offsets', np.uint64),
+    ('bucket_blob', np.uint8),
+    ('place_hash', np.int32),
+    ('slots', np.int32),
+    ('alpha', np.float64),
+    ('beta', np.float64),
+    ('arm_place', np.int32),
+    ('arm_bucket', np.int32),
+    ('touched', np.float64),
+]
+# Sections present in each format version (v1 had no timestamps)
+VERSION_SECTIONS = {1: SECTIONS[:10], 2: SECTIONS}
+
+_HEAD = struct.Struct('<8sIIQQQ')
+_SECTION = struct.Struct('<QQ')
+
+
+def _hash(encoded):
+    """Stable across processes (unlike hash()), and C-speed."""
+    return zlib.crc32(encoded)
+
+
+# =============================================================
+# Lazy views over the mapped string table / hash index
+# =============================================================
+
+class StringTable:
+    """Place-id list backed by the mapped string table, plus in-RAM appends."""
+
+    def __init__(self, offsets, blob, extra=None):
+        self.offsets = offsets
+        self.blob = blob
+        self.base = len(offsets) - 1
+        self.extra = extra if extra is not None else []
+
+    def __len__(self):
+        return self.base + len(self.extra)
+
+    def __getitem__(self, i):
+        if i < self.base:
+            return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+        return self.extra[i - self.base]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value):
+        self.extra.append(value)
+
+    def copy(self):
+        return StringTable(self.offsets, self.blob, list(self.extra))
+
+
+class PlaceIndex:
+    """place_id → place row: probes the mapped hash table, then in-RAM additions."""
+
+    def __init__(self, table, names, extra=None):
+        self.table = table
+        self.mask = len(table) - 1
+        self.names = names
+        self.extra = extra if extra is not None else {}
+
+    def get(self, place_id, default=None):
+        row = self.extra.get(place_id)
+        if row is not None:
+            return row
+        if self.mask < 0:
+            return default
+        slot = _hash(place_id.encode()) & self.mask
+        while True:
+            row = int(self.table[slot])
+            if row < 0:
+                return default
+            if self.names[row] == place_id:
+                return row
+            slot = (slot + 1) & self.mask
+
+    def __contains__(self, place_id):
+        return self.get(place_id) is not None
+
+    def __setitem__(self, place_id, row):
+        self.extra[place_id] = row
+
+    def __len__(self):
+        return self.names.base + len(self.extra)
+
+    def copy(self):
+        return PlaceIndex(self.table, self.names, dict(self.extra))
+
+
+# =============================================================
+# Writing
+# =============================================================
+
+def _string_table(strings):
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return encoded, offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _hash_table(encoded):
+    """Linear-probing table at load factor <= 0.5."""
+    size = 8
+    while size < 2 * len(encoded):
+        size *= 2
+    mask = size - 1
+    table = [-1] * size
+    for row, key in enumerate(encoded):
+        slot = _hash(key) & mask
+        while table[slot] >= 0:
+            slot = (slot + 1) & mask
+        table[slot] = row
+    return np.array(table, dtype=np.int32)
+
+
+def write_snapshot(path, store, seq=0):
+    """Atomically write `store` (covering WAL records up to `seq`) to `path`."""
+    n = store.n
+    encoded, place_offsets, place_blob = _string_table(store.place_ids)
+    _, bucket_offsets, bucket_blob = _string_table(store.bucket_names)
+    sections = {
+        'place_offsets': place_offsets,
+        'place_blob': place_blob,
+        'bucket_offsets': bucket_offsets,
+        'bucket_blob': bucket_blob,
+        'place_hash': _hash_table(encoded),
+        'slots': np.asarray(store.slots[:len(encoded)], dtype=np.int32),
+        'alpha': np.asarray(store.alpha[:n], dtype=np.float64),
+        'beta': np.asarray(store.beta[:n], dtype=np.float64),
+        'arm_place': np.asarray(store.arm_place[:n], dtype=np.int32),
+        'arm_bucket': np.asarray(store.arm_bucket[:n], dtype=np.int32),
+        'touched': np.asarray(store.touched[:n], dtype=np.float64),
+    }
+
+    table, offset = [], HEADER_SIZE
+    for name, _ in SECTIONS:
+        length = sections[name].nbytes
+        table.append((offset, length))
+        offset += -(-length // ALIGN) * ALIGN
+
+    def write(f):
+        header = _HEAD.pack(MAGIC, VERSION, len(store.bucket_names), n, len(encoded), seq)
+        header += b''.join(_SECTION.pack(*entry) for entry in table)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for (name, _), (start, length) in zip(SECTIONS, table):
+            f.seek(start)
+            f.write(np.ascontiguousarray(sections[name]).data)
+        f.truncate(offset)
+
+    atomic_write(path, write)
+
+
+# =============================================================
+# Loading
+# =============================================================
+
+def read_header(path):
+    """(n_buckets, n_arms, n_places, wal_seq, {section: (offset, length)}) of a snapshot file."""
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    magic, version, n_buckets, n_arms, n_places, seq = _HEAD.unpack_from(raw)
+    if magic != MAGIC or version not in VERSION_SECTIONS:
+        raise ValueError(f"{path} is not an arm snapshot (v1-v{VERSION})")
+    table = {name: _SECTION.unpack_from(raw, _HEAD.size + i * _SECTION.size)
+             for i, (name, _) in enumerate(VERSION_SECTIONS[version])}
+    return n_buckets, n_arms, n_places, seq, table
+
+
+def load_snapshot(path):
+    """
+    Map a snapshot file as an ArmStore. Returns (store, wal_seq).
+
+    Only the header and the (tiny) bucket-name table are read eagerly;
+    everything else is a copy-on-write view into the mapping.
+    """
+    n_buckets, n_arms, n_places, seq, table = read_header(path)
+    mapped = np.memmap(path, dtype=np.uint8, mode='c')
+    arrays = {}
+    for name, dtype in SECTIONS:
+        if name in table:
+            start, length = table[name]
+            arrays[name] = mapped[start:start + length].view(dtype)
+    if 'touched' not in arrays:
+        # v1 file: treat every arm as last updated when the file was written
+        arrays['touched'] = np.full(n_arms, os.path.getmtime(path))
+
+    bucket_names = list(StringTable(arrays['bucket_offsets'], arrays['bucket_blob']))
+    place_ids = StringTable(arrays['place_offsets'], arrays['place_blob'])
+    store = ArmStore.from_arrays(
+        alpha=arrays['alpha'], beta=arrays['beta'],
+        arm_place=arrays['arm_place'], arm_bucket=arrays['arm_bucket'],
+        touched=arrays['touched'], place_ids=place_ids, place_index=PlaceIndex(arrays['place_hash'], place_ids),
+        bucket_names=bucket_names,
+        slots=arrays['slots'].reshape(n_places, n_buckets),
+    )
+    return store, seq
+
+
+def load_json(path):
+    """Parse a JSON snapshot ("place_id|bucket": {alpha, beta}). Returns (store, wal_seq)."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    seq = data.pop('_wal_seq', 0)
+    now = time.time()
+    place_ids, buckets, alphas, betas, touched = [], [], [], [], []
+    for key, arm in data.items():
+        parts = key.split('|', 1)
+        if len(parts) == 2:
+            place_ids.append(parts[0])
+            buckets.append(parts[1])
+            alphas.append(arm['alpha'])
+            betas.append(arm['beta'])
+            touched.append(arm.get('touched', now))
+    store = ArmStore()
+    store.add_arms(place_ids, buckets, alphas, betas, touched)
+    # Older versions created a Beta(1, 1) arm for every candidate ever
+    # sampled; those never-updated arms are dropped here
+    keep = store.updated_mask()
+    if not keep.all():
+        store = store.compacted(keep)
+    return store, seq
+
+
+def convert_json(json_path, bin_path, half_life=None):
+    """
+    Convert a JSON snapshot to the binary format.
+
+    Updates still sitting in the JSON snapshot's write-ahead log are
+    folded in, so the binary file starts a fresh log (seq 0).
+    """
+    store, seq = load_json(json_path)
+    store.replay(WriteAheadLog(json_path).replay(after_seq=seq), half_life)
+    write_snapshot(bin_path, store, seq=0)
+    return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: python -m models.arm_snapshot <state.json> <state.bin>")
+        sys.exit(1)
+    converted = convert_json(sys.argv[1], sys.argv[2])
+    print(f"[OK] Wrote {len(converted)} arms to {sys.argv[2]}")
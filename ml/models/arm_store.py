@@ -0,0 +1,379 @@
+# =============================================================
+# Arm Store — array-backed Beta arms for the contextual bandit
+# =============================================================
+#
+# The original store was a dict: (place_id, "morning_food") tuple →
+# {'alpha': .., 'beta': ..} dict. That is hundreds of bytes per arm,
+# and sampling had to loop in Python, building an f-string per place.
+#
+# Here every arm is one ROW in a set of parallel NumPy arrays:
+#   alpha[row], beta[row]   — the Beta posterior
+#   arm_place[row]          — integer place id (row in place_ids)
+#   arm_bucket[row]         — integer context-bucket id
+#   touched[row]            — unix time of the last update
+#
+# Lookup is two-level:
+#   place_index: place_id string → place row  (one dict entry per PLACE)
+#   slots[place_row, bucket_id] → arm row, -1 when the arm doesn't exist
+#
+# so resolving a whole candidate list is one dict lookup per place plus
+# a single fancy-index into `slots`, and sampling is one vectorized
+# Generator.beta call over alpha[rows], beta[rows].
+#
+# All arrays grow by doubling (amortized O(1) appends).
+#
+# Discounting (optional, half_life in seconds): evidence fades toward
+# the prior as  prior + (x - prior) · 0.5^(age / half_life).  Nothing
+# sweeps the arrays — reads decay on the fly from `touched`, and an
+# update first folds the decay into the stored counts, then re-stamps
+# `touched`. Arms whose evidence decayed to ~nothing can be evict()ed.
+
+import time
+
+import numpy as np
+
+TIME_PERIODS = ['morning', 'afternoon', 'evening', 'night']
+BUCKET_CATEGORIES = ['food', 'outdoor', 'entertainment', 'culture']
+
+# 4 time periods × 4 categories = 16 buckets with fixed ids
+DEFAULT_BUCKETS = [f"{t}_{c}" for t in TIME_PERIODS for c in BUCKET_CATEGORIES]
+
+# Beta(1, 1) — uniform prior, total ignorance
+PRIOR_ALPHA = 1.0
+PRIOR_BETA = 1.0
+
+
+def time_period(hour):
+    """Hour → period index (0=morning 6-11, 1=afternoon 11-17, 2=evening 17-21, 3=night)."""
+    if 6 <= hour < 11:     return 0
+    elif 11 <= hour < 17:  return 1
+    elif 17 <= hour < 21:  return 2
+    else:                  return 3
+
+
+def decay_factor(touched, now, half_life):
+    """0.5^(age / half_life); 1.0 everywhere when half_life is falsy."""
+    if not half_life:
+        return np.ones(np.shape(touched))
+    age = np.maximum(now - np.asarray(touched, dtype=np.float64), 0.0)
+    return np.exp2(-age / half_life)
+
+
+def _grow(array, size, fill):
+    """Copy `array` into a larger array (at least `size` along axis 0)."""
+    new_len = max(size, 2 * len(array), 16)
+    grown = np.full((new_len,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ArmStore:
+    """Growable parallel arrays of Beta arms, indexed by (place, bucket)."""
+
+    def __init__(self, capacity=1024, place_capacity=256):
+        self.n = 0
+        self.alpha = np.full(capacity, PRIOR_ALPHA)
+        self.beta = np.full(capacity, PRIOR_BETA)
+        self.arm_place = np.zeros(capacity, dtype=np.int32)
+        self.arm_bucket = np.zeros(capacity, dtype=np.int32)
+        self.touched = np.zeros(capacity)
+
+        self.place_ids = []
+        self.place_index = {}
+
+        self.bucket_names = list(DEFAULT_BUCKETS)
+        self.bucket_index = {name: i for i, name in enumerate(self.bucket_names)}
+        # Fast path for the 16 standard buckets: (period, category) → id
+        self._category_index = {c: i for i, c in enumerate(BUCKET_CATEGORIES)}
+
+        self.slots = np.full((place_capacity, len(self.bucket_names)), -1, dtype=np.int32)
+
+    @classmethod
+    def from_arrays(cls, alpha, beta, arm_place, arm_bucket, touched, place_ids, place_index,
+                    bucket_names, slots):
+        """Wrap existing arrays (e.g. views into a mapped snapshot) without copying."""
+        store = cls.__new__(cls)
+        store.n = len(alpha)
+        store.alpha, store.beta = alpha, beta
+        store.arm_place, store.arm_bucket = arm_place, arm_bucket
+        store.touched = touched
+        store.place_ids, store.place_index = place_ids, place_index
+        store.bucket_names = list(bucket_names)
+        store.bucket_index = {name: i for i, name in enumerate(store.bucket_names)}
+        store._category_index = {c: i for i, c in enumerate(BUCKET_CATEGORIES)}
+        store.slots = slots
+        return store
+
+    def __len__(self):
+        return self.n
+
+    # =============================================================
+    # Buckets
+    # =============================================================
+
+    def bucket_id(self, name):
+        """Integer id for a bucket name, registering unseen names."""
+        bid = self.bucket_index.get(name)
+        if bid is None:
+            bid = len(self.bucket_names)
+            self.bucket_names.append(name)
+            self.bucket_index[name] = bid
+            # One more column in the slot table
+            extra = np.full((len(self.slots), 1), -1, dtype=np.int32)
+            self.slots = np.hstack([self.slots, extra])
+        return bid
+
+    def bucket_ids(self, hour, categories, create=True):
+        """
+        Bucket id for each category at this hour (no string building for
+        known categories). Unseen bucket names are registered, or mapped
+        to -1 when create=False.
+        """
+        period = time_period(hour)
+        base = period * len(BUCKET_CATEGORIES)
+        ids = np.empty(len(categories), dtype=np.int32)
+        for i, cat in enumerate(categories):
+            c = self._category_index.get(cat)
+            if c is not None:
+                ids[i] = base + c
+                continue
+            name = f"{TIME_PERIODS[period]}_{cat}"
+            ids[i] = self.bucket_id(name) if create else self.bucket_index.get(name, -1)
+        return ids
+
+    # =============================================================
+    # Lookup / creation
+    # =============================================================
+
+    def place_rows(self, place_ids, create=False):
+        """Place row for each id; -1 for unknown ids unless create=True."""
+        rows = np.empty(len(place_ids), dtype=np.int64)
+        index = self.place_index
+        for i, pid in enumerate(place_ids):
+            if not isinstance(pid, str):
+                # Ids are stored as strings (snapshot string table); also
+                # covers log records written before update() coerced them
+                pid = str(pid)
+            row = index.get(pid)
+            if row is None:
+                if not create:
+                    rows[i] = -1
+                    continue
+                row = len(self.place_ids)
+                self.place_ids.append(pid)
+                index[pid] = row
+            rows[i] = row
+        if create and len(self.place_ids) > len(self.slots):
+            self.slots = _grow(self.slots, len(self.place_ids), -1)
+        return rows
+
+    def lookup(self, place_ids, bucket_ids):
+        """Arm row for each (place, bucket); -1 where no arm exists. Never allocates."""
+        bucket_ids = np.asarray(bucket_ids)
+        place_rows = self.place_rows(place_ids)
+        arms = np.full(len(place_rows), -1, dtype=np.int64)
+        known = (place_rows >= 0) & (bucket_ids >= 0)
+        arms[known] = self.slots[place_rows[known], bucket_ids[known]]
+        return arms
+
+    def params(self, rows, now=None, half_life=None):
+        """
+        (alpha, beta) for arm rows, with the Beta(1, 1) prior where
+        row == -1. With a half_life, counts are decayed to `now` (read
+        only — stored counts are not touched).
+        """
+        alpha = np.full(len(rows), PRIOR_ALPHA)
+        beta = np.full(len(rows), PRIOR_BETA)
+        known = rows[rows >= 0]
+        mask = rows >= 0
+        alpha[mask] = self.alpha[known]
+        beta[mask] = self.beta[known]
+        if half_life and len(known):
+            f = decay_factor(self.touched[known], now, half_life)
+            alpha[mask] = PRIOR_ALPHA + (alpha[mask] - PRIOR_ALPHA) * f
+            beta[mask] = PRIOR_BETA + (beta[mask] - PRIOR_BETA) * f
+        return alpha, beta
+
+    def touch(self, rows, now, half_life=None):
+        """Fold pending decay into the stored counts of `rows`, then stamp them with `now`."""
+        rows = np.unique(rows)
+        if half_life:
+            alpha, beta = self.params(rows, now, half_life)
+            self.alpha[rows] = alpha
+            self.beta[rows] = beta
+        self.touched[rows] = np.maximum(self.touched[rows], now)
+
+    def evidence(self, now=None, half_life=None):
+        """Observations per arm (alpha + beta - 2), decayed to `now` when discounting."""
+        n = self.n
+        obs = self.alpha[:n] + self.beta[:n] - (PRIOR_ALPHA + PRIOR_BETA)
+        if half_life:
+            obs = obs * decay_factor(self.touched[:n], now, half_life)
+        return obs
+
+    def get_or_create(self, place_ids, bucket_ids):
+        """Arm row for each (place, bucket), creating prior arms as needed."""
+        return self.get_or_create_rows(self.place_rows(place_ids, create=True), bucket_ids)
+
+    def get_or_create_rows(self, place_rows, bucket_ids):
+        """get_or_create() for place rows that are already registered."""
+        bucket_ids = np.asarray(bucket_ids, dtype=np.int64)
+        place_rows = np.asarray(place_rows, dtype=np.int64)
+        arms = self.slots[place_rows, bucket_ids].astype(np.int64)
+
+        missing = np.flatnonzero(arms < 0)
+        if len(missing):
+            # Duplicate (place, bucket) pairs in one call share one new arm
+            keys = place_rows[missing] * len(self.bucket_names) + bucket_ids[missing]
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            new_rows = self._append(place_rows[missing][first], bucket_ids[missing][first])
+            arms[missing] = new_rows[inverse]
+        return arms
+
+    def _append(self, place_rows, bucket_ids):
+        """Append prior arms for (place_row, bucket_id) pairs; returns their rows."""
+        k = len(place_rows)
+        start, end = self.n, self.n + k
+        if end > len(self.alpha):
+            self.alpha = _grow(self.alpha, end, PRIOR_ALPHA)
+            self.beta = _grow(self.beta, end, PRIOR_BETA)
+            self.arm_place = _grow(self.arm_place, end, 0)
+            self.arm_bucket = _grow(self.arm_bucket, end, 0)
+            self.touched = _grow(self.touched, end, 0.0)
+        rows = np.arange(start, end)
+        self.alpha[start:end] = PRIOR_ALPHA
+        self.beta[start:end] = PRIOR_BETA
+        self.arm_place[start:end] = place_rows
+        self.arm_bucket[start:end] = bucket_ids
+        self.touched[start:end] = time.time()
+        self.slots[place_rows, bucket_ids] = rows
+        self.n = end
+        return rows
+
+    def add_arms(self, place_ids, bucket_names, alpha, beta, touched=None):
+        """Bulk insert/overwrite arms (state loading). touched defaults to now."""
+        bucket_ids = [self.bucket_id(name) for name in bucket_names]
+        rows = self.get_or_create(place_ids, bucket_ids)
+        self.alpha[rows] = alpha
+        self.beta[rows] = beta
+        if touched is not None:
+            self.touched[rows] = touched
+        return rows
+
+    def apply_rewards(self, place_ids, bucket_names, rewards, times=None, half_life=None, counts=None):
+        """
+        Bulk Bernoulli updates: alpha += reward, beta += 1 - reward
+        (repeats accumulate). `counts` repeats each reward that many times
+        (default 1). `times` (scalar or per reward) defaults to now; with
+        a half_life, each arm decays up to its update time first.
+        """
+        bucket_ids = [self.bucket_id(name) for name in bucket_names]
+        rows = self.get_or_create(place_ids, bucket_ids)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        counts = np.broadcast_to(np.asarray(1.0 if counts is None else counts,
+                                            dtype=np.float64), rewards.shape)
+        times = np.broadcast_to(np.asarray(time.time() if times is None else times,
+                                           dtype=np.float64), rewards.shape)
+
+        if half_life and len(rows) and np.ptp(times) > 0:
+            # Decay depends on the gaps between events: apply them in order
+            for row, reward, count, t in zip(rows.tolist(), rewards.tolist(),
+                                             counts.tolist(), times.tolist()):
+                self.touch([row], t, half_life)
+                self.alpha[row] += reward * count
+                self.beta[row] += (1.0 - reward) * count
+            return rows
+
+        if len(rows):
+            self.touch(rows, times[0], half_life)
+        np.add.at(self.alpha, rows, rewards * counts)
+        np.add.at(self.beta, rows, (1.0 - rewards) * counts)
+        return rows
+
+    def replay(self, records, half_life=None):
+        """
+        Apply WAL records [place_id, bucket, reward(, time(, count, replica))]
+        in order. Records logged before timestamps existed count as
+        happening now; merged replica evidence carries a count.
+        """
+        now = time.time()
+        records = [[r[0], r[1], r[2], r[3] if len(r) > 3 else now, r[4] if len(r) > 4 else 1]
+                   for r in records]
+        if records:
+            place_ids, buckets, rewards, times, counts = zip(*records)
+            self.apply_rewards(place_ids, buckets, rewards, times, half_life, counts)
+        return len(records)
+
+    def copy(self):
+        """Independent copy trimmed to the live arms (frozen state for snapshots)."""
+        clone = ArmStore.__new__(ArmStore)
+        clone.n = self.n
+        clone.alpha = self.alpha[:self.n].copy()
+        clone.beta = self.beta[:self.n].copy()
+        clone.arm_place = self.arm_place[:self.n].copy()
+        clone.arm_bucket = self.arm_bucket[:self.n].copy()
+        clone.touched = self.touched[:self.n].copy()
+        clone.place_ids = self.place_ids.copy()
+        clone.place_index = self.place_index.copy()
+        clone.bucket_names = list(self.bucket_names)
+        clone.bucket_index = dict(self.bucket_index)
+        clone._category_index = self._category_index
+        clone.slots = self.slots[:len(self.place_ids)].copy()
+        return clone
+
+    def compacted(self, keep):
+        """New store holding only the arm rows where the boolean mask `keep` is set."""
+        rows = np.flatnonzero(keep)
+        clone = ArmStore(capacity=max(len(rows), 16))
+        clone.add_arms([self.place_ids[p] for p in self.arm_place[rows].tolist()],
+                       [self.bucket_names[b] for b in self.arm_bucket[rows].tolist()],
+                       self.alpha[rows], self.beta[rows], self.touched[rows])
+        return clone
+
+    def evict(self, keep):
+        """
+        Drop arm rows where the boolean mask `keep` is False, in place.
+
+        Fully vectorized (no per-arm Python), so it can run under the
+        bandit lock. Place ids stay registered; only arm rows go.
+        """
+        rows = np.flatnonzero(keep)
+        evicted = self.n - len(rows)
+        if not evicted:
+            return 0
+        self.alpha = self.alpha[rows]
+        self.beta = self.beta[rows]
+        self.arm_place = self.arm_place[rows]
+        self.arm_bucket = self.arm_bucket[rows]
+        self.touched = self.touched[rows]
+        self.n = len(rows)
+        self.slots = np.array(self.slots)
+        self.slots.fill(-1)
+        self.slots[self.arm_place, self.arm_bucket] = np.arange(self.n, dtype=np.int32)
+        return evicted
+
+    def updated_mask(self):
+        """True for arms that moved off the prior (i.e. ever received feedback)."""
+        return (self.alpha[:self.n] != PRIOR_ALPHA) | (self.beta[:self.n] != PRIOR_BETA)
+
+    # =============================================================
+    # Views
+    # =============================================================
+
+    def arm_key(self, row):
+        """(place_id, bucket_name) of one arm row."""
+        return self.place_ids[self.arm_place[row]], self.bucket_names[self.arm_bucket[row]]
+
+    def items(self):
+        """Yield (place_id, bucket_name, alpha, beta) for every arm."""
+        alpha = self.alpha[:self.n].tolist()
+        beta = self.beta[:self.n].tolist()
+        places = self.arm_place[:self.n].tolist()
+        buckets = self.arm_bucket[:self.n].tolist()
+        for a, b, p, k in zip(alpha, beta, places, buckets):
+            yield self.place_ids[p], self.bucket_names[k], a, b
+
+    def nbytes(self):
+        """Bytes held by the NumPy arrays (allocated capacity)."""
+        return (self.alpha.nbytes + self.beta.nbytes + self.arm_place.nbytes
+                + self.arm_bucket.nbytes + self.touched.nbytes + self.slots.nbytes)
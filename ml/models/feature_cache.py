@@ -0,0 +1,165 @@
+# =============================================================
+# Place Feature Cache — precomputed place-static feature blocks
+# =============================================================
+#
+# Half of the feature vector only depends on the PLACE, not on the user
+# or the moment: composite quality, trending, the category one-hot and
+# the six vibe scores. Popular places get scored thousands of times per
+# hour, so we compute that block once and reuse it.
+#
+# Layout: one preallocated float64 slab (capacity × block width).
+# Each cached place owns one slab row; a batch lookup is a single
+# fancy-index gather over the slab.
+#
+# Entries are keyed by place id and carry a content hash of every field
+# the block depends on — if Google returns a new rating or review
+# count, the hash changes and the row is recomputed.
+#
+# Bounded two ways:
+#   - LRU: at most `max_entries` places, least recently used go first
+#   - TTL: rows older than `ttl_seconds` are recomputed on next use
+#
+# max_entries=0 (ML_PLACE_CACHE_SIZE=0) disables the cache: every block
+# is computed.
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Every activity field the place-static block is computed from
+PLACE_STATIC_FIELDS = (
+    'rating', 'userRatingsTotal', 'category', 'priceLevel', 'typicalDuration',
+    'vibe_chill', 'vibe_social', 'vibe_studious', 'vibe_trendy',
+    'vibe_date_spot', 'vibe_budget_friendly',
+)
+
+
+def content_hash(activity):
+    """Hash of the place-static fields (missing fields hash as None)."""
+    return hash(tuple(activity.get(field) for field in PLACE_STATIC_FIELDS))
+
+
+class PlaceFeatureCache:
+    """Bounded LRU + TTL cache of place-static feature rows, keyed by place id."""
+
+    def __init__(self, width, max_entries=50_000, ttl_seconds=3600.0):
+        self.width = width
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._slab = np.zeros((max_entries, width), dtype=np.float64)
+        self._free = list(range(max_entries - 1, -1, -1))
+        # place_id → (content_hash, expires_at, slab_row), in LRU order
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0      # pushed out by the LRU bound
+        self.expirations = 0    # TTL ran out
+        self.invalidations = 0  # place content changed
+
+    def get_block(self, activities, compute_fn):
+        """
+        Return the (n, width) place-static block for `activities`.
+
+        Cached rows are gathered from the slab; everything else is
+        computed in ONE compute_fn(list_of_activities) call and stored.
+        Activities without an 'id' are always computed, never cached.
+        """
+        if self.max_entries <= 0:
+            with self._lock:
+                self.misses += len(activities)
+            return compute_fn(list(activities))
+
+        n = len(activities)
+        slots = np.empty(n, dtype=np.intp)
+        hashes = [None] * n
+        missing = []
+        now = time.monotonic()
+
+        with self._lock:
+            for i, activity in enumerate(activities):
+                pid = activity.get('id')
+                if pid is None:
+                    missing.append(i)
+                    continue
+                h = content_hash(activity)
+                hashes[i] = h
+                entry = self._entries.get(pid)
+                if entry is not None:
+                    cached_hash, expires_at, slot = entry
+                    if cached_hash == h and expires_at > now:
+                        self._entries.move_to_end(pid)
+                        slots[i] = slot
+                        self.hits += 1
+                        continue
+                    if cached_hash != h:
+                        self.invalidations += 1
+                    else:
+                        self.expirations += 1
+                    self._release(pid)
+                missing.append(i)
+            self.misses += len(missing)
+
+            if not missing:
+                return self._slab[slots]
+
+            # Copy the hits now: once the lock is dropped another request
+            # may evict these entries and reuse their slab rows
+            block = np.empty((n, self.width), dtype=np.float64)
+            hit_rows = np.ones(n, dtype=bool)
+            hit_rows[missing] = False
+            block[hit_rows] = self._slab[slots[hit_rows]]
+
+        # Compute outside the lock — it is the expensive part
+        computed = compute_fn([activities[i] for i in missing])
+        block[missing] = computed
+
+        with self._lock:
+
+            expires_at = now + self.ttl_seconds
+            for row, i in enumerate(missing):
+                pid = activities[i].get('id')
+                if pid is None:
+                    continue
+                if pid in self._entries:
+                    # Another request cached it meanwhile — keep the newer copy
+                    self._release(pid)
+                if not self._free:
+                    oldest = next(iter(self._entries))
+                    self._release(oldest)
+                    self.evictions += 1
+                slot = self._free.pop()
+                self._slab[slot] = computed[row]
+                self._entries[pid] = (hashes[i], expires_at, slot)
+
+        return block
+
+    def _release(self, pid):
+        """Drop one entry and return its slab row to the free list."""
+        _, _, slot = self._entries.pop(pid)
+        self._free.append(slot)
+
+    def clear(self):
+        """Drop every cached row (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def stats(self):
+        """Hit/miss/eviction counters — for /api/health and dashboards."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,206 @@
+# =============================================================
+# Profile Cache — bounded LRU of hot profiles over SQLite
+# =============================================================
+#
+# Only a small fraction of users are active at any one time, yet the
+# dict and matrix backends keep every profile in memory. This backend
+# keeps the hot ones in an LRU (ML_PROFILE_CACHE_SIZE entries) and the
+# long tail in an on-disk SQLite table:
+#
+#   read   LRU hit → done. Miss → profiles written but not yet on disk
+#          → one primary-key SELECT (read-through), result cached.
+#          Unknown users are cached too (as absent), so a flood of
+#          new users doesn't become a flood of SELECTs.
+#   write  LRU + the unwritten set. user_profile's flusher writes the
+#          unwritten set in ONE transaction (write-behind, in batches).
+#          Unwritten profiles are pinned: evicting them from the LRU
+#          never loses an update.
+#
+# SQLite runs in WAL mode: the flusher's transaction doesn't block
+# read-throughs, which use their own connection. The database is its
+# own log + snapshot — no user_profiles.json rewrite, no compaction.
+#
+# stats() reports hit rate, evictions, and read-through / batch-write
+# latency (p50/p99 over the most recent operations) for /metrics.
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import closing
+
+import numpy as np
+
+# Cached "no such user" (distinct from None, which callers may store as a default)
+_ABSENT = object()
+# Recent operations kept for the latency percentiles
+LATENCY_WINDOW = 1024
+
+
+class ProfileCache(MutableMapping):
+    """user_id → ProfileRecord mapping: LRU in memory, everyone in SQLite."""
+
+    def __init__(self, path, keys, record_type, capacity=100_000):
+        self.path = path
+        self.keys = tuple(keys)
+        self.record_type = record_type
+        self.capacity = capacity
+        self._lru = OrderedDict()      # user_id → record or _ABSENT, oldest first
+        self._unwritten = {}           # user_id → record not yet in SQLite
+        self._lock = threading.Lock()  # LRU, unwritten set, reader connection
+        self._write_lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'db_found': 0, 'evictions': 0,
+                          'writes': 0, 'write_batches': 0}
+        self._latency = {'read_through': deque(maxlen=LATENCY_WINDOW),
+                         'write_batch': deque(maxlen=LATENCY_WINDOW)}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        columns = ', '.join(f"{key} REAL NOT NULL" for key in self.keys)
+        self._writer = self._connect()
+        self._writer.execute(f"CREATE TABLE IF NOT EXISTS profiles "
+                             f"(user_id TEXT PRIMARY KEY, {columns}) WITHOUT ROWID")
+        self._reader = self._connect()
+        self._select = f"SELECT {', '.join(self.keys)} FROM profiles WHERE user_id = ?"
+        self._upsert = (f"INSERT OR REPLACE INTO profiles (user_id, {', '.join(self.keys)}) "
+                        f"VALUES ({', '.join('?' * (len(self.keys) + 1))})")
+        self._count = self._reader.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: a commit survives a process crash; an OS crash can
+        # lose the last batches — the same window as the profile log
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # =============================================================
+    # Mapping interface (what user_profile.py uses)
+    # =============================================================
+
+    def _lookup(self, user_id, count=True):
+        """Record or _ABSENT; reads through on a miss. Caller holds _lock."""
+        value = self._lru.get(user_id)
+        if value is not None:
+            self._counters['hits'] += count
+            self._lru.move_to_end(user_id)
+            return value
+        self._counters['misses'] += count
+        value = self._unwritten.get(user_id)
+        if value is None:
+            start = time.perf_counter()
+            row = self._reader.execute(self._select, (user_id,)).fetchone()
+            self._latency['read_through'].append(time.perf_counter() - start)
+            value = _ABSENT if row is None else self.record_type(row)
+            self._counters['db_found'] += row is not None
+        self._cache(user_id, value)
+        return value
+
+    def _cache(self, user_id, value):
+        self._lru[user_id] = value
+        self._lru.move_to_end(user_id)
+        while len(self._lru) > self.capacity:
+            # Unwritten profiles stay reachable through _unwritten
+            self._lru.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def get(self, user_id, default=None):
+        if not isinstance(user_id, str):
+            return default
+        with self._lock:
+            value = self._lookup(user_id)
+        return default if value is _ABSENT else value
+
+    def __getitem__(self, user_id):
+        value = self.get(user_id, _ABSENT)
+        if value is _ABSENT:
+            raise KeyError(user_id)
+        return value
+
+    def __contains__(self, user_id):
+        return self.get(user_id, _ABSENT) is not _ABSENT
+
+    def __setitem__(self, user_id, profile):
+        record = self.record_type.from_dict(profile)
+        with self._lock:
+            # Writers read first (update = read-modify-write): not counted again
+            if self._lookup(user_id, count=False) is _ABSENT:
+                self._count += 1
+            self._unwritten[user_id] = record
+            self._cache(user_id, record)
+
+    def __delitem__(self, user_id):
+        raise TypeError("profiles are never deleted")
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Every user id: flushes first so the table is complete."""
+        self.flush()
+        with closing(self._connect()) as conn:
+            for (user_id,) in conn.execute("SELECT user_id FROM profiles"):
+                yield user_id
+
+    # =============================================================
+    # Write-behind
+    # =============================================================
+
+    def flush(self):
+        """Write every unwritten profile in one transaction. Returns how many."""
+        with self._write_lock:
+            with self._lock:
+                batch = list(self._unwritten.items())
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            self._writer.execute("BEGIN")
+            try:
+                self._writer.executemany(self._upsert, [(uid, *record.values_tuple) for uid, record in batch])
+                self._writer.execute("COMMIT")
+            except Exception:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._latency['write_batch'].append(time.perf_counter() - start)
+            with self._lock:
+                for user_id, record in batch:
+                    # A newer update since the batch was taken stays unwritten
+                    if self._unwritten.get(user_id) is record:
+                        del self._unwritten[user_id]
+                self._counters['writes'] += len(batch)
+                self._counters['write_batches'] += 1
+        return len(batch)
+
+    def close(self):
+        self.flush()
+        with self._write_lock, self._lock:
+            # Fold the SQLite WAL back into the main file
+            self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._writer.close()
+            self._reader.close()
+
+    # =============================================================
+    # Metrics
+    # =============================================================
+
+    def stats(self):
+        """Hit rate, sizes and latency percentiles — for /metrics."""
+        with self._lock:
+            counters = dict(self._counters)
+            latency = {name: np.array(samples) for name, samples in self._latency.items()}
+            cached, unwritten = len(self._lru), len(self._unwritten)
+        lookups = counters['hits'] + counters['misses']
+        result = {
+            'profiles': self._count,
+            'cached': cached,
+            'capacity': self.capacity,
+            'unwritten': unwritten,
+            **counters,
+            'hit_rate': round(counters['hits'] / lookups, 4) if lookups else None,
+        }
+        for name, samples in latency.items():
+            if len(samples):
+                p50, p99 = np.percentile(samples, [50, 99]) * 1e3
+                result[f"{name}_ms"] = {'p50': round(p50, 3), 'p99': round(p99, 3), 'samples': len(samples)}
+        return result
@@ -0,0 +1,260 @@
+# =============================================================
+# Profile Matrix — columnar, memory-mapped user profile store
+# =============================================================
+#
+# The dict-of-records store parses every profile out of JSON at import
+# and keeps one Python object per user — fine for thousands of users,
+# not for millions. This backend keeps all profiles in ONE N×6 float32
+# matrix (24 bytes per user), memory-mapped from disk like the bandit
+# snapshot (arm_snapshot.py): startup is mmap + a header read, pages
+# fault in as users show up.
+#
+# File layout (little-endian, every section 64-byte aligned):
+#
+#   header (256 bytes)
+#     magic "PROFMAT\1", version, n_cols, n_rows, capacity, wal_seq
+#     section table: (offset, length) for each section below
+#
+#   id_offsets  uint64[n_rows + 1]   ┐ string table: user i is
+#   id_blob     utf-8 bytes          ┘ blob[offsets[i]:offsets[i+1]]
+#   id_hash     int32[2^k]           open-addressing table: crc32(user id) → row
+#   matrix      float32[capacity, 6] columns in user_profile.PROFILE_KEYS order
+#
+# The matrix section is written with spare capacity, so new users are
+# appended into the mapping (copy-on-write, mode 'c') without copying
+# it; past capacity the matrix moves to RAM until the next snapshot.
+# Updates are persisted by the profile write-ahead log, as with JSON.
+#
+# Compaction (every snapshot) drops users still at the neutral profile:
+# get_profile() returns the neutral profile for unknown users anyway.
+#
+# Batch scoring gathers many users with one fancy-indexing call:
+#     matrix.gather(user_ids)   → float32[len(user_ids), 6]
+
+import struct
+import zlib
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from models.arm_snapshot import ALIGN, HEADER_SIZE, PlaceIndex, StringTable, _hash_table, _string_table
+from models.arm_store import _grow
+from models.wal import atomic_write
+
+MAGIC = b'PROFMAT\x01'
+VERSION = 1
+# Headroom written into each snapshot for users who sign up before the next one
+SPARE_FRACTION = 0.25
+
+SECTIONS = [
+    ('id_offsets', np.uint64),
+    ('id_blob', np.uint8),
+    ('id_hash', np.int32),
+    ('matrix', np.float32),
+]
+
+_HEAD = struct.Struct('<8sIIQQQ')
+_SECTION = struct.Struct('<QQ')
+
+
+class ProfileMatrix(MutableMapping):
+    """
+    user_id → ProfileRecord mapping over an N×6 float32 matrix.
+
+    Reads build a ProfileRecord from the row (values are stored rounded
+    to 3 decimals, so rounding the float32 back recovers them exactly).
+
+    >>> m = ProfileMatrix(('a', 'b'), (0.5, 0.5), tuple)
+    >>> m['u1'] = {'a': 0.75, 'b': 0.125}
+    >>> m['u1'], 'u2' in m, len(m)
+    ((0.75, 0.125), False, 1)
+    >>> m.gather(['u1', 'u2', None]).tolist()
+    [[0.75, 0.125], [0.5, 0.5], [0.5, 0.5]]
+    """
+
+    def __init__(self, keys, neutral, record_type, capacity=1024):
+        self.keys = tuple(keys)
+        self.neutral = np.asarray(neutral, dtype=np.float32)
+        self.record_type = record_type
+        self.matrix = np.empty((capacity, len(self.keys)), dtype=np.float32)
+        self.n = 0
+        self.ids = []
+        self.index = {}
+
+    @classmethod
+    def from_arrays(cls, keys, neutral, record_type, matrix, n, ids, index):
+        store = cls(keys, neutral, record_type, capacity=0)
+        store.matrix, store.n, store.ids, store.index = matrix, n, ids, index
+        return store
+
+    # =============================================================
+    # Mapping interface (what user_profile.py uses)
+    # =============================================================
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self.ids[i]
+
+    def __contains__(self, user_id):
+        return isinstance(user_id, str) and self.index.get(user_id) is not None
+
+    def __getitem__(self, user_id):
+        row = self.index.get(user_id) if isinstance(user_id, str) else None
+        if row is None:
+            raise KeyError(user_id)
+        return self._record(row)
+
+    def get(self, user_id, default=None):
+        row = self.index.get(user_id) if isinstance(user_id, str) else None
+        return default if row is None else self._record(row)
+
+    def _record(self, row):
+        return self.record_type(round(v, 3) for v in self.matrix[row].tolist())
+
+    def __setitem__(self, user_id, profile):
+        # Same boundary as the reads: the snapshot's string table holds str ids
+        if not isinstance(user_id, str):
+            raise TypeError(f"user id must be a str, not {type(user_id).__name__}")
+        values = [profile[key] for key in self.keys]
+        row = self.index.get(user_id)
+        if row is not None:
+            self.matrix[row] = values
+            return
+        row = self.n
+        if row >= len(self.matrix):
+            # Past the mapped capacity: continue in RAM until the next snapshot
+            self.matrix = _grow(self.matrix, row + 1, 0.0)
+        self.matrix[row] = values
+        self.ids.append(user_id)
+        # Published last: a lock-free reader never finds an unwritten row
+        self.index[user_id] = row
+        self.n += 1
+
+    def __delitem__(self, user_id):
+        raise TypeError("profiles are dropped by compaction, not deleted")
+
+    # =============================================================
+    # Batch access
+    # =============================================================
+
+    def rows(self, user_ids):
+        """Matrix row for each user id; -1 for unknown users (and None)."""
+        if isinstance(self.index, PlaceIndex):
+            return self._mapped_rows(user_ids)
+        get = self.index.get
+        rows = np.empty(len(user_ids), dtype=np.int64)
+        for i, user_id in enumerate(user_ids):
+            row = get(user_id) if isinstance(user_id, str) else None
+            rows[i] = -1 if row is None else row
+        return rows
+
+    def _mapped_rows(self, user_ids):
+        """
+        Batch probe of the mapped hash table: each probe step reads every
+        pending user's slot in one fancy-index and checks it with a bytes
+        compare (no id decoding). Users added since the file was written
+        are found in the index's in-RAM part.
+        """
+        index, names = self.index, self.index.names
+        rows = np.full(len(user_ids), -1, dtype=np.int64)
+        encoded = [user_id.encode() if isinstance(user_id, str) else None for user_id in user_ids]
+        pending = np.array([i for i, key in enumerate(encoded) if key is not None], dtype=np.int64)
+        slots = np.fromiter((zlib.crc32(key or b'') for key in encoded), dtype=np.int64, count=len(encoded))
+        slots &= index.mask
+        blob = memoryview(names.blob)
+        while pending.size:
+            candidate = index.table[slots[pending]].astype(np.int64)
+            # An empty slot ends the probe: not in the file
+            pending, candidate = pending[candidate >= 0], candidate[candidate >= 0]
+            starts, ends = names.offsets[candidate].tolist(), names.offsets[candidate + 1].tolist()
+            hit = np.fromiter((blob[start:end] == encoded[i] for i, start, end in zip(pending.tolist(), starts, ends)),
+                              dtype=bool, count=len(pending))
+            rows[pending[hit]] = candidate[hit]
+            pending = pending[~hit]
+            slots[pending] = (slots[pending] + 1) & index.mask
+        if index.extra:
+            for i in np.flatnonzero(rows < 0).tolist():
+                row = index.extra.get(user_ids[i])
+                if row is not None:
+                    rows[i] = row
+        return rows
+
+    def gather(self, user_ids):
+        """float32[len(user_ids), n_cols] profiles in one fancy-index; neutral for unknown users."""
+        rows = self.rows(user_ids)
+        # Read after the rows: a concurrent grow only ever makes it longer
+        matrix = self.matrix
+        out = matrix[np.maximum(rows, 0)]
+        out[rows < 0] = self.neutral
+        return out
+
+    # =============================================================
+    # Snapshots
+    # =============================================================
+
+    def copy(self):
+        """Frozen copy for a background snapshot (matrix rows copied, ids shared read-only)."""
+        ids = self.ids.copy() if isinstance(self.ids, StringTable) else list(self.ids)
+        index = self.index.copy() if isinstance(self.index, PlaceIndex) else dict(self.index)
+        return ProfileMatrix.from_arrays(self.keys, self.neutral, self.record_type,
+                                         np.array(self.matrix[:self.n]), self.n, ids, index)
+
+    def non_neutral_rows(self):
+        return np.flatnonzero((self.matrix[:self.n] != self.neutral).any(axis=1))
+
+
+def write_matrix(path, store, seq=0):
+    """Atomically write `store` (covering profile-log records up to `seq`), compacted."""
+    keep = store.non_neutral_rows()
+    ids = [store.ids[i] for i in keep.tolist()]
+    encoded, offsets, blob = _string_table(ids)
+    capacity = max(int(len(ids) * (1 + SPARE_FRACTION)), 1024)
+    sections = {
+        'id_offsets': offsets,
+        'id_blob': blob,
+        'id_hash': _hash_table(encoded),
+        'matrix': np.asarray(store.matrix[keep], dtype=np.float32),
+    }
+    lengths = {name: sections[name].nbytes for name, _ in SECTIONS}
+    lengths['matrix'] = capacity * len(store.keys) * 4
+
+    table, offset = [], HEADER_SIZE
+    for name, _ in SECTIONS:
+        table.append((offset, lengths[name]))
+        offset += -(-lengths[name] // ALIGN) * ALIGN
+
+    def write(f):
+        header = _HEAD.pack(MAGIC, VERSION, len(store.keys), len(ids), capacity, seq)
+        header += b''.join(_SECTION.pack(*entry) for entry in table)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for (name, _), (start, _) in zip(SECTIONS, table):
+            f.seek(start)
+            f.write(np.ascontiguousarray(sections[name]).data)
+        # Spare capacity reads back as zeros (sparse on most filesystems)
+        f.truncate(offset)
+
+    atomic_write(path, write)
+    return len(ids)
+
+
+def load_matrix(path, keys, neutral, record_type):
+    """Map a profile matrix file. Returns (ProfileMatrix, wal_seq)."""
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    magic, version, n_cols, n_rows, capacity, seq = _HEAD.unpack_from(raw)
+    if magic != MAGIC or version != VERSION or n_cols != len(keys):
+        raise ValueError(f"{path} is not a {len(keys)}-column profile matrix (v{VERSION})")
+    mapped = np.memmap(path, dtype=np.uint8, mode='c')
+    arrays = {}
+    for i, (name, dtype) in enumerate(SECTIONS):
+        start, length = _SECTION.unpack_from(raw, _HEAD.size + i * _SECTION.size)
+        arrays[name] = mapped[start:start + length].view(dtype)
+
+    ids = StringTable(arrays['id_offsets'], arrays['id_blob'])
+    matrix = arrays['matrix'].reshape(capacity, n_cols)
+    store = ProfileMatrix.from_arrays(keys, neutral, record_type, matrix, n_rows,
+                                      ids, PlaceIndex(arrays['id_hash'], ids))
+    return store, seq
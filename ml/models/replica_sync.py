@@ -0,0 +1,318 @@
+# =============================================================
+# Replica Sync — merge bandit evidence across ML replicas
+# =============================================================
+#
+# Behind a load balancer every replica only sees its own share of the
+# feedback, so each one learns from a fraction of the traffic. Shipping
+# whole bandit states around doesn't work either: two states can't be
+# merged without knowing which evidence they already share.
+#
+# Instead, each arm's evidence is kept as grow-only counters (a G-counter
+# CRDT), one pair per replica:
+#
+#     counts[replica]["place_id|bucket"] = [successes, failures]
+#
+# A replica only ever increments its OWN pair. Merging takes the
+# element-wise MAX per (replica, arm), so it is commutative, associative
+# and idempotent — deltas can arrive late, twice, or in any order and
+# every replica still ends at the same totals:
+#
+#     alpha = 1 + Σ_replicas successes      beta = 1 + Σ_replicas failures
+#
+# A delta is just this replica's pair for the arms that changed since the
+# last export — never the full state. DirectorySync exchanges deltas
+# through a shared directory (NFS mount, synced volume, or a local dir as
+# a stand-in):
+#
+#     <ML_SYNC_DIR>/<replica_id>/000000000042.json   ← written by that replica only
+#
+# Notes:
+#   - Discounted mode (ML_BANDIT_HALF_LIFE_HOURS) decays remote evidence
+#     from when it was merged, so replicas agree only approximately there.
+#   - Evidence gathered before sync was enabled stays local.
+
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+from models.wal import atomic_write
+
+# Shared directory for delta files (unset = no sync)
+SYNC_DIR = os.getenv('ML_SYNC_DIR')
+# This replica's name in the counters; must be unique and stable across restarts
+REPLICA_ID = os.getenv('ML_REPLICA_ID') or socket.gethostname()
+SYNC_INTERVAL_SECONDS = float(os.getenv('ML_SYNC_SECONDS', 10))
+# Once this many of our delta files pile up, replace them with one full file
+SYNC_KEEP_FILES = int(os.getenv('ML_SYNC_KEEP_FILES', 64))
+
+
+def merge_counters(a, b):
+    """
+    Merge two {replica: {arm: [successes, failures]}} counter sets (element-wise max).
+
+    >>> a = {'r1': {'p|morning_food': [3, 1]}}
+    >>> b = {'r1': {'p|morning_food': [2, 4]}, 'r2': {'p|morning_food': [1, 0]}}
+    >>> merge_counters(a, b) == merge_counters(b, a)
+    True
+    >>> merge_counters(a, b)
+    {'r1': {'p|morning_food': [3, 4]}, 'r2': {'p|morning_food': [1, 0]}}
+    >>> merge_counters(merge_counters(a, b), b) == merge_counters(a, b)
+    True
+    """
+    merged = {replica: {arm: list(pair) for arm, pair in arms.items()} for replica, arms in a.items()}
+    for replica, arms in b.items():
+        mine = merged.setdefault(replica, {})
+        for arm, (s, f) in arms.items():
+            old = mine.get(arm, (0, 0))
+            mine[arm] = [max(old[0], s), max(old[1], f)]
+    return merged
+
+
+def totals(counters):
+    """
+    {arm: [successes, failures]} summed over replicas — the evidence behind the posterior.
+
+    >>> totals({'r1': {'p|night_food': [3, 1]}, 'r2': {'p|night_food': [1, 2]}})
+    {'p|night_food': [4, 3]}
+    """
+    summed = {}
+    for arms in counters.values():
+        for arm, (s, f) in arms.items():
+            pair = summed.setdefault(arm, [0, 0])
+            pair[0] += s
+            pair[1] += f
+    return summed
+
+
+class ReplicaCounters:
+    """
+    Per-replica grow-only success/failure counters for every arm.
+
+    The bandit records its own feedback here and asks merge() which
+    remote increments to fold into its arms.
+
+    >>> r1, r2 = ReplicaCounters('r1'), ReplicaCounters('r2')
+    >>> r1.record(['p|morning_food', 'p|morning_food'], [1, 0])
+    >>> r2.record(['p|morning_food'], [1])
+    >>> d1, d2 = r1.delta(), r2.delta()
+    >>> r1.merge(d2), r2.merge(d1)
+    ([('p|morning_food', 1, 0)], [('p|morning_food', 1, 1)])
+    >>> r1.merge(d2)                        # already seen: nothing to apply
+    []
+    >>> totals(r1.counts) == totals(r2.counts) == {'p|morning_food': [2, 1]}
+    True
+    """
+
+    def __init__(self, replica_id):
+        self.replica_id = replica_id
+        self.counts = {replica_id: {}}
+        # Our pairs as of the last export (in memory: after a restart the
+        # first delta re-sends everything, which merging ignores anyway)
+        self._exported = {}
+
+    def copy(self):
+        copied = ReplicaCounters(self.replica_id)
+        copied.counts = merge_counters(self.counts, {})
+        return copied
+
+    @property
+    def own(self):
+        return self.counts[self.replica_id]
+
+    def add(self, arm, reward, count=1, replica=None):
+        """Add `count` successes (reward 1) or failures to one replica's pair."""
+        pair = self.counts.setdefault(replica or self.replica_id, {}).setdefault(arm, [0, 0])
+        pair[0 if reward == 1 else 1] += count
+
+    def record(self, arms, rewards):
+        """Count this replica's own feedback."""
+        for arm, reward in zip(arms, rewards):
+            self.add(arm, reward)
+
+    def replay(self, records):
+        """Rebuild counts from bandit log records (see ContextualThompsonSampling.merge_delta)."""
+        for record in records:
+            count = record[4] if len(record) > 4 else 1
+            replica = record[5] if len(record) > 5 else None
+            self.add(f"{record[0]}|{record[1]}", record[2], count, replica)
+
+    # =============================================================
+    # Deltas
+    # =============================================================
+
+    def delta(self, full=False):
+        """Our pairs that changed since the last mark_exported() (all of them if full)."""
+        arms = {arm: list(pair) for arm, pair in self.own.items()
+                if full or self._exported.get(arm) != pair}
+        return {'replica': self.replica_id, 'time': round(time.time(), 3), 'arms': arms}
+
+    def mark_exported(self, delta):
+        for arm, pair in delta['arms'].items():
+            self._exported[arm] = list(pair)
+
+    def merge(self, delta):
+        """
+        Fold in a remote delta. Returns [(arm, new_successes, new_failures)]
+        — what the posterior still has to absorb. Our own pairs are never
+        taken from a delta: this replica is the only writer of them.
+        """
+        replica = delta['replica']
+        if replica == self.replica_id:
+            return []
+        mine = self.counts.setdefault(replica, {})
+        increments = []
+        for arm, (s, f) in delta['arms'].items():
+            old = mine.get(arm, (0, 0))
+            ds, df = max(s - old[0], 0), max(f - old[1], 0)
+            if ds or df:
+                mine[arm] = [old[0] + ds, old[1] + df]
+                increments.append((arm, ds, df))
+        return increments
+
+    # =============================================================
+    # Persistence (written alongside each bandit snapshot)
+    # =============================================================
+
+    def save(self, path, seq):
+        data = {'replica': self.replica_id, 'seq': seq, 'counts': self.counts}
+        atomic_write(path, lambda f: f.write(json.dumps(data, separators=(',', ':')).encode()))
+
+    def load(self, path):
+        """Load counts saved with save(); returns the log seq they cover (0 if none)."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r') as f:
+            data = json.load(f)
+        self.counts = data['counts']
+        self.counts.setdefault(self.replica_id, {})
+        return data['seq']
+
+    def stats(self):
+        return {
+            'replica': self.replica_id,
+            'replicas': len(self.counts),
+            'own_arms': len(self.own),
+            'pending_export': sum(1 for arm, pair in self.own.items() if self._exported.get(arm) != pair),
+        }
+
+
+# =============================================================
+# Periodic exchange through a shared directory
+# =============================================================
+
+class DirectorySync:
+    """
+    Every `interval` seconds: write our delta to <directory>/<replica>/,
+    then merge every delta file from other replicas we haven't read yet.
+    """
+
+    def __init__(self, bandit, directory=None, interval=None, keep_files=None):
+        self.bandit = bandit
+        self.directory = directory or SYNC_DIR
+        self.interval = SYNC_INTERVAL_SECONDS if interval is None else interval
+        self.keep_files = keep_files or SYNC_KEEP_FILES
+        self.replica_id = bandit.replicas.replica_id
+        self.own_dir = os.path.join(self.directory, self.replica_id)
+        os.makedirs(self.own_dir, exist_ok=True)
+        files = self._files(self.own_dir)
+        self._next_seq = self._seq(files[-1]) + 1 if files else 1
+        # Last file read per remote replica
+        self._seen = {}
+        self.rounds = 0
+        self.merged_arms = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _files(directory):
+        return sorted(glob.glob(os.path.join(glob.escape(directory), '[0-9]*.json')))
+
+    @staticmethod
+    def _seq(path):
+        return int(os.path.basename(path).split('.')[0])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='replica-sync', daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"[WARN] Replica sync failed: {e}")
+
+    def sync_once(self):
+        """One exchange: export, then merge. Returns the number of arms merged."""
+        with self._lock:
+            self._export()
+            merged = self._merge()
+            self.rounds += 1
+            self.merged_arms += merged
+            return merged
+
+    def _write(self, delta):
+        path = os.path.join(self.own_dir, f"{self._next_seq:012d}.json")
+        atomic_write(path, lambda f: f.write(json.dumps(delta, separators=(',', ':')).encode()))
+        self._next_seq += 1
+        return path
+
+    def _export(self):
+        delta = self.bandit.export_delta()
+        if delta['arms']:
+            self._write(delta)
+            self.bandit.replicas.mark_exported(delta)
+
+        files = self._files(self.own_dir)
+        if len(files) > self.keep_files:
+            # Our full counters supersede every older delta of ours
+            latest = self._write(self.bandit.export_delta(full=True))
+            for path in files:
+                if path != latest:
+                    os.remove(path)
+
+    def _merge(self):
+        merged = 0
+        for replica_dir in sorted(glob.glob(os.path.join(glob.escape(self.directory), '*', ''))):
+            replica = os.path.basename(os.path.dirname(replica_dir))
+            if replica == self.replica_id:
+                continue
+            seen = self._seen.get(replica, 0)
+            for path in self._files(replica_dir):
+                seq = self._seq(path)
+                if seq <= seen:
+                    continue
+                try:
+                    with open(path, 'r') as f:
+                        delta = json.load(f)
+                except FileNotFoundError:
+                    # Pruned under us; the full file that replaced it is next
+                    continue
+                merged += self.bandit.merge_delta(delta)
+                self._seen[replica] = seen = seq
+        return merged
+
+    def close(self):
+        """Stop the loop and push a final delta (called on shutdown)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        try:
+            with self._lock:
+                self._export()
+        except Exception as e:
+            print(f"[WARN] Final replica sync failed: {e}")
+
+    def stats(self):
+        return {
+            **self.bandit.replicas.stats(),
+            'directory': self.directory,
+            'rounds': self.rounds,
+            'merged_arms': self.merged_arms,
+            'peers_seen': len(self._seen),
+        }
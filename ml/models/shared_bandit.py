@@ -0,0 +1,504 @@
+# =============================================================
+# Shared Bandit — one posterior for every uvicorn worker
+# =============================================================
+#
+# With `uvicorn --workers N`, every worker imports routes.py and gets
+# its OWN ContextualThompsonSampling: each learns from whatever 1/N of
+# the feedback it happens to receive, and they all rewrite the same
+# state files. This mode puts the arms in one POSIX shared-memory
+# segment that every worker maps:
+#
+#   header   magic, capacity, count, attached-process count, ready flag
+#   hashes   uint64[capacity]     0 = empty slot
+#   keys     S128[capacity]       "place_id|bucket"
+#   alpha, beta, touched  float64[capacity]
+#
+# It's a fixed-capacity open-addressing table (linear probing), keyed by
+# a 64-bit blake2b of "place_id|bucket". Lookups are lock-free and
+# vectorized over the candidate list; a slot is published by writing its
+# hash LAST, so a reader never sees a half-written key.
+#
+# Locking (fcntl byte-range locks on one lock file — they work across
+# processes, and are released by the kernel if a worker dies):
+#   byte 0         insert lock: claiming new slots, attach/detach; the
+#                  creator holds it until the table is seeded from disk
+#   bytes 1..64    count stripes: slot % 64 → stripe, held while
+#                  alpha/beta/touched of that slot are read-modify-written
+#   byte 100       snapshot writer: whoever holds it persists the table
+#   byte 101       attached: every attached worker holds a SHARED lock
+#
+# Seeding: the worker that creates the segment keeps the insert lock
+# until it has copied the snapshot (+ WAL) in, then sets the header's
+# ready flag. Attaching workers block on that lock, so none of them
+# samples from (or updates) a half-seeded table. A segment found without
+# the ready flag lost its creator mid-seed: the attacher re-seeds it.
+#
+# Persistence: the worker that wins the writer lock snapshots the table
+# to the normal binary snapshot every ML_SHARED_SNAPSHOT_SECONDS and on
+# shutdown. There is no per-update log in this mode — a hard crash of
+# the whole service can lose up to one interval of feedback.
+#
+# The last worker to close() unlinks the segment. "Last" is decided by
+# the attached lock (an exclusive lock on it succeeds only when no other
+# worker holds its shared one), not by the header's attached count — a
+# worker that was killed never decrements the count. If the service
+# dies without shutting down, the segment outlives it and the next
+# start re-attaches to it (its contents are at least as new as the
+# snapshot) and resets the stale count.
+#
+# User profiles are NOT in shared memory: this mode needs the sqlite
+# profile backend, which every worker can write (see user_profile.py).
+#
+# Eviction isn't supported (slots are never freed); size the table with
+# ML_SHARED_ARMS_CAPACITY.
+#
+# Enable with ML_SHARED_STATE=1 and run e.g. `uvicorn app:app --workers 4`.
+
+import collections
+import contextlib
+import fcntl
+import hashlib
+import os
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from models.arm_store import ArmStore, PRIOR_ALPHA, PRIOR_BETA, TIME_PERIODS, time_period, decay_factor
+from models.thompson import ContextualThompsonSampling, _count
+
+SHARED_NAME = os.getenv('ML_SHARED_STATE_NAME', 'sorcerer_bandit')
+CAPACITY = int(os.getenv('ML_SHARED_ARMS_CAPACITY', 1 << 18))
+SNAPSHOT_SECONDS = float(os.getenv('ML_SHARED_SNAPSHOT_SECONDS', 30))
+
+MAGIC = 0x53484152_4D53_0002
+KEY_BYTES = 128
+N_STRIPES = 64
+INSERT_LOCK = 0
+WRITER_LOCK = 100
+ATTACH_LOCK = 101
+# Refuse new arms past this load factor (linear probing degrades)
+MAX_LOAD = 0.9
+
+# Tables attached per segment name in THIS process (see _alone)
+_local_tables = collections.Counter()
+
+_HEADER = struct.Struct('<QQQQQ')
+HEADER_SIZE = 64
+
+
+def arm_hash(key):
+    """64-bit hash of an encoded "place_id|bucket" key; never 0 (0 marks empty)."""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') | 1
+
+
+def _layout(capacity):
+    """Byte offset of each array in the segment, and the total size."""
+    offsets, offset = {}, HEADER_SIZE
+    for name, itemsize in (('hashes', 8), ('alpha', 8), ('beta', 8), ('touched', 8), ('keys', KEY_BYTES)):
+        offsets[name] = offset
+        offset += itemsize * capacity
+    return offsets, offset
+
+
+class SharedArmTable:
+    """Fixed-capacity arm hash table in shared memory (see module header)."""
+
+    def __init__(self, name=SHARED_NAME, capacity=CAPACITY, lock_dir='/tmp'):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.name = name
+        self._lock_fd = os.open(os.path.join(lock_dir, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        self.is_writer = False
+
+        # Held until mark_ready() if this process has to seed the table
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, INSERT_LOCK)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_layout(capacity)[1])
+            self.created = True
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.created = False
+        # Workers come and go independently — don't let Python's
+        # resource tracker unlink the segment when THIS process exits
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        buf = self.shm.buf
+        magic, cap, _, attached, ready = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            attached = 0
+        elif attached and self._alone():
+            # Left by workers that died without close()
+            print(f"[WARN] Shared arms '{name}': resetting {attached} stale attached worker(s)")
+            attached = 0
+        if self.created or magic != MAGIC or not ready:
+            # New, foreign, or its creator died before seeding it: start over
+            cap = capacity if self.created or magic != MAGIC else cap
+            _HEADER.pack_into(buf, 0, MAGIC, cap, 0, 0, 0)
+            self.created = True
+        self.capacity = cap
+        self.mask = cap - 1
+        offsets, _ = _layout(cap)
+        self.hashes = np.ndarray(cap, np.uint64, buf, offsets['hashes'])
+        self.alpha = np.ndarray(cap, np.float64, buf, offsets['alpha'])
+        self.beta = np.ndarray(cap, np.float64, buf, offsets['beta'])
+        self.touched = np.ndarray(cap, np.float64, buf, offsets['touched'])
+        self.keys = np.ndarray(cap, f'S{KEY_BYTES}', buf, offsets['keys'])
+        if self.created:
+            self.hashes[:] = 0
+        self._set_header(attached=attached + 1)
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_SH, 1, ATTACH_LOCK)
+        _local_tables[name] += 1
+        self._seeding = self.created
+        if not self._seeding:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, INSERT_LOCK)
+
+    def mark_ready(self):
+        """Creator only: the table is seeded — let other workers attach."""
+        if self._seeding:
+            self._set_header(ready=1)
+            self._seeding = False
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, INSERT_LOCK)
+
+    # =============================================================
+    # Header / locks
+    # =============================================================
+
+    def _header(self):
+        return _HEADER.unpack_from(self.shm.buf, 0)
+
+    def _set_header(self, count=None, attached=None, ready=None):
+        magic, cap, old_count, old_attached, old_ready = self._header()
+        _HEADER.pack_into(self.shm.buf, 0, magic, cap,
+                          old_count if count is None else count,
+                          old_attached if attached is None else attached,
+                          old_ready if ready is None else ready)
+
+    def __len__(self):
+        return self._header()[2]
+
+    class _Locked:
+        def __init__(self, fd, byte):
+            self.fd, self.byte = fd, byte
+
+        def __enter__(self):
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.byte)
+
+        def __exit__(self, *exc):
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.byte)
+
+    def _alone(self):
+        """
+        True if nothing else is attached: no other table in this process
+        (a process's own fcntl locks never conflict with each other), and
+        no other process holding the attached lock. Caller holds the
+        insert lock, and this table is not counted in _local_tables.
+        """
+        if _local_tables[self.name]:
+            return False
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, ATTACH_LOCK)
+        except OSError:
+            return False
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, ATTACH_LOCK)
+        return True
+
+    def _locked(self, byte):
+        if byte == INSERT_LOCK and self._seeding:
+            # Already held since __init__ (fcntl locks don't nest: an inner
+            # unlock would release it before seeding is done)
+            return contextlib.nullcontext()
+        return self._Locked(self._lock_fd, byte)
+
+    def try_become_writer(self):
+        """Non-blocking: take the snapshot-writer lock if no other worker holds it."""
+        if not self.is_writer:
+            try:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, WRITER_LOCK)
+                self.is_writer = True
+            except OSError:
+                pass
+        return self.is_writer
+
+    # =============================================================
+    # Lookup / insert
+    # =============================================================
+
+    @staticmethod
+    def encode(keys):
+        encoded = [k.encode() for k in keys]
+        too_long = [k for k in encoded if len(k) > KEY_BYTES]
+        if too_long:
+            raise ValueError(f"arm key longer than {KEY_BYTES} bytes: {too_long[0][:40]!r}...")
+        return encoded
+
+    def lookup(self, keys):
+        """Slot for each "place_id|bucket" key; -1 where the arm doesn't exist. Lock-free."""
+        encoded = self.encode(keys)
+        hashes = np.fromiter((arm_hash(k) for k in encoded), dtype=np.uint64, count=len(encoded))
+        wanted = np.array(encoded, dtype=f'S{KEY_BYTES}')
+        result = np.full(len(encoded), -1, dtype=np.int64)
+        slots = (hashes & np.uint64(self.mask)).astype(np.int64)
+        pending = np.arange(len(encoded))
+        # Probe every unresolved key one step at a time, all keys at once
+        for _ in range(self.capacity):
+            if not len(pending):
+                break
+            at = slots[pending]
+            found = self.hashes[at]
+            hit = (found == hashes[pending]) & (self.keys[at] == wanted[pending])
+            result[pending[hit]] = at[hit]
+            pending = pending[~(hit | (found == 0))]
+            slots[pending] = (slots[pending] + 1) & self.mask
+        return result
+
+    def get_or_create(self, keys, now):
+        """Slot for each key, claiming prior slots for new arms (under the insert lock)."""
+        slots = self.lookup(keys)
+        missing = np.flatnonzero(slots < 0)
+        if not len(missing):
+            return slots
+        with self._locked(INSERT_LOCK):
+            # Another worker may have inserted some of them meanwhile
+            slots[missing] = self.lookup([keys[i] for i in missing])
+            count = len(self)
+            for i in np.flatnonzero(slots < 0).tolist():
+                if count + 1 > self.capacity * MAX_LOAD:
+                    raise RuntimeError(f"shared arm table full ({count} arms); "
+                                       f"raise ML_SHARED_ARMS_CAPACITY")
+                key = keys[i].encode()
+                h = arm_hash(key)
+                slot = h & self.mask
+                while self.hashes[slot] != 0:
+                    if self.hashes[slot] == h and self.keys[slot] == key:
+                        break
+                    slot = (slot + 1) & self.mask
+                else:
+                    self.keys[slot] = key
+                    self.alpha[slot] = PRIOR_ALPHA
+                    self.beta[slot] = PRIOR_BETA
+                    self.touched[slot] = now
+                    self.hashes[slot] = h   # publish last
+                    count += 1
+                slots[i] = slot
+            self._set_header(count=count)
+        return slots
+
+    # =============================================================
+    # Reads / updates
+    # =============================================================
+
+    def params(self, slots, now=None, half_life=None):
+        """(alpha, beta) per slot, prior where slot == -1, decayed to `now` if discounting."""
+        alpha = np.full(len(slots), PRIOR_ALPHA)
+        beta = np.full(len(slots), PRIOR_BETA)
+        mask = slots >= 0
+        known = slots[mask]
+        alpha[mask] = self.alpha[known]
+        beta[mask] = self.beta[known]
+        if half_life and len(known):
+            f = decay_factor(self.touched[known], now, half_life)
+            alpha[mask] = PRIOR_ALPHA + (alpha[mask] - PRIOR_ALPHA) * f
+            beta[mask] = PRIOR_BETA + (beta[mask] - PRIOR_BETA) * f
+        return alpha, beta
+
+    def apply_rewards(self, keys, rewards, now, half_life=None):
+        """Scatter rewards into their arms, one stripe lock at a time."""
+        slots = self.get_or_create(keys, now)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        stripes = slots % N_STRIPES
+        for stripe in np.unique(stripes).tolist():
+            sel = stripes == stripe
+            rows, r = slots[sel], rewards[sel]
+            with self._locked(1 + stripe):
+                unique = np.unique(rows)
+                if half_life:
+                    alpha, beta = self.params(unique, now, half_life)
+                    self.alpha[unique] = alpha
+                    self.beta[unique] = beta
+                self.touched[unique] = np.maximum(self.touched[unique], now)
+                np.add.at(self.alpha, rows, r)
+                np.add.at(self.beta, rows, 1.0 - r)
+        return slots
+
+    def occupied(self):
+        """Slots holding an arm."""
+        return np.flatnonzero(self.hashes != 0)
+
+    def to_store(self):
+        """Copy the table into a regular ArmStore (for snapshots)."""
+        slots = self.occupied()
+        place_ids, buckets = [], []
+        for key in self.keys[slots].tolist():
+            place_id, bucket = key.decode().split('|', 1)
+            place_ids.append(place_id)
+            buckets.append(bucket)
+        store = ArmStore(capacity=max(len(slots), 16))
+        store.add_arms(place_ids, buckets, self.alpha[slots], self.beta[slots], self.touched[slots])
+        return store
+
+    def close(self):
+        """Detach; the last worker out removes the segment."""
+        self.mark_ready()
+        with self._locked(INSERT_LOCK):
+            attached = max(self._header()[3] - 1, 0)
+            self._set_header(attached=attached)
+            self.hashes = self.alpha = self.beta = self.touched = self.keys = None
+            self.shm.close()
+            _local_tables[self.name] -= 1
+            if not _local_tables[self.name]:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, ATTACH_LOCK)
+            if self._alone():
+                # unlink() unregisters from the tracker; register first to match
+                resource_tracker.register(self.shm._name, 'shared_memory')
+                self.shm.unlink()
+        os.close(self._lock_fd)
+
+
+class SharedContextualThompsonSampling(ContextualThompsonSampling):
+    """
+    ContextualThompsonSampling whose arms live in a SharedArmTable, so
+    every worker process samples from and updates the same posterior.
+
+    Same public API. The first worker to create the segment seeds it
+    from the on-disk snapshot (+ any WAL left by single-process mode)
+    before any other worker can attach.
+    """
+
+    def __init__(self, persist_path=None, seed=None, half_life_hours=None,
+                 name=SHARED_NAME, capacity=CAPACITY, lock_dir='/tmp'):
+        self.table = SharedArmTable(name, capacity, lock_dir)
+        # Seeds self.store from disk (base _load_state) — copied into the
+        # table below if this worker created it, then dropped
+        super().__init__(persist_path, seed, half_life_hours, max_arms=0)
+        self.store = None
+        self._snapshot_thread = threading.Thread(
+            target=self._snapshot_loop, name='shared-bandit-snapshot', daemon=True)
+        self._snapshot_thread.start()
+
+    def __len__(self):
+        return len(self.table)
+
+    def _keys(self, place_ids, categories, hour):
+        period = TIME_PERIODS[time_period(hour)]
+        return [f"{pid}|{period}_{cat}" for pid, cat in zip(place_ids, categories)]
+
+    def sample_scores(self, place_ids, categories, hour):
+        """Same as the base class, drawn from the shared table (lookups never insert)."""
+        place_ids = list(place_ids)
+        slots = self.table.lookup(self._keys(place_ids, categories, hour))
+        alpha, beta = self.table.params(slots, time.time(), self.half_life)
+        with self._lock:
+            draws = self._rng.beta(alpha, beta)
+        return dict(zip(place_ids, draws.tolist()))
+
+    def update(self, place_id, category, hour, reward):
+        self.update_many([place_id], [category], [hour], [reward])
+
+    def update_many(self, place_ids, categories, hours, rewards):
+        if not len(place_ids):
+            return 0
+        keys = [f"{pid}|{self._get_context_bucket(h, c)}"
+                for pid, c, h in zip(place_ids, categories, hours)]
+        rewards = [1 if r == 1 else 0 for r in rewards]
+        with self._lock:
+            slots = self.table.apply_rewards(keys, rewards, time.time(), self.half_life)
+        return len(np.unique(slots))
+
+    def explain(self, place_id, category, hour):
+        bucket = self._get_context_bucket(hour, category)
+        slots = self.table.lookup([f"{place_id}|{bucket}"])
+        alpha, beta = self.table.params(slots, time.time(), self.half_life)
+        return self._explanation(bucket, _count(alpha[0]), _count(beta[0]))
+
+    def get_all_stats(self):
+        slots = self.table.occupied()
+        keys = [k.decode().split('|', 1) for k in self.table.keys[slots].tolist()]
+        alphas, betas = self.table.params(slots, time.time(), self.half_life)
+        return self._stats_table(keys, alphas, betas)
+
+    # Paged stats: the base class drives these over table slots instead of rows
+
+    def _scan_end(self):
+        return self.table.capacity
+
+    def _scan_window(self, lo, hi, place_ids, bucket, min_observations):
+        slots = lo + np.flatnonzero(self.table.hashes[lo:hi] != 0)
+        names = self._arm_names(slots)
+        if place_ids is not None or bucket is not None:
+            wanted = None if place_ids is None else set(place_ids)
+            keep = [(wanted is None or pid in wanted) and (bucket is None or b == bucket)
+                    for pid, b in names]
+            slots = slots[np.asarray(keep, dtype=bool)]
+            names = [name for name, k in zip(names, keep) if k]
+        alpha, beta = self.table.params(slots, time.time(), self.half_life)
+        groups = np.array([pid for pid, _ in names], dtype=object)
+        if min_observations:
+            keep = alpha + beta - 2 >= min_observations
+            slots, groups, alpha, beta = slots[keep], groups[keep], alpha[keep], beta[keep]
+        return slots, groups, alpha, beta
+
+    def _arm_names(self, slots):
+        return [tuple(k.decode().split('|', 1)) for k in self.table.keys[slots].tolist()]
+
+    def _place_name(self, group):
+        return group
+
+    def evict(self, now=None):
+        """Not supported: shared slots are never freed (see module header)."""
+        return 0
+
+    def store_stats(self):
+        return {
+            'arms': len(self.table),
+            'capacity': self.table.capacity,
+            'array_bytes': self.table.shm.size,
+            'half_life_hours': self.half_life / 3600 if self.half_life else None,
+            'shared_segment': self.table.name,
+            'snapshot_writer': self.table.is_writer,
+        }
+
+    # =============================================================
+    # Persistence — one elected writer snapshots the shared table
+    # =============================================================
+
+    def _load_state(self):
+        if not self.table.created:
+            print(f"[OK] Attached to shared Thompson arms '{self.table.name}' ({len(self.table)} arms)")
+            return
+        try:
+            super()._load_state()
+            keys = [f"{pid}|{bucket}" for pid, bucket, _, _ in self.store.items()]
+            if keys:
+                now = time.time()
+                slots = self.table.get_or_create(keys, now)
+                n = len(self.store)
+                self.table.alpha[slots] = self.store.alpha[:n]
+                self.table.beta[slots] = self.store.beta[:n]
+                self.table.touched[slots] = self.store.touched[:n]
+                print(f"[OK] Seeded shared Thompson arms '{self.table.name}' with {n} arms")
+        finally:
+            # Attaching workers have been waiting on the insert lock
+            self.table.mark_ready()
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(SNAPSHOT_SECONDS):
+            if self.table.try_become_writer():
+                self._save_state()
+
+    def _save_state(self):
+        """Snapshot the shared table (and retire any single-process WAL it covers)."""
+        try:
+            seq = self.wal.rotate()
+            self.wal.compact(seq, lambda path: self._write_snapshot(path, self.table.to_store(), seq),
+                             background=False)
+        except Exception as e:
+            print(f"[WARN] Failed to save shared Thompson state: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self.table.try_become_writer():
+            self._save_state()
+        self.table.close()
@@ -0,0 +1,87 @@
+# =============================================================
+# Telemetry — in-process data-quality counters
+# =============================================================
+#
+# Scoring used to print one "[WARN] ... defaulting to ..." line per
+# activity missing a critical field. Under real traffic that floods
+# stdout and puts synchronous I/O inside the scoring loop.
+#
+# Instead we count: one counter per (field, source), where source is
+# the entry point that saw the data ('recommend', 'train', ...). The
+# counters are exposed through /api/metrics, so a data-quality
+# regression (e.g. the server stops sending ratings) shows up as a
+# climbing counter instead of a wall of log lines.
+#
+# Optional sampled logging: at most one summary line per (field,
+# source) every `log_interval` seconds, with one example place id.
+
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Field → the default extract_features falls back to (for log lines)
+CRITICAL_FIELDS = {
+    'rating': '3.0',
+    'userRatingsTotal': '100',
+    'category': 'entertainment',
+}
+
+
+class MissingFieldCounters:
+    """Thread-safe counters of defaulted fields, keyed by (field, source)."""
+
+    def __init__(self, log_interval=60.0):
+        # <= 0 disables logging entirely
+        self.log_interval = log_interval
+        self._counts = defaultdict(int)       # (field, source) → total
+        self._unlogged = defaultdict(int)     # (field, source) → since last log line
+        self._last_log = {}                   # (field, source) → monotonic time
+        self._lock = threading.Lock()
+
+    def record_activities(self, activities, source):
+        """Count every critical field missing from a batch of activities."""
+        for field in CRITICAL_FIELDS:
+            missing = [a for a in activities if field not in a]
+            if missing:
+                self.record(field, source, len(missing), missing[0].get('id', '?'))
+
+    def record(self, field, source, count=1, example_id=None):
+        key = (field, source)
+        line = None
+        with self._lock:
+            self._counts[key] += count
+            self._unlogged[key] += count
+            if self.log_interval > 0:
+                now = time.monotonic()
+                last = self._last_log.get(key)
+                if last is None or now - last >= self.log_interval:
+                    line = (f"[WARN] {self._unlogged[key]} activities without {field} "
+                            f"(source={source}, e.g. {example_id}) — defaulting to "
+                            f"{CRITICAL_FIELDS.get(field, 'default')}")
+                    self._last_log[key] = now
+                    self._unlogged[key] = 0
+        # Print outside the lock — I/O never blocks other scorers
+        if line:
+            print(line)
+
+    def snapshot(self):
+        """{field: {source: count}} — for /api/metrics."""
+        with self._lock:
+            items = list(self._counts.items())
+        result = defaultdict(dict)
+        for (field, source), count in items:
+            result[field][source] = count
+        return dict(result)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._unlogged.clear()
+            self._last_log.clear()
+
+
+# Process-wide registry used by LightGBMRecommender
+missing_fields = MissingFieldCounters(
+    log_interval=float(os.getenv('ML_MISSING_FIELD_LOG_SECONDS', 60)),
+)
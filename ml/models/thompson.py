@@ -25,10 +25,42 @@
 import numpy as np
 import json
 import os
+import threading
+import time
 from collections import defaultdict
 
+from models.arm_snapshot import convert_json, load_json, load_snapshot, write_snapshot
+from models.arm_store import ArmStore, TIME_PERIODS, time_period
+from models.replica_sync import ReplicaCounters
+from models.topk import top_k_indices
+from models.wal import WriteAheadLog, atomic_write
+
 # Default persistence path (relative to ml/ root)
-_DEFAULT_STATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'thompson_state.json')
+_DEFAULT_STATE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'thompson_state.bin')
+
+# Discounted mode: evidence halves every HALF_LIFE_HOURS (0 = never forget)
+HALF_LIFE_HOURS = float(os.getenv('ML_BANDIT_HALF_LIFE_HOURS', 0))
+# Memory cap: keep at most this many arms, evicting the least evidence (0 = no cap)
+MAX_ARMS = int(os.getenv('ML_BANDIT_MAX_ARMS', 0))
+# Background eviction pass: how often, and below how many (decayed)
+# observations an arm counts as back at the prior
+EVICT_INTERVAL_SECONDS = float(os.getenv('ML_BANDIT_EVICT_SECONDS', 600))
+EVICT_MIN_EVIDENCE = float(os.getenv('ML_BANDIT_EVICT_EVIDENCE', 0.05))
+# Stats reads scan the arm arrays this many rows per lock hold
+STATS_CHUNK = 65_536
+
+
+def _count(value):
+    """Arm counts are stored as floats (decayed ones aren't whole); show whole counts as ints."""
+    value = round(float(value), 3)
+    return int(value) if value.is_integer() else value
+
+
+def _top_n(scores, n):
+    """[(place_id, score)] for the n best sampled scores, best first."""
+    ids = list(scores)
+    values = np.fromiter(scores.values(), dtype=np.float64, count=len(ids))
+    return [(ids[i], float(values[i])) for i in top_k_indices(values, n).tolist()]
 
 
 class ThompsonSamplingRecommender:
@@ -64,9 +96,7 @@ class ThompsonSamplingRecommender:
 
     def recommend_top_n(self, place_ids, n=5):
         """Sample all arms, return top N by sampled score."""
-        scores = self.sample_scores(place_ids)
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked[:n]
+        return _top_n(self.sample_scores(place_ids), n)
 
     def update(self, place_id, reward):
         """
@@ -119,32 +149,57 @@ class ContextualThompsonSampling:
 
     This means "Cafe X in the morning" and "Cafe X at night" are
     independent arms with independent beliefs. Context-specific learning.
+
+    Arms live in an ArmStore (parallel NumPy arrays, see arm_store.py),
+    so a whole candidate list is sampled with one Generator.beta call.
+
+    Discounted mode (half_life_hours > 0): tastes and places change, so
+    old evidence fades back toward Beta(1, 1) — a like from last month
+    counts for less than a like from today. Decay is lazy (computed from
+    each arm's last-update time when it's read or updated), and a
+    background pass evicts arms that have decayed back to the prior, or
+    the weakest arms once there are more than max_arms.
+
+    Replicated mode (replica_id set): every arm's evidence is also kept
+    as per-replica grow-only counters, so replicas behind a load
+    balancer can swap deltas and converge (see replica_sync.py).
     """
 
-    def __init__(self, persist_path=None):
-        # Key: (place_id, context_bucket) → {'alpha': int, 'beta': int}
-        self.arms = {}
+    def __init__(self, persist_path=None, seed=None, half_life_hours=None, max_arms=None,
+                 replica_id=None):
+        self.store = ArmStore()
         self.persist_path = persist_path or _DEFAULT_STATE_PATH
+        self._rng = np.random.default_rng(seed)
+        hours = HALF_LIFE_HOURS if half_life_hours is None else half_life_hours
+        self.half_life = hours * 3600 if hours > 0 else None
+        self.max_arms = MAX_ARMS if max_arms is None else max_arms
+        self.evicted = 0
+        self.replicas = ReplicaCounters(replica_id) if replica_id else None
+        # Arms are read by scoring threads and written by the state thread
+        self._lock = threading.RLock()
+        # Updates append to this log; snapshots are written in the background
+        self.wal = WriteAheadLog(self.persist_path)
         self._load_state()
 
+        self._stop = threading.Event()
+        if self.half_life or self.max_arms:
+            threading.Thread(target=self._eviction_loop, name='bandit-eviction',
+                             daemon=True).start()
+
+    def __len__(self):
+        return len(self.store)
+
     def _get_context_bucket(self, hour, category):
         """
         Discretize context into time_period × category buckets.
         4 time periods × 4 categories = 16 possible buckets.
         """
-        if 6 <= hour < 11:     time_bucket = 'morning'
-        elif 11 <= hour < 17:  time_bucket = 'afternoon'
-        elif 17 <= hour < 21:  time_bucket = 'evening'
-        else:                  time_bucket = 'night'
-
-        return f"{time_bucket}_{category}"
+        return f"{TIME_PERIODS[time_period(hour)]}_{category}"
 
     def _get_arm(self, place_id, context_bucket):
-        """Get or create the Beta distribution for this (place, context)."""
-        key = (place_id, context_bucket)
-        if key not in self.arms:
-            self.arms[key] = {'alpha': 1, 'beta': 1}
-        return self.arms[key]
+        """Get or create the arm row for this (place, context)."""
+        bucket_id = self.store.bucket_id(context_bucket)
+        return int(self.store.get_or_create([place_id], [bucket_id])[0])
 
     def sample_scores(self, place_ids, categories, hour):
         """
@@ -153,19 +208,23 @@ class ContextualThompsonSampling:
         Each place is scored using the Beta distribution for its
         specific (place, context_bucket) — so the same cafe gets
         different exploration behavior at 8am vs 10pm.
+
+        All candidates are drawn in ONE vectorized Generator.beta call.
+        Read-only: places with no arm in this context are drawn from the
+        Beta(1, 1) prior without creating one — only update() adds arms.
         """
-        scores = {}
-        for pid, cat in zip(place_ids, categories):
-            bucket = self._get_context_bucket(hour, cat)
-            arm = self._get_arm(pid, bucket)
-            scores[pid] = float(np.random.beta(arm['alpha'], arm['beta']))
-        return scores
+        place_ids = list(place_ids)
+        with self._lock:
+            bucket_ids = self.store.bucket_ids(hour, list(categories), create=False)
+            rows = self.store.lookup(place_ids, bucket_ids)
+            alpha, beta = self.store.params(rows, time.time(), self.half_life)
+            # Generator isn't thread-safe; draw while holding the lock
+            draws = self._rng.beta(alpha, beta)
+        return dict(zip(place_ids, draws.tolist()))
 
     def recommend_top_n(self, place_ids, categories, hour, n=5):
         """Recommend top N places for current context."""
-        scores = self.sample_scores(place_ids, categories, hour)
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked[:n]
+        return _top_n(self.sample_scores(place_ids, categories, hour), n)
 
     def update(self, place_id, category, hour, reward):
         """
@@ -175,15 +234,80 @@ class ContextualThompsonSampling:
         (cafe_id, morning_food) arm — it does NOT affect
         the same cafe's evening score. Context-specific learning.
         """
+        # The snapshot stores place ids as strings (ints etc. too)
+        place_id = str(place_id)
         bucket = self._get_context_bucket(hour, category)
-        arm = self._get_arm(place_id, bucket)
+        now = time.time()
+        with self._lock:
+            row = self._get_arm(place_id, bucket)
+            # Discounted mode: fold in the decay since the last update first
+            self.store.touch([row], now, self.half_life)
+
+            if reward == 1:
+                self.store.alpha[row] += 1
+            else:
+                self.store.beta[row] += 1
+
+            self._log_updates([[place_id, bucket, 1 if reward == 1 else 0, round(now, 3)]])
+            if self.replicas is not None:
+                self.replicas.add(f"{place_id}|{bucket}", reward)
+
+    def update_many(self, place_ids, categories, hours, rewards):
+        """
+        Apply a batch of feedback events at once.
 
-        if reward == 1:
-            arm['alpha'] += 1
-        else:
-            arm['beta'] += 1
+        Same result as calling update() per event, but the arm counts are
+        applied with one np.add.at scatter (repeat events on the same arm
+        accumulate) and the whole batch is one write to the log.
+        Returns the number of distinct arms touched.
+        """
+        if not len(place_ids):
+            return 0
+        place_ids = [str(p) for p in place_ids]
+        buckets = [self._get_context_bucket(h, c) for h, c in zip(hours, categories)]
+        rewards = [1 if r == 1 else 0 for r in rewards]
+        now = time.time()
+        stamp = round(now, 3)
+        with self._lock:
+            rows = self.store.apply_rewards(place_ids, buckets, rewards, now, self.half_life)
+            self._log_updates([[p, b, r, stamp] for p, b, r in zip(place_ids, buckets, rewards)])
+            if self.replicas is not None:
+                self.replicas.record([f"{p}|{b}" for p, b in zip(place_ids, buckets)], rewards)
+        return len(np.unique(rows))
+
+    # =============================================================
+    # Replica deltas — converge with other replicas (replica_sync.py)
+    # =============================================================
+
+    def export_delta(self, full=False):
+        """This replica's counters for the arms that changed since the last export."""
+        with self._lock:
+            return self.replicas.delta(full)
 
-        self._save_state()
+    def merge_delta(self, delta):
+        """
+        Fold another replica's delta into the arms. Idempotent: evidence
+        already merged is skipped. Returns the number of arms that changed.
+
+        The increments go through the log as counted records tagged with
+        the source replica, so a restart rebuilds arms and counters alike.
+        """
+        now = time.time()
+        stamp = round(now, 3)
+        with self._lock:
+            increments = self.replicas.merge(delta)
+            if not increments:
+                return 0
+            records = []
+            for arm, successes, failures in increments:
+                place_id, bucket = str(arm).split('|', 1)
+                for reward, count in ((1, successes), (0, failures)):
+                    if count:
+                        records.append([place_id, bucket, reward, stamp, count, delta['replica']])
+            place_ids, buckets, rewards, _, counts, _ = zip(*records)
+            self.store.apply_rewards(place_ids, buckets, rewards, now, self.half_life, counts)
+            self._log_updates(records)
+        return len(increments)
 
     def explain(self, place_id, category, hour):
         """
@@ -192,9 +316,16 @@ class ContextualThompsonSampling:
         Shows why this place was scored the way it was in this context.
         """
         bucket = self._get_context_bucket(hour, category)
-        arm = self._get_arm(place_id, bucket)
-        mean = arm['alpha'] / (arm['alpha'] + arm['beta'])
-        obs = arm['alpha'] + arm['beta'] - 2
+        with self._lock:
+            bucket_id = self.store.bucket_index.get(bucket, -1)
+            rows = self.store.lookup([place_id], [bucket_id])
+            alpha, beta = self.store.params(rows, time.time(), self.half_life)
+        return self._explanation(bucket, _count(alpha[0]), _count(beta[0]))
+
+    @staticmethod
+    def _explanation(bucket, alpha, beta):
+        mean = alpha / (alpha + beta)
+        obs = alpha + beta - 2
 
         return {
             'context': bucket,
@@ -202,7 +333,7 @@ class ContextualThompsonSampling:
             'expected_quality': round(mean, 3),
             'uncertainty': 'high' if obs < 5 else 'medium' if obs < 20 else 'low',
             'explanation': (
-                f"In '{bucket}' context: {arm['alpha']-1} likes, {arm['beta']-1} skips. "
+                f"In '{bucket}' context: {alpha-1} likes, {beta-1} skips. "
                 + ("Still exploring (few observations)." if obs < 5
                    else "Good confidence in this score.")
             )
@@ -210,52 +341,318 @@ class ContextualThompsonSampling:
 
     def get_all_stats(self):
         """Get stats for all (place, context) pairs — for demo."""
+        with self._lock:
+            keys = [(pid, bucket) for pid, bucket, _, _ in self.store.items()]
+            alphas, betas = self.store.params(np.arange(len(keys)), time.time(), self.half_life)
+        return self._stats_table(keys, alphas, betas)
+
+    @staticmethod
+    def _stats_table(keys, alphas, betas):
+        """{"place_id|bucket": stats} for (place_id, bucket) keys and their counts."""
         stats = {}
-        for (pid, bucket), arm in self.arms.items():
-            mean = arm['alpha'] / (arm['alpha'] + arm['beta'])
-            obs = arm['alpha'] + arm['beta'] - 2
+        for (pid, bucket), alpha, beta in zip(keys, alphas.tolist(), betas.tolist()):
+            alpha, beta = _count(alpha), _count(beta)
+            mean = alpha / (alpha + beta)
+            obs = alpha + beta - 2
             key = f"{pid}|{bucket}"
             stats[key] = {
                 'place_id': pid,
                 'context': bucket,
-                'alpha': arm['alpha'],
-                'beta': arm['beta'],
+                'alpha': alpha,
+                'beta': beta,
                 'expected_value': round(mean, 3),
                 'observations': obs,
             }
         return stats
 
+    # =============================================================
+    # Paged stats — /api/thompson/stats without building every arm
+    # =============================================================
+    #
+    # get_all_stats() builds a dict per arm in one go. These scan the
+    # arm arrays in STATS_CHUNK-row windows (filters are vectorized over
+    # views, nothing copies the table) and only format the arms that
+    # make it onto the page. The lock is held per window, not per read.
+    #
+    # The cursor is an arm row: an eviction pass between two pages
+    # renumbers rows, so a page may then repeat or skip a few arms.
+
+    def stats_page(self, cursor=0, limit=100, place_ids=None, bucket=None, min_observations=0):
+        """
+        Up to `limit` arm stats from row `cursor` on, matching the filters.
+        Returns ({"place_id|bucket": stats}, next_cursor or None at the end).
+        """
+        arms, pos = {}, cursor
+        while True:
+            with self._lock:
+                end = self._scan_end()
+                if pos >= end:
+                    return arms, None
+                hi = min(pos + STATS_CHUNK, end)
+                found, _, alpha, beta = self._scan_window(pos, hi, place_ids, bucket, min_observations)
+                take = found[:limit - len(arms)]
+                arms.update(self._stats_table(self._arm_names(take), alpha[:len(take)], beta[:len(take)]))
+            if len(take) < len(found):
+                return arms, int(take[-1]) + 1
+            pos = hi
+            if len(arms) >= limit:
+                return arms, pos
+
+    def stats_by_place(self, cursor=0, limit=100, place_ids=None, bucket=None, min_observations=0):
+        """
+        Matching arms summed per place, most observed first. `cursor` is
+        an offset into that ordering. Returns ([place stats], next_cursor).
+        """
+        keys, arms, likes, skips = [], [], [], []
+        pos = 0
+        while True:
+            with self._lock:
+                end = self._scan_end()
+                if pos >= end:
+                    break
+                hi = min(pos + STATS_CHUNK, end)
+                _, groups, alpha, beta = self._scan_window(pos, hi, place_ids, bucket, min_observations)
+            pos = hi
+            if len(groups):
+                uniq, inverse = np.unique(groups, return_inverse=True)
+                keys.append(uniq)
+                arms.append(np.bincount(inverse))
+                likes.append(np.bincount(inverse, alpha - 1.0))
+                skips.append(np.bincount(inverse, beta - 1.0))
+        if not keys:
+            return [], None
+
+        # Places spanning several windows: fold their partial sums together
+        uniq, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        arms = np.bincount(inverse, np.concatenate(arms))
+        likes = np.bincount(inverse, np.concatenate(likes))
+        skips = np.bincount(inverse, np.concatenate(skips))
+        obs = likes + skips
+        order = np.argsort(-obs, kind='stable')[cursor:cursor + limit]
+
+        places = []
+        for i in order.tolist():
+            like, skip = _count(likes[i]), _count(skips[i])
+            places.append({
+                'place_id': self._place_name(uniq[i]),
+                'arms': int(arms[i]),
+                'likes': like,
+                'skips': skip,
+                'observations': _count(obs[i]),
+                'expected_value': round((like + 1) / (like + skip + 2), 3),
+            })
+        nxt = cursor + len(order)
+        return places, (nxt if nxt < len(uniq) else None)
+
+    def _scan_end(self):
+        return len(self.store)
+
+    def _scan_window(self, lo, hi, place_ids, bucket, min_observations):
+        """
+        Matching arms among rows [lo, hi): (rows, place rows, alpha, beta),
+        counts decayed to now. Caller holds _lock.
+        """
+        store = self.store
+        mask = np.ones(hi - lo, dtype=bool)
+        if bucket is not None:
+            mask &= store.arm_bucket[lo:hi] == store.bucket_index.get(bucket, -1)
+        if place_ids is not None:
+            mask &= np.isin(store.arm_place[lo:hi], store.place_rows(place_ids))
+        rows = lo + np.flatnonzero(mask)
+        alpha, beta = store.params(rows, time.time(), self.half_life)
+        if min_observations:
+            keep = alpha + beta - 2 >= min_observations
+            rows, alpha, beta = rows[keep], alpha[keep], beta[keep]
+        return rows, store.arm_place[rows], alpha, beta
+
+    def _arm_names(self, rows):
+        return [self.store.arm_key(row) for row in rows.tolist()]
+
+    def _place_name(self, group):
+        return self.store.place_ids[int(group)]
+
+    # =============================================================
+    # Eviction — bounded memory for discounted / capped bandits
+    # =============================================================
+
+    def _eviction_loop(self):
+        while not self._stop.wait(EVICT_INTERVAL_SECONDS):
+            try:
+                self.evict()
+            except Exception as e:
+                print(f"[WARN] Thompson eviction pass failed: {e}")
+
+    def evict(self, now=None):
+        """
+        Drop arms whose (decayed) evidence is back at the prior, then the
+        weakest arms beyond max_arms. Returns how many arms were evicted.
+
+        Vectorized over the arm arrays, so the lock is held for a few ms
+        even at 1M arms. The result is snapshotted right away so a
+        restart doesn't resurrect evicted arms from the log.
+        """
+        now = time.time() if now is None else now
+        self.wal.wait()
+        with self._lock:
+            evidence = self.store.evidence(now, self.half_life)
+            keep = evidence >= EVICT_MIN_EVIDENCE if self.half_life else np.ones(len(evidence), bool)
+            kept = np.flatnonzero(keep)
+            if self.max_arms and len(kept) > self.max_arms:
+                strongest = np.argpartition(-evidence[kept], self.max_arms - 1)[:self.max_arms]
+                keep = np.zeros(len(evidence), bool)
+                keep[kept[strongest]] = True
+            evicted = self.store.evict(keep)
+            if not evicted:
+                return 0
+            self.evicted += evicted
+            left = len(self.store)
+        # Started under the lock, so no log compaction can begin in between.
+        # One already running predates the eviction: wait for it, then retry.
+        while True:
+            with self._lock:
+                seq = self.wal.rotate()
+                if self.wal.compact(seq, self._snapshot_writer(seq)):
+                    break
+            self.wal.wait()
+        print(f"[INFO] Evicted {evicted} Thompson arms ({left} left)")
+        return evicted
+
+    def store_stats(self):
+        """Arm count, memory, and discount/eviction settings — for /metrics."""
+        with self._lock:
+            return {
+                'arms': len(self.store),
+                'array_bytes': self.store.nbytes(),
+                'half_life_hours': self.half_life / 3600 if self.half_life else None,
+                'max_arms': self.max_arms or None,
+                'evicted': self.evicted,
+            }
+
     # =============================================================
     # Persistence — survive restarts without Redis/Postgres
     # =============================================================
+    #
+    # Each update appends one [seq, place_id, bucket, reward, time] line to a
+    # write-ahead log (see wal.py) — O(1), independent of arm count. The
+    # snapshot is rewritten in the background once the log grows past
+    # ML_WAL_MAX_BYTES or ML_WAL_MAX_SECONDS. Startup = snapshot + replay
+    # of the log records it doesn't cover yet.
+    #
+    # Snapshots are binary (arm_snapshot.py) and memory-mapped on load,
+    # so startup doesn't grow with arm count. A persist_path ending in
+    # .json keeps the readable JSON format instead.
+    #
+    # Replicated mode also writes <persist_path>.replicas.json (the
+    # per-replica counters) with every snapshot, just before it.
+
+    def _log_updates(self, records):
+        """Append updates to the WAL; kick off compaction when due. Caller holds _lock."""
+        try:
+            self.wal.append_many(records)
+            if self.wal.compaction_due():
+                seq = self.wal.rotate()
+                self.wal.compact(seq, self._snapshot_writer(seq))
+        except Exception as e:
+            print(f"[WARN] Failed to log Thompson update: {e}")
 
     def _save_state(self):
-        """Write bandit arms to JSON. Called after every update."""
+        """Write a full snapshot now (blocking) and drop the log it covers."""
         try:
-            os.makedirs(os.path.dirname(self.persist_path), exist_ok=True)
-            # Serialize tuple keys as "place_id|bucket" strings
-            serializable = {}
-            for (pid, bucket), arm in self.arms.items():
-                serializable[f"{pid}|{bucket}"] = arm
-            with open(self.persist_path, 'w') as f:
-                json.dump(serializable, f, indent=2)
+            self.wal.wait()
+            with self._lock:
+                seq = self.wal.rotate()
+                write = self._snapshot_writer(seq)
+            self.wal.compact(seq, write, background=False)
         except Exception as e:
             print(f"[WARN] Failed to save Thompson state: {e}")
 
+    def close(self):
+        """Flush everything into the snapshot (called on shutdown)."""
+        self._stop.set()
+        if self.wal.seq:
+            self._save_state()
+        self.wal.close()
+
+    def _snapshot_writer(self, seq):
+        """
+        Freeze the state covering log records up to `seq` (caller holds
+        _lock). Returns the write callback for wal.compact().
+        """
+        frozen = self.store.copy()
+        counters = self.replicas.copy() if self.replicas is not None else None
+
+        def write(path):
+            if counters is not None:
+                # Counters land first: if we crash before the arms do, both
+                # are still rebuilt from the (not yet deleted) log
+                counters.save(self._replicas_path, seq)
+            self._write_snapshot(path, frozen, seq)
+        return write
+
+    @property
+    def _replicas_path(self):
+        return f"{self.persist_path}.replicas.json"
+
+    @staticmethod
+    def _write_snapshot(path, store, seq):
+        """Atomically write `store` as the snapshot covering log records up to `seq`."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Arms still at the prior carry no information — leave them out
+        keep = store.updated_mask()
+        if not keep.all():
+            store = store.compacted(keep)
+        if not path.endswith('.json'):
+            write_snapshot(path, store, seq)
+            return
+        # Serialize tuple keys as "place_id|bucket" strings
+        serializable = {f"{pid}|{bucket}": {'alpha': _count(a), 'beta': _count(b), 'touched': t}
+                        for (pid, bucket, a, b), t in zip(store.items(), store.touched.tolist())}
+        # No "|" in the key, so loaders that predate the WAL skip it
+        serializable['_wal_seq'] = seq
+        atomic_write(path, lambda f: f.write(json.dumps(serializable).encode()))
+
     def _load_state(self):
-        """Load bandit arms from JSON on startup. No file = fresh start."""
-        if not os.path.exists(self.persist_path):
+        """Map/load the snapshot, then replay the WAL on top. No files = fresh start."""
+        binary = not self.persist_path.endswith('.json')
+        legacy_path = os.path.splitext(self.persist_path)[0] + '.json'
+        if binary and not os.path.exists(self.persist_path) and os.path.exists(legacy_path):
+            try:
+                converted = convert_json(legacy_path, self.persist_path, self.half_life)
+                print(f"[OK] Converted {len(converted)} Thompson arms from {legacy_path}")
+            except Exception as e:
+                print(f"[WARN] Failed to convert {legacy_path}: {e}")
+
+        seq = 0
+        if os.path.exists(self.persist_path):
+            try:
+                self.store, seq = (load_snapshot if binary else load_json)(self.persist_path)
+                print(f"[OK] Loaded {len(self.store)} Thompson arms from disk")
+            except Exception as e:
+                print(f"[WARN] Failed to load Thompson state: {e} — starting fresh")
+        elif not self.wal.segments():
             print("[INFO] No Thompson state file — starting fresh")
             return
+
+        if self.replicas is None:
+            records = self.wal.replay(after_seq=seq)
+        else:
+            records = self._replay_replicas(seq)
+        try:
+            replayed = self.store.replay(records, self.half_life)
+            if replayed:
+                print(f"[OK] Replayed {replayed} Thompson updates from the log")
+        except Exception as e:
+            print(f"[WARN] Failed to replay Thompson log: {e}")
+
+    def _replay_replicas(self, seq):
+        """Load the replica counters; yield the log records the arm snapshot (at `seq`) misses."""
         try:
-            with open(self.persist_path, 'r') as f:
-                data = json.load(f)
-            count = 0
-            for key, arm in data.items():
-                parts = key.split('|', 1)
-                if len(parts) == 2:
-                    self.arms[(parts[0], parts[1])] = arm
-                    count += 1
-            print(f"[OK] Loaded {count} Thompson arms from disk")
+            counters_seq = self.replicas.load(self._replicas_path)
         except Exception as e:
-            print(f"[WARN] Failed to load Thompson state: {e} — starting fresh")
+            print(f"[WARN] Failed to load replica counters: {e} — rebuilding from the log")
+            counters_seq = 0
+        for record_seq, record in self.wal.replay(after_seq=min(seq, counters_seq), with_seq=True):
+            if record_seq > counters_seq:
+                self.replicas.replay([record])
+            if record_seq > seq:
+                yield record
@@ -0,0 +1,98 @@
+# =============================================================
+# Top-K Selection — only sort what the client will actually see
+# =============================================================
+#
+# The client shows a handful of suggestions, but we score hundreds or
+# thousands of candidates. Fully sorting every candidate is O(n log n)
+# over Python dicts; selecting the k best is O(n) with argpartition
+# plus an O(k log k) sort of just the winners.
+#
+# Two tools:
+#   top_k_indices  — one score array already in memory
+#   StreamingTopK  — candidates arrive in chunks too large to score at once
+
+import heapq
+import itertools
+
+import numpy as np
+
+
+def top_k_indices(scores, k=None):
+    """
+    Indices of the k highest scores, best first.
+
+    k=None (or k >= len(scores)) sorts everything. Ties keep input order,
+    like a stable sort(reverse=True).
+
+    >>> top_k_indices(np.array([0.2, 0.9, 0.5, 0.7]), 2).tolist()
+    [1, 3]
+    >>> top_k_indices(np.array([0.75, 0.75, 0.25, 0.75, 0.75]), 3).tolist()
+    [0, 1, 3]
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    n = len(scores)
+    if k is None or k >= n:
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # argpartition finds the k-th best score, but among candidates tied
+    # with it keeps an arbitrary subset — take every one of them instead.
+    # Partitioning -scores puts NaN last, as the full argsort does; a NaN
+    # k-th score means fewer than k real scores, so sort them all.
+    kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    if np.isnan(kth):
+        return np.argsort(-scores, kind='stable')[:k]
+    winners = np.flatnonzero(scores >= kth)
+    # Sort just the winners: score descending, then index ascending
+    order = np.lexsort((winners, -scores[winners]))
+    return winners[order[:k]]
+
+
+class StreamingTopK:
+    """
+    Running top-k over a stream of (score, item) chunks.
+
+    Keeps a k-sized min-heap; each chunk is first filtered against the
+    current k-th best score with NumPy, so only real contenders ever
+    touch the heap.
+
+    >>> top = StreamingTopK(2)
+    >>> top.push_many([0.1, 0.8], ['a', 'b'])
+    >>> top.push_many([0.5, 0.9], ['c', 'd'])
+    >>> top.result()
+    [(0.9, 'd'), (0.8, 'b')]
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []              # (score, -seq, item); smallest on top
+        self._seq = itertools.count()
+
+    def push_many(self, scores, items):
+        """Offer a chunk of candidates (scores aligned with items)."""
+        if self.k <= 0:
+            return
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(self._heap) >= self.k:
+            # Strictly better than the current k-th best, or it can't enter
+            contenders = np.flatnonzero(scores > self._heap[0][0])
+        else:
+            contenders = np.arange(len(scores))
+
+        for i in contenders.tolist():
+            # -seq makes earlier items win ties, like a stable sort
+            entry = (float(scores[i]), -next(self._seq), items[i])
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif entry[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, entry)
+
+    def push(self, score, item):
+        """Offer a single candidate."""
+        self.push_many([score], [item])
+
+    def result(self):
+        """Current top-k as [(score, item)], best first."""
+        ranked = sorted(self._heap, key=lambda e: (e[0], e[1]), reverse=True)
+        return [(score, item) for score, _, item in ranked]
@@ -0,0 +1,199 @@
+# =============================================================
+# Compiled Tree Evaluator — LightGBM ensemble as flat NumPy arrays
+# =============================================================
+#
+# The production ranker is tiny (50 trees, depth 3, 7 leaves), so
+# most of predict_proba's time is wrapper overhead, not tree walking.
+#
+# This module flattens every tree of a trained booster into one set of
+# contiguous node arrays:
+#   feature[i]    — split feature index (leaves: 0)
+#   threshold[i]  — split threshold     (leaves: +inf)
+#   left[i]       — left child node     (leaves: point to themselves)
+#   right[i]      — right child node    (leaves: point to themselves)
+#   value[i]      — leaf value          (internal nodes: 0)
+#
+# Evaluation walks ALL rows through ALL trees at once: a (rows × trees)
+# matrix of node ids advances one level per step. Leaves loop back to
+# themselves, so after max_depth steps every cell sits on its leaf.
+#
+# Only NumPy is needed at serving time — no lightgbm, no sklearn.
+
+import numpy as np
+
+# Missing-value handling, same codes as LightGBM's MissingType enum
+MISSING_NONE = 0
+MISSING_ZERO = 1
+MISSING_NAN = 2
+_MISSING_TYPES = {'None': MISSING_NONE, 'Zero': MISSING_ZERO, 'NaN': MISSING_NAN}
+
+# LightGBM treats |x| <= kZeroThreshold as zero for MissingType::Zero
+_ZERO_THRESHOLD = 1e-35
+
+
+class CompiledForest:
+    """
+    Flat-array binary-classification forest with a predict_proba contract.
+
+    Drop-in for LGBMClassifier inside LightGBMRecommender.score_matrix:
+    predict_proba(X) returns an (n, 2) array of [P(0), P(1)].
+    """
+
+    def __init__(self, feature, threshold, left, right, value,
+                 default_left, missing_type, roots, max_depth, sigmoid=1.0):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.default_left = default_left
+        self.missing_type = missing_type
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.sigmoid = float(sigmoid)
+        self._children = np.column_stack([left, right]).ravel()
+        # Skip the missing-value branch when no split (or input) needs it
+        self._needs_missing = bool(np.any(missing_type != MISSING_NONE))
+
+    # =============================================================
+    # Export from a trained LightGBM model
+    # =============================================================
+
+    @classmethod
+    def from_lgbm(cls, model):
+        """
+        Flatten a trained LGBMClassifier (or raw Booster) into node arrays.
+
+        Only binary objectives with numerical splits are supported —
+        which is what LightGBMRecommender.train produces.
+        """
+        booster = getattr(model, 'booster_', model)
+        dump = booster.dump_model()
+
+        objective = dump.get('objective', '')
+        if not objective.startswith('binary') or dump.get('num_tree_per_iteration', 1) != 1:
+            raise ValueError(f"Unsupported objective for compiled trees: {objective!r}")
+        sigmoid = 1.0
+        for token in objective.split()[1:]:
+            if token.startswith('sigmoid:'):
+                sigmoid = float(token.split(':', 1)[1])
+
+        feature, threshold, left, right, value = [], [], [], [], []
+        default_left, missing_type, roots = [], [], []
+        max_depth = 0
+
+        def add_node(node, depth):
+            nonlocal max_depth
+            idx = len(feature)
+            feature.append(0)
+            threshold.append(np.inf)
+            left.append(idx)
+            right.append(idx)
+            value.append(0.0)
+            default_left.append(True)
+            missing_type.append(MISSING_NONE)
+
+            if 'leaf_value' in node:
+                value[idx] = node['leaf_value']
+                max_depth = max(max_depth, depth)
+                return idx
+
+            if node.get('decision_type', '<=') != '<=':
+                raise ValueError("Categorical splits are not supported by CompiledForest")
+            feature[idx] = node['split_feature']
+            threshold[idx] = node['threshold']
+            default_left[idx] = node.get('default_left', True)
+            missing_type[idx] = _MISSING_TYPES.get(node.get('missing_type', 'None'), MISSING_NONE)
+            left[idx] = add_node(node['left_child'], depth + 1)
+            right[idx] = add_node(node['right_child'], depth + 1)
+            return idx
+
+        for tree in dump['tree_info']:
+            roots.append(add_node(tree['tree_structure'], 0))
+
+        return cls(
+            feature=np.array(feature, dtype=np.int32),
+            threshold=np.array(threshold, dtype=np.float64),
+            left=np.array(left, dtype=np.int32),
+            right=np.array(right, dtype=np.int32),
+            value=np.array(value, dtype=np.float64),
+            default_left=np.array(default_left, dtype=bool),
+            missing_type=np.array(missing_type, dtype=np.int8),
+            roots=np.array(roots, dtype=np.int32),
+            max_depth=max_depth,
+            sigmoid=sigmoid,
+        )
+
+    # =============================================================
+    # Evaluation
+    # =============================================================
+
+    def predict_raw(self, X):
+        """Sum of leaf values over all trees (the booster's raw margin)."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n, n_features = X.shape
+        if n == 0:
+            return np.empty(0, dtype=np.float64)
+
+        flat = X.ravel()
+        # Offset of each row's first feature in the flattened matrix
+        row_base = (np.arange(n, dtype=np.intp) * n_features)[:, None]
+        nodes = np.broadcast_to(self.roots, (n, len(self.roots)))
+        # NaN inputs need the slow path even when every split is MissingType::None
+        needs_missing = self._needs_missing or bool(np.isnan(flat).any())
+
+        for depth in range(self.max_depth):
+            if depth == 0:
+                # Every row starts at the same root: a plain column gather
+                fval = X[:, self.feature[self.roots]]
+                threshold = self.threshold[self.roots]
+            else:
+                fval = flat.take(row_base + self.feature.take(nodes))
+                threshold = self.threshold.take(nodes)
+
+            if needs_missing:
+                missing = self.missing_type.take(nodes)
+                is_nan = np.isnan(fval)
+                # Same order as LightGBM's NumericalDecision
+                fval = np.where(is_nan & (missing != MISSING_NAN), 0.0, fval)
+                use_default = (((missing == MISSING_ZERO) & (np.abs(fval) <= _ZERO_THRESHOLD))
+                               | ((missing == MISSING_NAN) & is_nan))
+                go_left = np.where(use_default, self.default_left.take(nodes), fval <= threshold)
+            else:
+                go_left = fval <= threshold
+
+            # children[2i] = left, children[2i + 1] = right
+            nodes = self._children.take(2 * nodes + ~go_left)
+
+        return self.value.take(nodes).sum(axis=1)
+
+    def predict_proba(self, X):
+        """[P(0), P(1)] per row, matching LGBMClassifier.predict_proba."""
+        p1 = 1.0 / (1.0 + np.exp(-self.sigmoid * self.predict_raw(X)))
+        return np.column_stack([1.0 - p1, p1])
+
+    # =============================================================
+    # Persistence — a single .npz, loadable without lightgbm
+    # =============================================================
+
+    def save(self, path):
+        """Write all node arrays to one .npz file."""
+        np.savez(
+            path,
+            feature=self.feature, threshold=self.threshold,
+            left=self.left, right=self.right, value=self.value,
+            default_left=self.default_left, missing_type=self.missing_type,
+            roots=self.roots, max_depth=self.max_depth, sigmoid=self.sigmoid,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a forest written by save()."""
+        with np.load(path) as data:
+            return cls(
+                feature=data['feature'], threshold=data['threshold'],
+                left=data['left'], right=data['right'], value=data['value'],
+                default_left=data['default_left'], missing_type=data['missing_type'],
+                roots=data['roots'], max_depth=int(data['max_depth']),
+                sigmoid=float(data['sigmoid']),
+            )
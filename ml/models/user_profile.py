@@ -15,15 +15,51 @@ Profile dimensions:
   - price_sensitivity (0-1)     0 = budget, 1 = splurge
   - adventure_level (0-1)       0 = stick to favorites, 1 = try new things
 
-3 seeded personas for demo. Updates persist in-memory
-(Flask runs with use_reloader=False to prevent state loss).
+3 seeded personas for demo. Updates apply in memory; changed profiles
+are flushed to disk in batches (see Persistence below).
+
+ML_PROFILE_BACKEND=matrix keeps profiles in one memory-mapped N×6
+float32 matrix instead (profile_matrix.py) — for millions of users.
+ML_PROFILE_BACKEND=sqlite keeps only recently active users in memory,
+over an on-disk SQLite table (profile_cache.py).
 """
 
-import copy
 import json
 import os
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+
+from models.profile_cache import ProfileCache
+from models.profile_matrix import ProfileMatrix, load_matrix, write_matrix
+from models.wal import WriteAheadLog, atomic_write
+
+# 'json' (dict of records, readable file), 'matrix' (memory-mapped N×6 float32)
+# or 'sqlite' (LRU of hot profiles over a SQLite table)
+PROFILE_BACKEND = os.getenv('ML_PROFILE_BACKEND', 'json')
+_JSON_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'user_profiles.json')
+_PROFILES_PATH = os.path.splitext(_JSON_PATH)[0] + {'matrix': '.bin', 'sqlite': '.db'}.get(PROFILE_BACKEND, '.json')
+# Profiles held in memory by the sqlite backend
+CACHE_SIZE = int(os.getenv('ML_PROFILE_CACHE_SIZE', 100_000))
 
-_PROFILES_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'user_profiles.json')
+# ML_SHARED_STATE=1 runs several uvicorn workers over the same data/ dir
+# (shared_bandit.py). The json and matrix backends keep a private copy
+# per worker, and each worker's log and compaction would rewrite the
+# others' files. SQLite is the one backend every worker can write.
+# The LRU is turned off there: another worker may have updated the row
+# since it was cached. (Two workers updating the same user within one
+# flush interval still race: the later flush wins.)
+SHARED_STATE = os.getenv('ML_SHARED_STATE', '0') == '1'
+if SHARED_STATE:
+    if PROFILE_BACKEND != 'sqlite':
+        raise RuntimeError("ML_SHARED_STATE=1 needs ML_PROFILE_BACKEND=sqlite "
+                           f"(the {PROFILE_BACKEND!r} profile store can't be shared between workers)")
+    CACHE_SIZE = 0
+
+# Flush changed profiles every FLUSH_SECONDS, or as soon as FLUSH_DIRTY are waiting
+FLUSH_SECONDS = float(os.getenv('ML_PROFILE_FLUSH_SECONDS', 2))
+FLUSH_DIRTY = int(os.getenv('ML_PROFILE_FLUSH_DIRTY', 256))
 
 # =============================================================
 # Default profile — neutral preferences (no bias)
@@ -36,6 +72,83 @@ NEUTRAL_PROFILE = {
     'price_sensitivity': 0.5,
     'adventure_level': 0.5,
 }
+PROFILE_KEYS = tuple(NEUTRAL_PROFILE)
+
+
+# =============================================================
+# Profile records — immutable, shared by readers, copy-on-write
+# =============================================================
+#
+# get_profile() used to deepcopy a dict on every call (/recommend calls
+# it per request) so callers couldn't mutate the store by accident. A
+# ProfileRecord can't be mutated at all, so readers just get the stored
+# record — no copy. Writers build a new record and swap it in.
+
+class ProfileRecord(Mapping):
+    """
+    Read-only six-float profile. Reads like the old dict.
+
+    >>> p = ProfileRecord.from_dict({'category_food': 0.8})
+    >>> p['category_food'], p.get('adventure_level')
+    (0.8, 0.5)
+    >>> p['category_food'] = 1.0
+    Traceback (most recent call last):
+    ...
+    TypeError: 'ProfileRecord' object does not support item assignment
+    >>> q = p.replace('category_food', 0.9)
+    >>> p['category_food'], q['category_food'], dict(q) == dict(p, category_food=0.9)
+    (0.8, 0.9, True)
+    """
+    __slots__ = ('_values',)
+    _INDEX = {key: i for i, key in enumerate(PROFILE_KEYS)}
+
+    def __init__(self, values):
+        object.__setattr__(self, '_values', tuple(values))
+
+    @classmethod
+    def from_dict(cls, profile):
+        """Record from a profile dict; missing dimensions are neutral, unknown keys dropped."""
+        if isinstance(profile, cls):
+            return profile
+        return cls(profile.get(key, NEUTRAL_PROFILE[key]) for key in PROFILE_KEYS)
+
+    def __getitem__(self, key):
+        return self._values[self._INDEX[key]]
+
+    def get(self, key, default=None):
+        i = self._INDEX.get(key)
+        return default if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._INDEX
+
+    def __iter__(self):
+        return iter(PROFILE_KEYS)
+
+    def __len__(self):
+        return len(PROFILE_KEYS)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ProfileRecord is immutable — use replace()")
+
+    def __reduce__(self):
+        return ProfileRecord, (self._values,)
+
+    def __repr__(self):
+        return f"ProfileRecord({dict(self)})"
+
+    @property
+    def values_tuple(self):
+        return self._values
+
+    def replace(self, key, value):
+        """New record with one dimension changed."""
+        values = list(self._values)
+        values[self._INDEX[key]] = value
+        return ProfileRecord(values)
+
+
+NEUTRAL = ProfileRecord.from_dict(NEUTRAL_PROFILE)
 
 # =============================================================
 # Seeded personas for demo
@@ -116,52 +229,379 @@ PERSONAS = {
 # =============================================================
 # In-memory profile store (loaded from disk or seeded)
 # =============================================================
-_profiles = {}
+def _new_store():
+    if PROFILE_BACKEND == 'matrix':
+        return ProfileMatrix(PROFILE_KEYS, NEUTRAL.values_tuple, ProfileRecord)
+    if PROFILE_BACKEND == 'sqlite':
+        return ProfileCache(_PROFILES_PATH, PROFILE_KEYS, ProfileRecord, CACHE_SIZE)
+    return {}
+
+_profiles = _new_store()  # user_id → ProfileRecord
+# Profiles are read by scoring threads and written by the state thread
+_lock = threading.RLock()
+# Serializes log appends / snapshots so an older write never lands last
+_io_lock = threading.Lock()
+
+
+# =============================================================
+# Persistence — dirty tracking + write-ahead log
+# =============================================================
+#
+# Rewriting user_profiles.json after every click is O(total users) per
+# event. Instead, updates only mark the user dirty. A background flusher
+# (start_flusher(), run by the app on startup) appends the dirty
+# profiles to a write-ahead log (wal.py) as ONE write of
+# [user_id, profile] lines — cost grows with the number of changed
+# users, not the store. Once the log passes ML_WAL_MAX_BYTES /
+# ML_WAL_MAX_SECONDS, the full JSON file is rewritten in the background
+# (tmp file + fsync + rename) and the log it covers is dropped.
+#
+# Startup = JSON snapshot + replay of newer log lines (a profile record
+# is the whole profile, so the last one wins). A hard crash loses at
+# most the last FLUSH_SECONDS of profile updates; close() flushes
+# everything on shutdown.
+#
+# The sqlite backend keeps the same flush cadence, but a flush writes
+# the cache's unwritten profiles to the database in one transaction —
+# SQLite is both log and snapshot there, so this log stays empty.
+
+_wal = WriteAheadLog(_PROFILES_PATH)
+_dirty = set()
+_flush_wakeup = threading.Event()
+_stopped = threading.Event()
+_flush_stats = {'flushes': 0, 'profiles_written': 0}
+_flusher = None
+
+
+def _mark_dirty(user_ids):
+    """Queue users for the next flush. Caller holds _lock."""
+    _dirty.update(user_ids)
+    if len(_dirty) >= FLUSH_DIRTY:
+        _flush_wakeup.set()
+
+
+def flush():
+    """Append every dirty profile to the log in one write. Returns how many."""
+    if isinstance(_profiles, ProfileCache):
+        return _flush_cache()
+    with _io_lock:
+        with _lock:
+            if not _dirty:
+                return 0
+            records = [[uid, dict(_profiles[uid])] for uid in _dirty if uid in _profiles]
+            _dirty.clear()
+        try:
+            _wal.append_many(records)
+        except Exception as e:
+            print(f"[WARN] Failed to flush profiles: {e}")
+            with _lock:
+                _dirty.update(uid for uid, _ in records)
+            return 0
+        _flush_stats['flushes'] += 1
+        _flush_stats['profiles_written'] += len(records)
+        if _wal.compaction_due():
+            with _lock:
+                seq = _wal.rotate()
+                # Records are immutable: a shallow copy is a consistent snapshot
+                # (the matrix backend copies its rows)
+                snapshot = _profiles.copy()
+            _wal.compact(seq, lambda path: _write_snapshot(path, snapshot, seq))
+    return len(records)
+
+
+def _flush_cache():
+    """sqlite backend: write the cache's unwritten profiles in one transaction."""
+    with _io_lock:
+        with _lock:
+            _dirty.clear()
+        try:
+            written = _profiles.flush()
+        except Exception as e:
+            # Still unwritten in the cache: the next flush retries them
+            print(f"[WARN] Failed to flush profiles: {e}")
+            return 0
+        if written:
+            _flush_stats['flushes'] += 1
+            _flush_stats['profiles_written'] += written
+    return written
+
+
+def _flush_loop():
+    while not _stopped.is_set():
+        _flush_wakeup.wait(FLUSH_SECONDS)
+        _flush_wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"[WARN] Profile flush failed: {e}")
+
+
+def start_flusher():
+    """
+    Start the background flusher (idempotent). Not done at import: the
+    inference pool (api/process_pool.py) must fork from a single-threaded
+    parent, so the app starts this once the workers exist.
+    """
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, name='profile-flush', daemon=True)
+        _flusher.start()
+
+
+def _write_snapshot(path, snapshot, seq):
+    """Atomically write the full profile file covering log records up to `seq`."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(snapshot, ProfileMatrix):
+        write_matrix(path, snapshot, seq)
+        return
+    data = {uid: dict(profile) for uid, profile in snapshot.items()}
+    # Not a user id: the loader pops it
+    data['_wal_seq'] = seq
+    atomic_write(path, lambda f: f.write(json.dumps(data, indent=2).encode()))
+
 
 def _save_profiles():
-    """Write profiles to JSON. Called after every update."""
+    """Write the full profile file now (blocking) and drop the log it covers."""
+    if isinstance(_profiles, ProfileCache):
+        # The database is the snapshot
+        _flush_cache()
+        return
     try:
-        os.makedirs(os.path.dirname(_PROFILES_PATH), exist_ok=True)
-        with open(_PROFILES_PATH, 'w') as f:
-            json.dump(_profiles, f, indent=2)
+        _wal.wait()
+        with _io_lock:
+            with _lock:
+                _dirty.clear()
+                seq = _wal.rotate()
+                snapshot = _profiles.copy()
+            _wal.compact(seq, lambda path: _write_snapshot(path, snapshot, seq), background=False)
     except Exception as e:
         print(f"[WARN] Failed to save profiles: {e}")
 
+
+def close():
+    """Flush everything into the profile file (called on shutdown)."""
+    _stopped.set()
+    _flush_wakeup.set()
+    _save_profiles()
+    _wal.close()
+    if isinstance(_profiles, ProfileCache):
+        _profiles.close()
+
+
+def persistence_stats():
+    """Dirty/flush counters and log state — for /metrics."""
+    with _lock:
+        dirty = len(_dirty)
+        count = len(_profiles)
+    stats = {'profiles': count, 'dirty': dirty, **_flush_stats, 'wal': _wal.stats()}
+    if isinstance(_profiles, ProfileCache):
+        stats['cache'] = _profiles.stats()
+    return stats
+
+
+def _load_json(path):
+    """(profiles, log seq covered) from a JSON profile file."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    seq = data.pop('_wal_seq', 0)
+    return {uid: ProfileRecord.from_dict(p) for uid, p in data.items()}, seq
+
+
+def _convert_json(store):
+    """
+    Fill a matrix / sqlite `store` from user_profiles.json and persist it.
+    Updates still in the JSON file's log are folded in, so the new store
+    starts a fresh log.
+    """
+    profiles, seq = _load_json(_JSON_PATH)
+    for user_id, profile in WriteAheadLog(_JSON_PATH).replay(after_seq=seq):
+        profiles[user_id] = ProfileRecord.from_dict(profile)
+    for user_id, profile in profiles.items():
+        store[user_id] = profile
+    if isinstance(store, ProfileCache):
+        store.flush()
+    else:
+        write_matrix(_PROFILES_PATH, store, seq=0)
+    return store
+
+
 def _load_profiles():
-    """Load profiles from disk. If no file, seed from PERSONAS."""
+    """Load profiles from disk (snapshot + log). If neither exists, seed from PERSONAS."""
     global _profiles
-    if os.path.exists(_PROFILES_PATH):
+    matrix = PROFILE_BACKEND == 'matrix'
+    cache = isinstance(_profiles, ProfileCache)
+    fresh = not os.path.exists(_PROFILES_PATH) if matrix else cache and not _profiles
+    if fresh and os.path.exists(_JSON_PATH):
         try:
-            with open(_PROFILES_PATH, 'r') as f:
-                _profiles = json.load(f)
+            converted = _convert_json(_profiles if cache else _new_store())
+            print(f"[OK] Converted {len(converted)} user profiles from {_JSON_PATH}")
+        except Exception as e:
+            print(f"[WARN] Failed to convert {_JSON_PATH}: {e}")
+    seq = 0
+    if cache:
+        # Nothing to load: misses read through to the database
+        print(f"[OK] Opened {len(_profiles)} user profiles in {_PROFILES_PATH}")
+    elif os.path.exists(_PROFILES_PATH):
+        try:
+            if matrix:
+                _profiles, seq = load_matrix(_PROFILES_PATH, PROFILE_KEYS, NEUTRAL.values_tuple, ProfileRecord)
+            else:
+                _profiles, seq = _load_json(_PROFILES_PATH)
             print(f"[OK] Loaded {len(_profiles)} user profiles from disk")
-            return
         except Exception as e:
             print(f"[WARN] Failed to load profiles: {e} — seeding fresh")
+            _profiles = _new_store()
+    replayed = 0
+    for user_id, profile in _wal.replay(after_seq=seq):
+        _profiles[user_id] = ProfileRecord.from_dict(profile)
+        replayed += 1
+    if replayed:
+        print(f"[OK] Replayed {replayed} profile updates from the log")
+    if _profiles:
+        return
     # No file or load failed — seed from personas
     for user_id, persona in PERSONAS.items():
-        _profiles[user_id] = copy.deepcopy(persona['profile'])
+        _profiles[user_id] = ProfileRecord.from_dict(persona['profile'])
     _save_profiles()
 
 _load_profiles()
 
 
+# =============================================================
+# Batched EMA — exact fold of many rewards over the 0.001 grid
+# =============================================================
+#
+# One EMA step is v → clamp(round(0.9·v + 0.1·target, 3)). Unrounded,
+# k steps have a closed form — v·0.9^k + Σ 0.1·target_j·0.9^(k-j) — but
+# the per-step rounding makes it drift from the stored result (four
+# likes from 0.5: 0.671 step by step, 0.672 closed form).
+#
+# Every stored value is on the 0.001 grid, so one step is instead an
+# exact map on the 1001 grid indices, one table per reward. A run of
+# L equal rewards is that map applied L times; doubling tables
+# (_step_table(r, m) = the map applied 2^m times) apply it in log2(L)
+# lookups. fold_ema() run-length encodes every reward sequence and
+# applies all sequences' runs at once with NumPy fancy indexing.
+# Values off the grid (hand-edited files) take the step-by-step path.
+
+ALPHA = 0.1  # learning rate
+GRID = 1000  # values are rounded to 1/GRID
+_STEP_TABLES = {0: [], 1: []}   # reward → [map applied 2^m times]
+
+
+def _ema_step(value, reward):
+    """
+    One EMA step toward 1 (reward) or 0, rounded to 3 decimals and clamped.
+
+    >>> _ema_step(0.5, 1), _ema_step(0.5, 0)
+    (0.55, 0.45)
+    """
+    target = 1.0 if reward else 0.0
+    value = value * (1 - ALPHA) + target * ALPHA
+    return max(0.0, min(1.0, round(value, 3)))
+
+
+def _step_table(reward, m):
+    """Grid index → grid index after 2^m steps with this reward."""
+    tables = _STEP_TABLES[reward]
+    while len(tables) <= m:
+        if tables:
+            tables.append(tables[-1][tables[-1]])
+        else:
+            # i / GRID is the same float round(value, 3) produces
+            tables.append(np.array([round(_ema_step(i / GRID, reward) * GRID) for i in range(GRID + 1)]))
+    return tables[m]
+
+
+def fold_ema(values, sequences):
+    """
+    Apply each ordered reward sequence to its starting value in one
+    vectorized pass. Same result as _ema_step over each sequence.
+
+    >>> fold_ema([0.5, 0.5, 0.2], [[1, 1, 1, 1], [1, 0, 0], []]).tolist()
+    [0.671, 0.446, 0.2]
+    """
+    values = np.array(values, dtype=np.float64)
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    if not lengths.sum():
+        return values
+    rewards = np.fromiter((1 if r else 0 for seq in sequences for r in seq), dtype=np.int64, count=int(lengths.sum()))
+    group = np.repeat(np.arange(len(values)), lengths)
+
+    # Run-length encode every sequence: (group, reward, length, run number within the group)
+    starts = np.flatnonzero(np.r_[True, (rewards[1:] != rewards[:-1]) | (group[1:] != group[:-1])])
+    run_group, run_reward = group[starts], rewards[starts]
+    run_length = np.diff(np.r_[starts, len(rewards)])
+    first_run = np.r_[0, np.cumsum(np.bincount(run_group, minlength=len(values)))[:-1]]
+    run_number = np.arange(len(starts)) - first_run[run_group]
+
+    state = np.rint(values * GRID)
+    on_grid = (state / GRID == values) & (state >= 0) & (state <= GRID)
+    state = np.where(on_grid, state, 0).astype(np.int64)
+    for j in range(int(run_number.max()) + 1):
+        # The j-th runs of all sequences are independent: apply them together
+        at = run_number == j
+        g, r, length = run_group[at], run_reward[at], run_length[at]
+        for m in range(int(length.max()).bit_length()):
+            bit = (length >> m) & 1 == 1
+            for reward in (0, 1):
+                rows = g[bit & (r == reward)]
+                if len(rows):
+                    state[rows] = _step_table(reward, m)[state[rows]]
+
+    folded = state / GRID
+    for i in np.flatnonzero(~on_grid & (lengths > 0)).tolist():
+        # A Python float: np.float64 rounds differently from round()
+        value = float(values[i])
+        for reward in sequences[i]:
+            value = _ema_step(value, reward)
+        folded[i] = value
+    folded[lengths == 0] = values[lengths == 0]
+    return folded
+
+
 # =============================================================
 # Public API
 # =============================================================
 
+def _user_key(user_id):
+    """Stores key profiles by string id: a numeric userId reads and writes as its str()."""
+    return user_id if not user_id or isinstance(user_id, str) else str(user_id)
+
+
 def get_profile(user_id=None):
     """
     Get a user's profile. Returns neutral if user_id is None or unknown.
 
+    The stored ProfileRecord itself — immutable, so no copy is needed;
+    later updates swap in a new record and leave this one unchanged.
+
     >>> get_profile('alex')['category_food']
     0.8
     >>> get_profile(None)['category_food']
     0.5
     """
-    if not user_id or user_id not in _profiles:
-        return copy.deepcopy(NEUTRAL_PROFILE)
-    return copy.deepcopy(_profiles[user_id])
+    if not user_id:
+        return NEUTRAL
+    # A single dict read is atomic; records are never modified in place
+    return _profiles.get(_user_key(user_id), NEUTRAL)
+
+
+def get_profile_matrix(user_ids):
+    """
+    Profiles of many users as one float32 array [len(user_ids), 6], columns
+    in PROFILE_KEYS order; neutral rows for None/unknown users.
+
+    With the matrix backend this is one fancy-indexing gather — what batch
+    scoring (RFC.predict_score_matrix) feeds on.
+
+    >>> get_profile_matrix(['alex', None]).shape
+    (2, 6)
+    """
+    if isinstance(_profiles, ProfileMatrix):
+        return _profiles.gather([_user_key(user_id) for user_id in user_ids])
+    rows = [get_profile(user_id).values_tuple for user_id in user_ids]
+    return np.array(rows, dtype=np.float32).reshape(len(rows), len(PROFILE_KEYS))
 
 
 def update_profile(user_id, category, reward):
@@ -177,21 +617,58 @@ def update_profile(user_id, category, reward):
     """
     if not user_id:
         return
+    user_id = _user_key(user_id)
 
-    # Create profile if new user
-    if user_id not in _profiles:
-        _profiles[user_id] = copy.deepcopy(NEUTRAL_PROFILE)
+    with _lock:
+        # Create profile if new user
+        profile = _profiles.setdefault(user_id, NEUTRAL)
+        key = f'category_{category}'
+        if key not in profile:
+            return
 
-    profile = _profiles[user_id]
-    key = f'category_{category}'
+        # Copy-on-write so readers holding the old record are unaffected
+        _profiles[user_id] = profile.replace(key, _ema_step(profile[key], reward))
+        _mark_dirty([user_id])
+
+
+def update_profiles(events):
+    """
+    Apply a batch of (user_id, category, reward) feedback events.
+
+    Each (user, category)'s rewards are folded in arrival order into one
+    update (fold_ema), vectorized across every user in the batch — the
+    result matches calling update_profile() per event — and the store is
+    locked once and each user is flushed once.
+    Returns {user_id: updated ProfileRecord} for every user touched.
+
+    >>> sorted(update_profiles([('sam', 'food', 1), ('sam', 'food', 0), (None, 'food', 1)]))
+    ['sam']
+    """
+    by_user = {}
+    sequences = {}      # (user_id, dimension index) → rewards in arrival order
+    columns = {key[len('category_'):]: i for key, i in ProfileRecord._INDEX.items() if key.startswith('category_')}
+    for user_id, category, reward in events:
+        if not user_id:
+            continue
+        user_id = _user_key(user_id)
+        by_user[user_id] = True
+        i = columns.get(category)
+        if i is not None:
+            sequences.setdefault((user_id, i), []).append(reward)
+    if not by_user:
+        return {}
 
-    if key in profile:
-        alpha = 0.1  # learning rate
-        target = 1.0 if reward else 0.0
-        profile[key] = profile[key] * (1 - alpha) + target * alpha
-        # Clamp to 0-1
-        profile[key] = max(0.0, min(1.0, round(profile[key], 3)))
-        _save_profiles()
+    updated = {}
+    with _lock:
+        values = {user_id: list(_profiles.get(user_id, NEUTRAL).values_tuple) for user_id in by_user}
+        folded = fold_ema([values[user_id][i] for user_id, i in sequences], list(sequences.values()))
+        for (user_id, i), value in zip(sequences, folded.tolist()):
+            values[user_id][i] = value
+        for user_id in by_user:
+            # One new record per user per batch
+            _profiles[user_id] = updated[user_id] = ProfileRecord(values[user_id])
+        _mark_dirty(by_user)
+    return updated
 
 
 def get_all_profiles():
@@ -206,10 +683,12 @@ def get_all_profiles():
     """
     result = {}
     for user_id, persona in PERSONAS.items():
+        with _lock:
+            profile = dict(_profiles.get(user_id, NEUTRAL_PROFILE))
         entry = {
             'name': persona['name'],
             'description': persona['description'],
-            'profile': _profiles.get(user_id, copy.deepcopy(NEUTRAL_PROFILE)),
+            'profile': profile,
         }
         if 'location' in persona:
             entry['location'] = persona['location']
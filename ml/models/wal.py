@@ -0,0 +1,216 @@
+# =============================================================
+# Write-Ahead Log — append-only persistence with snapshot compaction
+# =============================================================
+#
+# Rewriting a whole state file after every event costs O(state) per
+# event. Instead:
+#
+#   1. Every mutation is appended to the log as ONE short JSON line:
+#        [seq, ...record]
+#      O(1) per event no matter how big the state is.
+#
+#   2. Once the active log segment passes a size or age threshold, the
+#      owner hands us a frozen copy of its state and we write a SNAPSHOT
+#      in a background thread (tmp file + fsync + rename, so the old
+#      snapshot stays valid until the new one is complete). The snapshot
+#      records the last seq it covers; segments it fully covers are
+#      deleted afterwards.
+#
+#   3. On startup: load snapshot, replay every log record with
+#      seq > snapshot seq. A crash at ANY point leaves a consistent pair:
+#        - mid-append      → torn last line, skipped on replay
+#        - mid-snapshot    → tmp file ignored, old snapshot + all segments
+#        - before cleanup  → already-covered records skipped by seq
+#
+# Log segments live next to the snapshot:
+#     thompson_state.json
+#     thompson_state.json.wal.000000000042   ← first seq in the segment
+#
+# The log only knows about records and seqs; what a record MEANS (and
+# how a snapshot is written) belongs to the owner.
+
+import glob
+import json
+import os
+import threading
+import time
+
+# Compact once the active segment passes either threshold
+DEFAULT_MAX_BYTES = int(os.getenv('ML_WAL_MAX_BYTES', 4 * 1024 * 1024))
+DEFAULT_MAX_SECONDS = float(os.getenv('ML_WAL_MAX_SECONDS', 300))
+# fsync every append (survives power loss, not just process crashes)
+DEFAULT_FSYNC = os.getenv('ML_WAL_FSYNC', '0') == '1'
+
+
+def atomic_write(path, write_fn):
+    """Write via write_fn(file) to a tmp file, fsync, then rename over path."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteAheadLog:
+    """Append-only record log for a snapshot at `snapshot_path`."""
+
+    def __init__(self, snapshot_path, max_bytes=None, max_seconds=None, fsync=None):
+        self.snapshot_path = snapshot_path
+        self.max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_seconds = DEFAULT_MAX_SECONDS if max_seconds is None else max_seconds
+        self.fsync = DEFAULT_FSYNC if fsync is None else fsync
+
+        self.seq = 0
+        self._file = None
+        self._segment_path = None
+        self._segment_bytes = 0
+        self._segment_opened = 0.0
+        self._compacting = threading.Lock()
+        self.compactions = 0
+
+    # =============================================================
+    # Startup
+    # =============================================================
+
+    def segments(self):
+        """Log segment paths, oldest first."""
+        return sorted(glob.glob(f"{glob.escape(self.snapshot_path)}.wal.*"))
+
+    def replay(self, after_seq=0, with_seq=False):
+        """
+        Yield every record with seq > after_seq, oldest first
+        ((seq, record) pairs if with_seq).
+
+        A torn final line (crash mid-append) is skipped. The log then
+        continues numbering after the highest seq seen.
+        """
+        self.seq = after_seq
+        for path in self.segments():
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        seq, *record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if seq > after_seq:
+                        yield (seq, record) if with_seq else record
+                    self.seq = max(self.seq, seq)
+
+    # =============================================================
+    # Appends
+    # =============================================================
+
+    def append(self, record):
+        """Append one record (a JSON-serializable list). Caller serializes appends."""
+        if self._file is None:
+            self._open_segment()
+        self.seq += 1
+        line = json.dumps([self.seq, *record], separators=(',', ':')).encode() + b'\n'
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._segment_bytes += len(line)
+        return self.seq
+
+    def append_many(self, records):
+        """Append a batch of records with a single write (and fsync). Returns the last seq."""
+        if not records:
+            return self.seq
+        if self._file is None:
+            self._open_segment()
+        lines = []
+        for record in records:
+            self.seq += 1
+            lines.append(json.dumps([self.seq, *record], separators=(',', ':')))
+        data = ('\n'.join(lines) + '\n').encode()
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._segment_bytes += len(data)
+        return self.seq
+
+    def _open_segment(self):
+        os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+        self._segment_path = f"{self.snapshot_path}.wal.{self.seq + 1:012d}"
+        self._file = open(self._segment_path, 'ab')
+        if self._file.tell():
+            # Reopening a segment that ended in a torn line: terminate it
+            self._file.write(b'\n')
+        self._segment_bytes = 0
+        self._segment_opened = time.monotonic()
+
+    def compaction_due(self):
+        """True when the active segment passed the size or age threshold."""
+        if self._file is None or self._segment_bytes == 0 or self._compacting.locked():
+            return False
+        return (self._segment_bytes >= self.max_bytes
+                or time.monotonic() - self._segment_opened >= self.max_seconds)
+
+    # =============================================================
+    # Compaction
+    # =============================================================
+
+    def rotate(self):
+        """
+        Close the active segment; the next append starts a new one.
+
+        Call while holding the same lock as append(), together with
+        freezing the state — the returned seq is what that frozen state
+        covers.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self.seq
+
+    def compact(self, seq, write_snapshot, background=True):
+        """
+        Persist a frozen state covering everything up to `seq`.
+
+        write_snapshot(path) must write the snapshot (recording `seq`)
+        atomically, e.g. via atomic_write. Covered segments are deleted
+        once it lands. Returns False if a compaction is already running.
+        """
+        if not self._compacting.acquire(blocking=False):
+            return False
+        if not background:
+            self._run_compaction(seq, write_snapshot)
+            return True
+        threading.Thread(target=self._run_compaction, args=(seq, write_snapshot),
+                         name='wal-compaction', daemon=True).start()
+        return True
+
+    def _run_compaction(self, seq, write_snapshot):
+        try:
+            write_snapshot(self.snapshot_path)
+            # Segments are rotated at `seq`, so any segment starting at or
+            # before it ends at or before it too
+            for path in self.segments():
+                if int(path.rsplit('.', 1)[1]) <= seq:
+                    os.remove(path)
+            self.compactions += 1
+        except Exception as e:
+            print(f"[WARN] Snapshot compaction of {self.snapshot_path} failed: {e}")
+        finally:
+            self._compacting.release()
+
+    def wait(self, timeout=None):
+        """Block until a running compaction finishes."""
+        if self._compacting.acquire(timeout=-1 if timeout is None else timeout):
+            self._compacting.release()
+
+    def close(self):
+        self.wait()
+        self.rotate()
+
+    def stats(self):
+        return {
+            'seq': self.seq,
+            'segments': len(self.segments()),
+            'active_segment_bytes': self._segment_bytes if self._file is not None else 0,
+            'compacting': self._compacting.locked(),
+            'compactions': self.compactions,
+        }
@@ -21,8 +21,9 @@ def main():
     recommender = LightGBMRecommender()
     recommender.train(training_data)
 
-    # Save model
+    # Save model (+ flat-array export for serving without lightgbm)
     recommender.save_model()
+    recommender.save_compiled()
 
     # Quick test
     print("\nQuick test with sample prediction:")